@@ -0,0 +1,90 @@
+# Rarely-used code for main.py, only imported from there in test modes or after fatal error
+# Not loaded on normal boot, to save some time and memory for loading it
+
+import sys, binascii, struct, random, re
+
+
+def export_image_buffers(epd, line_bytes=90):
+	if flush := getattr(sys.stdout, 'flush', None): flush() # not used in mpy atm
+	if epd.export_delta: return export_image_delta(epd, line_bytes)
+	for bt, buff in zip(['BK', 'RD'], [epd.black_buff, epd.red_buff]):
+		sys.stdout.buffer.write(f'\n-epd-:{bt} {epd.w} {epd.h} {len(buff)}\n'.encode())
+		for n in range(0, len(buff), line_bytes):
+			sys.stdout.buffer.write(b'-epd-:')
+			sys.stdout.buffer.write(binascii.b2a_base64(buff[n:n+line_bytes]))
+	sys.stdout.buffer.write(b'\n')
+	if flush := getattr(sys.stdout.buffer, 'flush', None): flush()
+
+def export_image_delta(epd, line_bytes):
+	# "DX <w> <h> <K/D> <seq> <len> <crc32>" line, then base64 lines of payload
+	# Payload: (plane, y0, rows) <BHH header + PackBits-encoded rows, for each dirty run
+	# K - keyframe with all rows, sent every export_keyframes, D - changed rows only
+	rows, wb, out = epd.rows_dirty, epd.w // 8, bytearray()
+	if key := epd.export_n % epd.export_keyframes == 0:
+		for y in range(epd.h): rows[y] = 1
+	y0 = None
+	for y in range(epd.h + 1):
+		if y < epd.h and rows[y]:
+			if y0 is None: y0 = y
+			rows[y] = 0; continue
+		if y0 is None: continue
+		for plane, buff in enumerate([epd.black_buff, epd.red_buff]):
+			out.extend(struct.pack('<BHH', plane, y0, y - y0))
+			packbits(out, memoryview(buff)[y0*wb:y*wb])
+		y0 = None
+	crc = f'{binascii.crc32(out):08x}' if hasattr(binascii, 'crc32') else '-' # optional in mpy
+	sys.stdout.buffer.write(( f'\n-epd-:DX {epd.w} {epd.h} {"K" if key else "D"}'
+		f' {epd.export_n} {len(out)} {crc}\n' ).encode())
+	for n in range(0, len(out), line_bytes):
+		sys.stdout.buffer.write(b'-epd-:')
+		sys.stdout.buffer.write(binascii.b2a_base64(out[n:n+line_bytes]))
+	sys.stdout.buffer.write(b'\n')
+	if flush := getattr(sys.stdout.buffer, 'flush', None): flush()
+	epd.export_n += 1
+
+def packbits(out, bs):
+	# Appends PackBits-RLE-encoded bs to out bytearray
+	# Control byte n: 0-127 - n+1 literal bytes follow, 129-255 - repeat next byte 257-n times
+	i, n = 0, len(bs)
+	while i < n:
+		j = i + 1
+		while j < n and j - i < 128 and bs[j] == bs[i]: j += 1
+		if j - i >= 3: out.append(257 - (j - i)); out.append(bs[i]); i = j; continue
+		j = i + 1
+		while j < n and j - i < 128 and not (
+			j + 2 < n and bs[j] == bs[j+1] and bs[j] == bs[j+2] ): j += 1
+		out.append(j - i - 1); out.extend(bs[i:j]); i = j
+
+
+def co2_log_fake_gen(ts_rtc=None, td=673):
+	values, ts_rtc = list(), ts_rtc or 1725673478
+	for n in range(30):
+		if random.random() > 0.6: ppm = random.randint(400, 900)
+		elif random.random() > 0.4: ppm = random.randint(500, 3000)
+		else: ppm = random.randint(500, 8000)
+		values.append((int(ts_rtc), ppm))
+		ts_rtc -= td
+	return reversed(values)
+
+
+async def main_err_print(epd, fail, x0=0, y0=1, ys=8, export=False):
+	# Traceback is compressed into one long line with alternating colors
+	# Standard "File <name>, line <n>, in" traceback-lines are shortened
+	# If it's still too long, only tail end is printed
+	cw, ch = (epd.w - 2*x0) // 8, (epd.h - 2*y0) // ys
+	hdr = '~ FATAL ERROR ~'[:cw]
+	if (n := cw - len(hdr) - 1) > 0: hdr += ' '*n
+	lines = [hdr]
+	lines.extend( re.sub(r'File "([^"]+)", line (\d+), in ', r'\1:\2: ', s) for s in
+		(re.sub(r'\s+', ' ', s.strip()) for s in re.sub('\n+', '\n', fail).splitlines()) )
+	for bn, buff in enumerate([epd.red, epd.black]):
+		buff.fill(1); fail = list()
+		for ln, line in enumerate(lines):
+			if ln & 1 == bn: line = ' '*len(line)
+			fail.append(line)
+		fail = ' '.join(fail)
+		fail = list(fail[n:n+cw] for n in range(0, len(fail), cw))[-ch:]
+		for line, y in zip(fail, range(y0, epd.h, ys)): buff.text(line, x0, y, 0)
+	epd.dirty()
+	if not export: await epd.display()
+	else: export_image_buffers(epd)
@@ -1,7 +1,7 @@
 #!/usr/bin/env python
 
 import pathlib as pl, contextlib as cl, collections as cs, itertools as it
-import os, sys, io, base64
+import concurrent.futures as cf, os, sys, io, time, base64, hashlib, struct
 
 import PIL.Image # pillow module
 
@@ -22,6 +22,8 @@ def main(args=None):
 		Every line relevant to this script should start with -p/--prefix (e.g. "-epd-:").
 		Data format is "<BK/RD> <w> <h> <len-B>" first line, then base64 bitmap lines.
 		File should have exactly two MONO_HLSB bitmap buffers, black then red.
+		Delta format from test-export-format=delta option ("DX ..." blocks) is also
+			supported, with full frames rebuilt from keyframes and changed rows in-between.
 		"-" can be used to read data from stdin instead, which is the default.'''))
 	parser.add_argument('-o', '--out-png-file', metavar='file', help=dd('''
 		PNG file to produce by combining exported black/red input buffers.
@@ -32,6 +34,37 @@ def main(args=None):
 		Offset/index of image from the -i/--in-b64-file data to convert,
 			using python list-index notation (0 - first, -1 - last, etc).
 		Input can contain multiple images, and by default last one is used.'''))
+	parser.add_argument('-f', '--follow', action='store_true', help=dd('''
+		Keep reading -i/--in-b64-file as it grows, like "tail -f" would,
+			writing new -o/--out-png-file image every time new black/red frame is complete.
+		Last frame already in the file is converted first, unless --follow-new is used.
+		-n/--in-img-num option is ignored in this mode.'''))
+	parser.add_argument('--follow-new', action='store_true',
+		help='Skip existing data in -i/--in-b64-file with -f/--follow option.')
+	parser.add_argument('--follow-interval', type=float, metavar='seconds', default=1.0,
+		help='Interval between checks for new data in -f/--follow mode. Default: %(default)ss')
+	parser.add_argument('-d', '--out-dir', metavar='dir', help=dd('''
+		Convert all frames from -i/--in-b64-file (or -r/--range of them)
+			to numbered PNG files in specified directory, instead of one -o/--out-png-file.
+		Files are named after frame index in the input (e.g. 00123.png),
+			and identical consecutive frames are skipped, so only changes are written.'''))
+	parser.add_argument('-a', '--out-anim', metavar='file', help=dd('''
+		Same as -d/--out-dir, but produce one animated image file with all frames,
+			in GIF format if filename ends with .gif, or animated PNG (APNG) otherwise.'''))
+	parser.add_argument('--anim-delay', metavar='ms', type=int, default=500,
+		help='Delay between frames in -a/--out-anim image. Default: %(default)sms')
+	parser.add_argument('-r', '--range', metavar='[start]:[end]', help=dd('''
+		Range of frames to convert with -d/--out-dir or -a/--out-anim option,
+			using python slice notation, with negative values counted from the end.
+		Examples: 100:200, :10, -r=-50: (with "=" for negative start).
+		Default is to convert all frames.'''))
+	parser.add_argument('-j', '--jobs', metavar='n', type=int, help=dd('''
+		Number of worker processes for -d/--out-dir or -a/--out-anim conversions.
+		Default is to use one per cpu core.'''))
+	parser.add_argument('--bench', metavar='n', type=int, help=dd('''
+		Convert selected image n times via old per-pixel loop and bulk conversion,
+			print average time for each and whether resulting PNG files are identical.
+		Does not produce any output file, exits with non-zero code on PNG mismatch.'''))
 	parser.add_argument('--invert', action='store_true', help=dd('''
 		Do not assume that bitmaps are inverted,
 			which is the default, as bitmaps sent to ePaper screen are inverted.'''))
@@ -51,38 +84,226 @@ def main(args=None):
 			p.rename(path)
 		finally: p.unlink(missing_ok=True)
 
-	def iter_bitmaps(src):
-		buff, pre_n = list(), len(pre := opts.prefix)
-		while line := src.readline():
+	def iter_blocks(src, follow=None):
+		'''Yields (pos, lines) for prefixed blocks, pos=None if src is not seekable.
+			follow=None reads src until EOF, follow=0 does same but only yields complete
+			blocks, and any positive follow value is used as a delay to wait for new data.'''
+		lines, line_tail, pre_n = list(), '', len(pre := opts.prefix)
+		try: pos = src.tell() if src.seekable() else None
+		except OSError: pos = None
+		seekable, pos_block = pos is not None, None
+		while True:
+			if not (line := src.readline()):
+				if not follow: break
+				time.sleep(follow); continue
+			if follow is not None and line[-1] != '\n': # incomplete line
+				line_tail += line; continue
+			if line_tail: line, line_tail = line_tail + line, ''
 			if not (line := line.strip()):
-				if buff: yield buff
-				buff.clear(); continue
-			if line.startswith(pre): buff.append(line[pre_n:])
-		if buff: yield buff
-
-	bitmap_t = cs.namedtuple('Bitmap', 'bt w h buff')
-	def parse_bitmap(lines):
-		bt, (w, h, sz) = (line := lines[0].split())[0], map(int, line[1:])
-		buff = base64.b64decode(''.join(lines[1:]))
-		if (n := len(buff)) != sz: raise ValueError(
-			f'Buffer size mismatch [{bt}]: expected={sz or 0:,d} actual={len(buff):,d}' )
-		if w*h//8 != sz: raise ValueError(
-			f'Buffer dimensions mismatch [{bt}]: sz={sz:,d} actual={(w,h)}' )
-		return bitmap_t(bt, w, h, buff)
-
-	bitmaps = list()
+				if lines: yield pos_block, lines
+				lines = list()
+			elif line.startswith(pre):
+				if not lines and seekable: pos_block = pos
+				lines.append(line[pre_n:])
+			if seekable: pos = src.tell()
+		if lines and follow is None: yield pos_block, lines
+
+	def iter_frames(src, follow=None, dx=None):
+		'''Yields (pos, bk_lines, rd_lines) tuples without decoding any bitmaps.
+			Delta-frames have to be decoded, and are yielded as full-frame lines with pos=None.
+			dx is the delta-frame decoding state, to pass along when resuming from src pos.'''
+		pos = bk = None
+		if dx is None: dx = dict()
+		for pos_block, lines in iter_blocks(src, follow):
+			if (bt := lines[0].split(None, 1)[0]) == 'DX':
+				if frame := delta_frame(lines, dx): yield None, *frame
+			elif bt == 'BK': pos, bk = pos_block, lines
+			elif bt == 'RD' and bk: yield pos, bk, lines; bk = None
+			else: raise ValueError(f'Unexpected bitmap type/order: {bt}')
+
+	def frame_lines(src, pos):
+		src.seek(pos)
+		(_, bk), (_, rd) = it.islice(iter_blocks(src), 2)
+		return bk, rd
+
+	if opts.follow:
+		if not opts.out_png_file or opts.out_png_file == '-':
+			parser.error('-f/--follow mode requires -o/--out-png-file path')
+		def frame_png(frame):
+			with out_func_bin(opts.out_png_file) as out:
+				out(bitmap_png(*parse_frame(*frame[1:]), not opts.invert))
+		with in_file(opts.in_b64_file) as src:
+			if follow := src.seekable() and opts.follow_interval:
+				# Skip to the end of last complete frame, converting that one first
+				frame = pos = None; dx = dict() # delta state continues from last frame
+				for frame in iter_frames(src, 0, dx): pos = src.tell()
+				if frame and not opts.follow_new: frame_png(frame)
+				src.seek(pos or 0)
+			else: dx = None
+			for frame in iter_frames(src, follow, dx): frame_png(frame)
+		return
+
+	if opts.out_dir or opts.out_anim:
+		if opts.out_dir and opts.out_anim:
+			parser.error('Only one of -d/--out-dir or -a/--out-anim options can be used')
+		try: frame_range = slice(*( int(n) if n.strip() else None
+			for n in (opts.range or ':').split(':', 1) ))
+		except ValueError: parser.error(f'Failed to parse -r/--range value: {opts.range!r}')
+		with in_file(opts.in_b64_file) as src:
+			def iter_digests():
+				# Yields (n, pos, digest, bitmaps) with digest of decoded black/red buffers
+				for n, (pos, bk, rd) in enumerate(iter_frames(src)):
+					bk, rd = parse_frame(bk, rd)
+					yield n, pos, hashlib.blake2b(bk.buff + rd.buff, digest_size=16).digest(), (bk, rd)
+
+			def iter_range(frames, start, end):
+				# Input is streamed, with only -start or -end frames buffered for negative values,
+				#  and bitmaps from seekable input in that buffer replaced by offsets to re-read later
+				if start is not None and start < 0:
+					frames = list(cs.deque(( (n, pos, digest, bms if pos is None else None)
+						for n, pos, digest, bms in frames ), maxlen=-start))
+					if frames and end is not None:
+						frames = frames[:end] if end < 0 else list(f for f in frames if f[0] < end)
+					for n, pos, digest, bms in frames:
+						yield n, pos, digest, bms or parse_frame(*frame_lines(src, pos))
+				elif end is not None and end < 0:
+					lag = cs.deque()
+					for frame in it.islice(frames, start, None):
+						lag.append(frame)
+						if len(lag) > -end: yield lag.popleft()
+				else: yield from it.islice(frames, start, end)
+
+			def iter_changed(frames, digest=None): # skips same consecutive frames
+				for frame in frames:
+					if digest != (digest := frame[2]): yield frame
+
+			frames = iter_changed(iter_range(iter_digests(), frame_range.start, frame_range.stop))
+			fmt = 'png' if opts.out_dir else ('rgb' if opts.out_anim.lower().endswith('.gif') else 'rgba')
+
+			def iter_results(jobs=opts.jobs or os.cpu_count()):
+				# Keeps jobs*4 conversions in-flight, yielding results in frame order
+				with cf.ProcessPoolExecutor(jobs) as ex:
+					futs = cs.deque()
+					while True:
+						for n, pos, digest, (bk, rd) in frames:
+							futs.append((n, ex.submit(frame_convert, bk, rd, not opts.invert, fmt)))
+							if len(futs) >= jobs * 4: break
+						if not futs: break
+						n, fut = futs.popleft()
+						yield n, fut.result()
+
+			if opts.out_dir:
+				(p := pl.Path(opts.out_dir)).mkdir(parents=True, exist_ok=True)
+				n = None
+				for n, png in iter_results():
+					with out_func_bin(p / f'{n:05d}.png') as out: out(png)
+				if n is None: raise IndexError('No frames in -r/--range to convert')
+			else:
+				imgs = (PIL.Image.frombytes(*img) for n, img in iter_results())
+				if not (img := next(imgs, None)): raise IndexError('No frames in -r/--range to convert')
+				if fmt != 'rgb': imgs = list(imgs) # APNG encoder ignores iterators
+				with out_func_bin(opts.out_anim) as out:
+					img.save( buff := io.BytesIO(), save_all=True, append_images=imgs,
+						format='gif' if fmt == 'rgb' else 'png', duration=opts.anim_delay, loop=0 )
+					out(buff.getvalue())
+		return
+
+	# Only line offsets of frames are indexed, and only requested frame is decoded
+	# Negative -n/--in-img-num keeps ring of last N offsets (or lines if not seekable)
 	with in_file(opts.in_b64_file) as src:
-		for bk, rd in it.batched(map(parse_bitmap, iter_bitmaps(src)), 2):
-			if (bk.bt, rd.bt) != ('BK', 'RD') or (bk.w, bk.h) != (rd.w, rd.h):
-				raise ValueError( 'Black/red bitmap type/dimensions'
-					' mismatch: black{(bk.bt, bk.w, bk.h)} != red{(rd.bt, rd.w, rd.h)}' )
-			bitmaps.append((bk, rd))
-	bk, rd = bitmaps[opts.in_img_num]
-
-	C, invert, (w, h) = 0xff, not opts.invert, (buff_wh := (bk.w, bk.h))
-	with (
-			PIL.Image.new('RGBA', buff_wh) as img,
-			out_func_bin(opts.out_png_file) as out ):
+		if (n := opts.in_img_num) >= 0:
+			for frame in it.islice(iter_frames(src), n, n+1): break
+			else: raise IndexError(f'Input has less than {n+1:,d} image(s)')
+		else:
+			frames = cs.deque(maxlen=-n)
+			for pos, bk, rd in iter_frames(src):
+				frames.append((pos, None, None) if pos is not None else (pos, bk, rd))
+			if len(frames) < -n: raise IndexError(f'Input has less than {-n:,d} image(s)')
+			frame = frames[0]
+		pos, bk, rd = frame
+		if bk is None: bk, rd = frame_lines(src, pos)
+		bk, rd = parse_frame(bk, rd)
+
+	if opts.bench: return bench_convert(bk, rd, not opts.invert, opts.bench)
+	with out_func_bin(opts.out_png_file) as out:
+		out(bitmap_png(bk, rd, not opts.invert))
+
+
+bitmap_t = cs.namedtuple('bitmap_t', 'bt w h buff') # same name for pickling
+def parse_bitmap(lines):
+	bt, (w, h, sz) = (line := lines[0].split())[0], map(int, line[1:])
+	buff = base64.b64decode(''.join(lines[1:]))
+	if (n := len(buff)) != sz: raise ValueError(
+		f'Buffer size mismatch [{bt}]: expected={sz or 0:,d} actual={len(buff):,d}' )
+	if w*h//8 != sz: raise ValueError(
+		f'Buffer dimensions mismatch [{bt}]: sz={sz:,d} actual={(w,h)}' )
+	return bitmap_t(bt, w, h, buff)
+
+def parse_frame(bk_lines, rd_lines):
+	bk, rd = parse_bitmap(bk_lines), parse_bitmap(rd_lines)
+	if (bk.bt, rd.bt) != ('BK', 'RD') or (bk.w, bk.h) != (rd.w, rd.h):
+		raise ValueError( 'Black/red bitmap type/dimensions'
+			f' mismatch: black{(bk.bt, bk.w, bk.h)} != red{(rd.bt, rd.w, rd.h)}' )
+	return bk, rd
+
+def unpackbits(data, n, sz):
+	'Returns (decoded bytes, next offset) for PackBits-RLE data at offset n'
+	res = bytearray()
+	while len(res) < sz:
+		if (c := data[n]) < 128: res += data[n+1:n+c+2]; n += c + 2
+		elif c > 128: res += data[n+1:n+2] * (257 - c); n += 2
+		else: n += 1
+	if len(res) != sz: raise ValueError(f'RLE data size mismatch: {len(res):,d} != {sz:,d}')
+	return res, n
+
+def delta_frame(lines, state):
+	'''Applies delta/key-frame lines to state dict, returning (bk_lines, rd_lines)
+		in the same format as exported full frames, or None if frame can't be decoded.
+		Any checksum or sequence error makes all frames until next keyframe get skipped.'''
+	import zlib
+	try:
+		w, h, kind, seq, sz, crc = (line := lines[0].split())[1:]
+		w, h, seq, sz, wb = int(w), int(h), int(seq), int(sz), int(w) // 8
+		data = base64.b64decode(''.join(lines[1:]))
+		if len(data) != int(sz): raise ValueError(f'size mismatch: {len(data):,d} != {sz:,d}')
+		if crc != '-' and zlib.crc32(data) != int(crc, 16): raise ValueError('crc32 mismatch')
+		if kind == 'K': state.update(seq=seq, w=w, h=h, planes=[bytearray(wb*h), bytearray(wb*h)])
+		elif state.get('seq') is None: # no keyframe yet, or skipping until next one
+			if not state.get('skip'): print( 'WARNING: Skipping delta-frame(s)'
+				f' without base keyframe, starting from [ {lines[0]} ]', file=sys.stderr )
+			state['skip'] = True; return
+		elif seq != state['seq'] + 1 or (w, h) != (state['w'], state['h']):
+			raise ValueError(f'frame sequence/size mismatch after {state["seq"]}')
+		n, planes = 0, state['planes']
+		while n < len(data):
+			plane, y0, rows = struct.unpack_from('<BHH', data, n)
+			buff, n = unpackbits(data, n + 5, rows * wb)
+			planes[plane][y0*wb:(y0+rows)*wb] = buff
+		state['seq'], state['skip'] = seq, False
+	except Exception as err:
+		print(f'WARNING: Skipping bad delta-frame [ {lines[0]} ]: {err}', file=sys.stderr)
+		state['seq'], state['skip'] = None, True; return
+	return tuple(
+		[f'{bt} {w} {h} {len(buff)}', base64.b64encode(buff).decode()]
+		for bt, buff in zip(['BK', 'RD'], planes) )
+
+def bitmap_img(bk, rd, invert=True):
+	'Returns RGBA image with black/red MONO_HLSB bitmap planes composited over transparency'
+	# MONO_HLSB is same as PIL "1" raw layout, and "1;I" rawmode inverts it on load
+	img, rawmode = PIL.Image.new('RGBA', wh := (bk.w, bk.h)), '1;I' if invert else '1'
+	for c, bm in [(0,0,0,0xff), bk], [(0xff,0,0,0xff), rd]:
+		with PIL.Image.frombytes('1', wh, bm.buff, 'raw', rawmode) as mask: img.paste(c, mask=mask)
+	return img
+
+def bitmap_png(bk, rd, invert=True):
+	with bitmap_img(bk, rd, invert) as img:
+		img.save(buff := io.BytesIO(), format='png', optimize=True)
+	return buff.getvalue()
+
+def bitmap_png_putpixel(bk, rd, invert=True):
+	'Old per-pixel conversion loop, only kept here for --bench comparisons'
+	C, (w, h) = 0xff, (buff_wh := (bk.w, bk.h))
+	with PIL.Image.new('RGBA', buff_wh) as img:
 		for c, bm in [(0,0,0,C), bk], [(C,0,0,C), rd]:
 			sz, wb = len(buff := bm.buff), w//8
 			for y, x in it.product(range(0, sz, wb), range(wb)):
@@ -90,7 +311,28 @@ def main(args=None):
 				for n in range(8):
 					if ((bits >> (7 - n)) & 1) ^ invert: img.putpixel((x*8 + n, y//wb), c)
 		img.save(buff := io.BytesIO(), format='png', optimize=True)
-		out(buff.getvalue())
+	return buff.getvalue()
+
+def frame_convert(bk, rd, invert=True, fmt='png'):
+	'Converts frame bitmaps to PNG bytes or (mode, size, pixels) tuple, for pool workers'
+	if fmt == 'png': return bitmap_png(bk, rd, invert)
+	with bitmap_img(bk, rd, invert) as img:
+		if fmt == 'rgb': # composited over white background, for GIF
+			with PIL.Image.new('RGBA', img.size, (0xff,)*4) as bg:
+				img = PIL.Image.alpha_composite(bg, img).convert('RGB')
+		return img.mode, img.size, img.tobytes()
+
+def bench_convert(bk, rd, invert, n):
+	import time
+	res = dict()
+	for k, func in ('putpixel', bitmap_png_putpixel), ('frombytes', bitmap_png):
+		ts = time.perf_counter()
+		for m in range(n): png = func(bk, rd, invert)
+		res[k] = png, (time.perf_counter() - ts) / n
+	(png0, td0), (png1, td1) = res.values()
+	print( f'Conversion time per image [ {bk.w}x{bk.h} ]: putpixel={td0*1000:,.2f}ms'
+		f' frombytes={td1*1000:,.2f}ms speedup=x{td0/td1:,.1f} png-match={png0 == png1}' )
+	return int(png0 != png1)
 
 if __name__ == '__main__':
 	try: sys.exit(main())
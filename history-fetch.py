@@ -0,0 +1,145 @@
+#!/usr/bin/env python
+
+import pathlib as pl, contextlib as cl, datetime as dt
+import os, sys, time, struct, select, zlib, subprocess
+
+
+frame_magic, frame_hdr = b'\x10CO2', struct.Struct('<cH')
+
+def iter_frames(read, timeout):
+	'''Yields (type, payload) for valid frames from read(n) function output,
+		skipping any other console output before/between them, like MH-Z19 response scan.
+		Raises TimeoutError if there's no new data for longer than timeout.'''
+	buff, ts_data = b'', time.monotonic()
+	while True:
+		if (n := buff.find(frame_magic)) < 0: buff = buff[-len(frame_magic)+1:]
+		else:
+			buff, hdr_end = buff[n:], len(frame_magic) + frame_hdr.size
+			if len(buff) >= hdr_end:
+				t, sz = frame_hdr.unpack_from(buff, len(frame_magic))
+				if len(buff) >= (frame_end := hdr_end + sz + 4):
+					crc, = struct.unpack_from('<I', buff, frame_end - 4)
+					if zlib.crc32(buff[len(frame_magic):frame_end-4]) != crc:
+						raise ValueError(f'Frame checksum mismatch [type={t}]')
+					yield t, buff[hdr_end:frame_end-4]
+					buff = buff[frame_end:]; continue
+		if bs := read(4096): buff += bs; ts_data = time.monotonic()
+		elif bs is None and time.monotonic() - ts_data > timeout:
+			raise TimeoutError(f'No data from device for {timeout:,.1f}s')
+		elif bs is not None: raise EOFError('Device connection closed')
+
+
+def main(args=None):
+	import argparse, textwrap, re
+	dd = lambda text: re.sub( r' \t+', ' ',
+		textwrap.dedent(text).strip('\n') + '\n' ).replace('\t', '  ')
+	parser = argparse.ArgumentParser(
+		formatter_class=argparse.RawTextHelpFormatter, description=dd('''
+			Fetch stored readings from running main.py script via its console to a CSV file.
+			Requires [storage] enabled=yes and dump=yes options (default) on the device.
+			Only records after last fetched one are requested every time,
+				with next record index stored in -s/--state file after each chunk.
+			Example: %(prog)s -p /dev/ttyACM0 -o co2log.csv'''))
+	group = parser.add_argument_group('Device connection')
+	group.add_argument('-p', '--port', metavar='path', help=dd('''
+		Serial port device (e.g. /dev/ttyACM0) connected to running main.py script.
+		Will be switched to raw mode if it's a tty.'''))
+	group.add_argument('-c', '--cmd', metavar='command', help=dd('''
+		Shell command to run and talk to over its stdin/stdout pipes, instead of -p/--port.
+		Intended for testing, e.g.: -c './main-sim.py -d sim -t 1h --stdin -o -' '''))
+	group.add_argument('--marker', metavar='byte', default='0x10', help=dd('''
+		Byte value used to prefix dump request to device. Default: %(default)s'''))
+	group.add_argument('--timeout', metavar='seconds', type=float, default=30.0,
+		help='Timeout for any new data from device. Default: %(default)ss')
+	group = parser.add_argument_group('Output')
+	group.add_argument('-o', '--out-csv', metavar='file', help=dd('''
+		CSV file to append fetched records to, created with header line if missing.
+		Columns: index, ts, time, ppm (or ppm.0, ppm.1, etc with multiple sensors).'''))
+	group.add_argument('-P', '--out-parquet', metavar='dir', help=dd('''
+		Directory to write a columnar Apache Parquet file to on every fetch, instead of -o/--out-csv.
+		Files are named <fetch-time>.<first-index>-<next-index>.parquet, with same columns
+			as CSV, and can be read as one dataset, e.g. via pandas.read_parquet(dir).
+		Requires pyarrow module. State is only updated after file is written.'''))
+	group.add_argument('-s', '--state', metavar='file', help=dd('''
+		File to store index of next record to fetch in. Default: <out-csv/out-parquet>.state'''))
+	group.add_argument('--from', dest='index', metavar='n', type=int, help=dd('''
+		Record index to fetch from, instead of one stored in -s/--state file.'''))
+	group.add_argument('--epoch', metavar='year', type=int, default=2000, help=dd('''
+		Year when device timestamps start, for time column. Default: %(default)s
+		It is 2000 for rp2040 micropython port, and 1970 for main-sim.py, for example.'''))
+	opts = parser.parse_args(sys.argv[1:] if args is None else args)
+
+	if bool(opts.port) == bool(opts.cmd):
+		parser.error('Exactly one of -p/--port or -c/--cmd options must be specified')
+	if bool(opts.out_csv) == bool(opts.out_parquet):
+		parser.error('Exactly one of -o/--out-csv or -P/--out-parquet options must be specified')
+	if parquet := bool(opts.out_parquet): import pyarrow as pa, pyarrow.parquet as pq
+	p_out = pl.Path(opts.out_parquet or opts.out_csv)
+	p_state = pl.Path(opts.state or f'{str(p_out).rstrip("/")}.state')
+	if (idx := opts.index) is None:
+		try: idx = int(p_state.read_text().strip())
+		except FileNotFoundError: idx = 0
+	ts_epoch = dt.datetime(opts.epoch, 1, 1)
+
+	with cl.ExitStack() as ctx:
+		if opts.port:
+			fd = os.open(opts.port, os.O_RDWR | os.O_NOCTTY)
+			ctx.callback(os.close, fd)
+			if os.isatty(fd): import tty; tty.setraw(fd)
+			fd_in = fd_out = fd
+		else:
+			proc = ctx.enter_context(subprocess.Popen(
+				opts.cmd, shell=True, stdin=subprocess.PIPE, stdout=subprocess.PIPE ))
+			ctx.callback(proc.kill)
+			fd_in, fd_out = proc.stdout.fileno(), proc.stdin.fileno()
+		def read(n):
+			if not select.select([fd_in], [], [], 1.0)[0]: return None
+			return os.read(fd_in, n)
+
+		request = lambda idx: os.write(fd_out, bytes([int(opts.marker, 0)]) + f'{idx}\n'.encode())
+		request(idx)
+		if parquet: p_out.mkdir(parents=True, exist_ok=True); out = data = None
+		else: out = ctx.enter_context(open(p_out, 'a'))
+		records = rec = None
+		for t, payload in iter_frames(read, opts.timeout):
+			if t == b'H':
+				idx0, idx_end, cols = struct.unpack('<IIB', payload)
+				if idx0 > idx_end: # device storage was wiped/replaced, its index restarted
+					print( f'WARNING: Record index {idx0:,d} is past last one on the device'
+						f' ({idx_end:,d}), re-fetching all records from its first one', file=sys.stderr )
+					request(idx := 0); rec = None; continue # E-frame of this request is skipped
+				if idx0 > idx: print( f'WARNING: Records {idx:,d} - {idx0-1:,d}'
+					' were already overwritten on the device', file=sys.stderr )
+				rec, keys = struct.Struct('<I' + 'H'*cols), ['ppm'] if cols == 1 else list(
+					f'ppm.{n}' for n in range(cols) )
+				if parquet: data = dict((k, list()) for k in ['index', 'ts', 'time', *keys])
+				elif not out.tell(): out.write('index,ts,time,' + ','.join(keys) + '\n')
+				idx, records = idx0, 0
+			elif t == b'R' and rec:
+				idx_chunk, = struct.unpack_from('<I', payload)
+				if idx_chunk != idx: raise ValueError(f'Record index mismatch: {idx_chunk} != {idx}')
+				for ts, *ppms in rec.iter_unpack(payload[4:]):
+					tt = ts_epoch + dt.timedelta(seconds=ts)
+					if parquet:
+						for k, v in zip(data, (idx, ts, tt, *ppms)): data[k].append(v)
+					else: out.write(f'{idx},{ts},{tt.isoformat(" ")},' + ','.join(map(str, ppms)) + '\n')
+					idx += 1; records += 1
+				if parquet: continue # state is updated after writing whole file
+				out.flush()
+				p_state.with_name(p_state.name + '.new').write_text(f'{idx}\n')
+				p_state.with_name(p_state.name + '.new').rename(p_state)
+			elif t == b'E' and rec: break
+		if parquet and records:
+			types = [pa.uint32(), pa.uint32(), pa.timestamp('ms')] + [pa.uint16()] * (len(data) - 3)
+			table = pa.table(dict(
+				(k, pa.array(vs, type=t)) for (k, vs), t in zip(data.items(), types) ))
+			p = p_out / f'{time.strftime("%Y%m%d-%H%M%S")}.{idx - records}-{idx}.parquet'
+			pq.write_table(table, p_tmp := p.with_name(f'{p.name}.new')); p_tmp.rename(p)
+		p_state.write_text(f'{idx}\n')
+	print(f'Fetched {records or 0:,d} record(s), next index: {idx:,d}', file=sys.stderr)
+
+if __name__ == '__main__':
+	try: sys.exit(main())
+	except BrokenPipeError: # stdout pipe closed
+		os.dup2(os.open(os.devnull, os.O_WRONLY), sys.stdout.fileno())
+		sys.exit(1)
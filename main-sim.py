@@ -0,0 +1,645 @@
+#!/usr/bin/env python
+
+import contextlib as cl, itertools as it
+import os, sys, io, gc, time, types, random, hashlib, calendar, selectors, threading
+import asyncio, tracemalloc
+
+
+class SimState:
+	'Shared virtual clock and stats counters for all simulated components'
+	def __init__(self, ts_wall=1725700000, seed=None):
+		self.vt, self.ts_wall, self.rng = 0.0, ts_wall, random.Random(seed)
+		self.heap = [None, None] # (reading-number, heap use) after warmup and last one
+		self.ts_reading = 0 # last counted reading, to skip ones replayed from storage
+		self.stats = dict.fromkeys(( 'readings uart_cmds uart_ppm_reqs uart_rx'
+			' uart_faults uart_resps uart_resp_ms i2c_reads i2c_errors spi_writes spi_bytes'
+			' epd_refreshes epd_ram_mismatch epd_faults console_bytes sleep_ms deepsleeps' ).split(), 0)
+		# Threads started via _thread shim run in lockstep with event loop - loop waits for
+		#  all of them to be sleeping before advancing virtual time, up to their wakeup times
+		self.cond, self.threads_running, self.threads_wake = threading.Condition(), 0, dict()
+	def count(self, k, n=1): self.stats[k] += n
+	def ticks_ms(self): return int(self.vt * 1000)
+	def in_window(self, windows): # windows = [(vt0, vt1), ...] intervals for fault injection
+		return any(vt0 <= self.vt < vt1 for vt0, vt1 in windows)
+
+	def advance(self, td):
+		if threading.current_thread() is threading.main_thread(): self.vt += td
+		else: self.thread_sleep(td)
+
+	def thread_sleep(self, td):
+		with self.cond:
+			self.threads_wake[tid := threading.get_ident()] = self.vt + td
+			self.threads_running -= 1; self.cond.notify_all()
+			self.cond.wait_for(lambda: tid not in self.threads_wake)
+
+	def loop_advance(self, timeout):
+		'Advances virtual time for event loop, returning new timeout to use for select()'
+		with self.cond:
+			self.cond.wait_for(lambda: not self.threads_running)
+			if self.threads_wake:
+				td = max(0, min(self.threads_wake.values()) - self.vt)
+				timeout = td if timeout is None else min(timeout, td)
+			if timeout and timeout > 0: self.vt += timeout
+			for tid, vt in list(self.threads_wake.items()):
+				if vt > self.vt: continue
+				del self.threads_wake[tid]; self.threads_running += 1
+			self.cond.notify_all()
+		return timeout
+
+sim = None # SimState instance, used by all shim modules
+
+class SimReset(BaseException):
+	'Raised from machine.deepsleep() to restart main script, like board reset on wake'
+
+
+## Virtual-time asyncio event loop
+
+class VirtualSelector(selectors.DefaultSelector):
+	# Instead of blocking for timeout, advances virtual time by that amount
+	# Only blocks without timeout, e.g. on waiting for other threads
+	def select(self, timeout=None):
+		if (timeout := sim.loop_advance(timeout)) is not None: timeout = 0
+		return super().select(timeout)
+
+class VirtualTimeLoop(asyncio.SelectorEventLoop):
+	def __init__(self): super().__init__(VirtualSelector())
+	def time(self): return sim.vt
+
+
+## "time", "gc", "_thread" and "uasyncio" module shims
+
+class MPyTuple(tuple):
+	'Tuple that raises same error as micropython on slices with step, e.g. tt[5:1:-1]'
+	def __getitem__(self, k):
+		if isinstance(k, slice) and k.step not in (None, 1):
+			raise NotImplementedError('only slices with step=1 (aka None) are supported')
+		return super().__getitem__(k)
+
+def time_module():
+	m = types.ModuleType('time')
+	m.ticks_ms = lambda: sim.ticks_ms()
+	m.ticks_us = lambda: int(sim.vt * 1e6)
+	m.ticks_diff = lambda a, b: a - b
+	m.ticks_add = lambda a, b: a + b
+	m.time = lambda: int(sim.ts_wall + sim.vt)
+	m.time_ns = lambda: int((sim.ts_wall + sim.vt) * 1e9)
+	m.sleep = lambda s: sim.advance(s) # blocking sleep in event loop thread
+	m.sleep_ms = lambda ms: sim.advance(ms / 1000)
+	m.sleep_us = lambda us: sim.advance(us / 1e6)
+	# No timezones on rp2040 - localtime/mktime are same as gmtime/timegm there
+	m.localtime = m.gmtime = lambda ts=None: MPyTuple(time.gmtime(m.time() if ts is None else ts)[:8])
+	m.mktime = lambda tt: calendar.timegm(tuple(tt[:6]) + (0, 0, 0))
+	return m
+
+def gc_module():
+	import gc
+	m, heap = types.ModuleType('gc'), 264 * 1024
+	# Heap use is only tracked with --tracemalloc, as python objects differ in size anyway
+	m.mem_alloc = lambda: tracemalloc.get_traced_memory()[0] if tracemalloc.is_tracing() else 0
+	m.mem_free = lambda: max(0, heap - m.mem_alloc())
+	m.collect, m.threshold = gc.collect, lambda n=None: -1
+	m.enable, m.disable, m.isenabled = gc.enable, gc.disable, gc.isenabled
+	return m
+
+class ThreadSafeFlag:
+	# Same as mpy ThreadSafeFlag - wait() clears flag, set() works from any thread
+	def __init__(self): self.ev, self.loop = asyncio.Event(), None
+	def set(self):
+		if not self.loop or threading.get_ident() == self.loop_tid: self.ev.set()
+		else: self.loop.call_soon_threadsafe(self.ev.set)
+	def clear(self): self.ev.clear()
+	async def wait(self):
+		self.loop, self.loop_tid = asyncio.get_running_loop(), threading.get_ident()
+		await self.ev.wait()
+		self.ev.clear()
+
+class StdinReader:
+	# Same as mpy StreamReader(sys.stdin), with real stdin polled every poll_td of virtual
+	#  time, if --stdin option is used, or returning EOF immediately otherwise
+	fd, poll_td = None, 10
+
+	def __init__(self, stream): self.buff = b''
+
+	async def _fill(self, line=False):
+		while self.fd is not None and not (b'\n' in self.buff if line else self.buff):
+			if not selectors.select.select([self.fd], [], [], 0)[0]:
+				sys.stdout.flush() # for responses to reach other side of the pipe
+				await asyncio.sleep(self.poll_td); continue
+			if not (bs := os.read(self.fd, 4096)): StdinReader.fd = None
+			self.buff += bs
+
+	async def read(self, n=-1):
+		await self._fill()
+		if n < 0: n = len(self.buff)
+		bs, self.buff = self.buff[:n], self.buff[n:]
+		return bs
+
+	async def readline(self):
+		await self._fill(line=True)
+		bs, nl, self.buff = self.buff.partition(b'\n')
+		return bs + nl
+
+def thread_module():
+	m = types.ModuleType('_thread')
+	def start_new_thread(func, args):
+		def run():
+			try: func(*args)
+			finally:
+				with sim.cond: sim.threads_running -= 1; sim.cond.notify_all()
+		with sim.cond: sim.threads_running += 1
+		threading.Thread(target=run, daemon=True).start()
+	m.start_new_thread, m.allocate_lock = start_new_thread, threading.Lock
+	m.get_ident = threading.get_ident
+	return m
+
+def uasyncio_module():
+	m = types.ModuleType('uasyncio')
+	m.__dict__.update((k, v) for k, v in vars(asyncio).items() if not k.startswith('__'))
+	m.sleep_ms = lambda ms: asyncio.sleep(ms / 1000)
+	m.ThreadSafeFlag, m.StreamReader = ThreadSafeFlag, StdinReader
+	return m
+
+
+## "framebuf" module shim
+
+def font_glyph(c, _cache=dict()):
+	# Placeholder 5x7 glyphs, as there's no copy of mpy's 8x8 font here
+	# Same char always renders to same pattern, so that frame diffs/hashes work
+	if (glyph := _cache.get(c)) is None:
+		glyph = bytes(7) if c == 32 else bytes( b & 0x7c
+			for b in hashlib.md5(bytes([c % 256])).digest()[:7] )
+		_cache[c] = glyph
+	return glyph
+
+def framebuf_module():
+	m = types.ModuleType('framebuf')
+	m.MONO_VLSB, m.MONO_HLSB, m.MONO_HMSB = 0, 3, 4
+
+	class FrameBuffer:
+		# Pure-python MONO_HLSB-only implementation of mpy FrameBuffer
+		def __init__(self, buf, w, h, fmt, stride=None):
+			if fmt != m.MONO_HLSB: raise ValueError(f'Unsupported format: {fmt}')
+			self.buf, self.w, self.h = buf, w, h
+			self.wb = ((stride or w) + 7) // 8
+
+		def pixel(self, x, y, c=None):
+			if not (0 <= x < self.w and 0 <= y < self.h): return
+			n, bit = y * self.wb + (x >> 3), 0x80 >> (x & 7)
+			if c is None: return int(bool(self.buf[n] & bit))
+			if c: self.buf[n] |= bit
+			else: self.buf[n] &= ~bit & 0xff
+
+		def fill(self, c):
+			self.buf[:] = (b'\xff' if c else b'\0') * len(self.buf)
+
+		def fill_rect(self, x, y, w, h, c):
+			x0, x1 = max(0, x), min(self.w, x + w)
+			y0, y1 = max(0, y), min(self.h, y + h)
+			if x0 >= x1 or y0 >= y1: return
+			xb0, xb1 = (x0 + 7) >> 3, x1 >> 3 # whole bytes in each row
+			for y in range(y0, y1):
+				if xb0 < xb1:
+					n = y * self.wb
+					self.buf[n+xb0:n+xb1] = (b'\xff' if c else b'\0') * (xb1 - xb0)
+					for x in it.chain(range(x0, xb0 << 3), range(xb1 << 3, x1)): self.pixel(x, y, c)
+				else:
+					for x in range(x0, x1): self.pixel(x, y, c)
+
+		def hline(self, x, y, w, c): self.fill_rect(x, y, w, 1, c)
+		def vline(self, x, y, h, c): self.fill_rect(x, y, 1, h, c)
+		def rect(self, x, y, w, h, c, f=False):
+			if f: return self.fill_rect(x, y, w, h, c)
+			self.hline(x, y, w, c); self.hline(x, y + h - 1, w, c)
+			self.vline(x, y, h, c); self.vline(x + w - 1, y, h, c)
+
+		def line(self, x0, y0, x1, y1, c):
+			dx, dy, sx, sy = abs(x1 - x0), -abs(y1 - y0), 1 if x0 < x1 else -1, 1 if y0 < y1 else -1
+			err = dx + dy
+			while True:
+				self.pixel(x0, y0, c)
+				if x0 == x1 and y0 == y1: break
+				if (e2 := 2 * err) >= dy: err += dy; x0 += sx
+				if e2 <= dx: err += dx; y0 += sy
+
+		def text(self, s, x, y, c=1):
+			for ch in s:
+				for yg, bits in enumerate(font_glyph(ord(ch)), 1):
+					for xg in range(8):
+						if bits & (0x80 >> xg): self.pixel(x + xg, y + yg, c)
+				x += 8
+
+		def scroll(self, xstep, ystep):
+			# Same as in mpy, vacated area is left with old contents
+			buf, wb, h = self.buf, self.wb, self.h
+			if xstep == 0 and ystep:
+				if ystep < 0: buf[:(h+ystep)*wb] = buf[-ystep*wb:h*wb]
+				else: buf[ystep*wb:h*wb] = buf[:(h-ystep)*wb]
+				return
+			src = FrameBuffer(bytearray(buf), self.w, self.h, m.MONO_HLSB)
+			for y, x in it.product(range(self.h), range(self.w)):
+				if 0 <= (xs := x - xstep) < self.w and 0 <= (ys := y - ystep) < self.h:
+					self.pixel(x, y, src.pixel(xs, ys))
+
+		def blit(self, fbuf, x, y, key=-1, palette=None):
+			for yf, xf in it.product(range(fbuf.h), range(fbuf.w)):
+				if (c := fbuf.pixel(xf, yf)) != key:
+					self.pixel(x + xf, y + yf, palette.pixel(c, 0) if palette else c)
+
+	m.FrameBuffer = FrameBuffer
+	return m
+
+
+## Simulated devices - MH-Z19 sensor, DS3231 RTC, ePaper screen
+
+class MHZ19Device:
+	'''Responds to 0x86 ppm reads with ppm_func(ts) values after latency,
+		as if bytes arrive at 9600 baud, with some probability of faults.'''
+	byte_td = 10 / 9600
+
+	def __init__( self, ppm_func, latency=0.05,
+			p_drop=0, p_garbage=0, p_corrupt=0, outages=() ):
+		self.ppm_func, self.latency, self.rx = ppm_func, latency, list() # [(vt, byte), ...]
+		self.req_vt = None # to measure time until response is fully read
+		self.p_drop, self.p_garbage, self.p_corrupt = p_drop, p_garbage, p_corrupt
+		self.outages = outages # no responses at all within these
+
+	def _frame(self, cmd, payload):
+		bs = bytearray(b'\xff' + bytes([cmd]) + payload)
+		bs.append((0x100 - sum(bs[1:]) % 0x100) % 0x100)
+		return bs
+
+	def write(self, bs):
+		sim.count('uart_cmds')
+		if len(bs) != 9 or bs[0] != 0xff or bs[2] != 0x86: return # abc/range settings
+		sim.count('uart_ppm_reqs')
+		if sim.in_window(self.outages): return sim.count('uart_faults')
+		if (rng := sim.rng).random() < self.p_drop: return sim.count('uart_faults')
+		ppm = max(0, min(0xffff, round(self.ppm_func(sim.ts_wall + sim.vt))))
+		res = self._frame(0x86, bytes([ppm >> 8, ppm & 0xff, 0x40, 0, 0, 0]))
+		if rng.random() < self.p_corrupt: res[rng.randrange(2, 8)] ^= 0x5a; sim.count('uart_faults')
+		if rng.random() < self.p_garbage:
+			res[:0] = bytes(rng.randrange(256) for n in range(rng.randint(1, 8)))
+			sim.count('uart_faults')
+		vt, self.req_vt = sim.vt + self.latency, sim.vt
+		self.rx.extend((vt + n * self.byte_td, b) for n, b in enumerate(res))
+
+	def any(self):
+		for n, (vt, b) in enumerate(self.rx):
+			if vt > sim.vt: return n
+		return len(self.rx)
+
+	def read(self, n=-1):
+		if not (n := self.any() if n < 0 else min(n, self.any())): return None
+		bs, self.rx[:n] = bytes(b for vt, b in self.rx[:n]), list()
+		sim.count('uart_rx', n)
+		if not self.rx and self.req_vt is not None:
+			sim.count('uart_resps'); sim.count('uart_resp_ms', (sim.vt - self.req_vt) * 1000)
+			self.req_vt = None
+		return bs
+
+class DS3231Device:
+	def __init__(self, drift_ppm=0, p_error=0):
+		self.drift, self.p_error, self.offset = drift_ppm / 1e6, p_error, 0
+	def ts(self): return int(sim.ts_wall + sim.vt * (1 + self.drift) + self.offset)
+
+	def read_regs(self, reg, n):
+		sim.count('i2c_reads')
+		if sim.rng.random() < self.p_error: sim.count('i2c_errors'); raise OSError(5) # EIO
+		yy, mo, dd, hh, mm, ss, wd = time.gmtime(self.ts())[:7]
+		bs = bytes((v // 10) << 4 | v % 10 for v in (ss, mm, hh, wd + 1, dd, mo, yy - 2000))
+		return (bs + bytes(0x13))[reg:reg+n]
+
+	def write_regs(self, reg, bs):
+		if reg != 0 or len(bs) < 7: return # only time-setting is supported
+		ss, mm, hh, wd, dd, mo, yy = ((b >> 4) * 10 + (b & 0xf) for b in bs[:7])
+		self.offset += calendar.timegm((yy + 2000, mo, dd, hh, mm, ss)) - self.ts()
+
+class EPDDevice:
+	'''Tracks controller RAM writes via window/counter commands, and goes busy for
+		refresh_td after 0x20 update command, checking RAM against epd buffers there.
+		Updates started within stuck windows keep busy line up until end of those.'''
+	def __init__(self, pin_dc, pin_cs, pin_busy, w=128, h=250, refresh_td=15.0, stuck=()):
+		self.pin_dc, self.pin_cs, self.pin_busy = pin_dc, pin_cs, pin_busy
+		self.w, self.h, self.wb, self.refresh_td = w, h, w // 8, refresh_td
+		self.stuck = stuck
+		self.ram = [bytearray(b'\xff' * (self.wb * h)) for n in range(2)]
+		self.busy_until, self.cmd, self.args, self.epd = 0, None, bytearray(), None
+		self.xr, self.yr, self.xc, self.yc = (0, self.wb - 1), (0, h - 1), 0, 0
+
+	def spi_write(self, bs, pins):
+		if pins.get(self.pin_cs, 1): return # not selected
+		if not pins.get(self.pin_dc, 1):
+			for b in bs: self.command(b)
+		elif self.cmd in (0x24, 0x26):
+			ram = self.ram[self.cmd == 0x26]
+			for b in bs:
+				if 0 <= self.yc < self.h and 0 <= self.xc < self.wb: ram[self.yc*self.wb + self.xc] = b
+				if (xc := self.xc + 1) > self.xr[1]: xc = self.xr[0]; self.yc += 1
+				self.xc = xc
+		else:
+			(a := self.args).extend(bs)
+			if self.cmd == 0x44 and len(a) >= 2: self.xr = a[0], a[1]
+			elif self.cmd == 0x45 and len(a) >= 4: self.yr = a[0] | a[1] << 8, a[2] | a[3] << 8
+			elif self.cmd == 0x4e and len(a) >= 1: self.xc = a[0]
+			elif self.cmd == 0x4f and len(a) >= 2: self.yc = a[0] | a[1] << 8
+
+	def command(self, b):
+		self.cmd, self.args = b, bytearray()
+		if b == 0x12: self.busy_until = sim.vt + 0.01 # swreset
+		elif b == 0x20:
+			self.busy_until = sim.vt + self.refresh_td
+			sim.count('epd_refreshes')
+			if sim.in_window(self.stuck):
+				self.busy_until = max(vt1 for vt0, vt1 in self.stuck if vt0 <= sim.vt < vt1)
+				sim.count('epd_faults')
+			if self.epd and ( self.ram[0] != self.epd.black_buff
+				or self.ram[1] != self.epd.red_buff ): sim.count('epd_ram_mismatch')
+
+	def busy(self): return int(sim.vt < self.busy_until)
+
+
+## "machine" module shim
+
+def machine_module(board):
+	m = types.ModuleType('machine')
+
+	class Pin:
+		IN, OUT, OPEN_DRAIN, PULL_UP, PULL_DOWN = 0, 1, 2, 1, 2
+		IRQ_RISING, IRQ_FALLING = 1, 2
+		def __init__(self, pin, mode=-1, pull=-1, value=None):
+			self.pin = pin
+			if value is not None: self.value(value)
+		def value(self, v=None):
+			if v is not None: board.pins[self.pin] = int(bool(v)); return
+			if self.pin == board.epd.pin_busy: return board.epd.busy()
+			return board.pins.get(self.pin, 0)
+		def __call__(self, v=None): return self.value(v)
+		def on(self): self.value(1)
+		def off(self): self.value(0)
+		def irq(self, *a, **kw): pass
+		def init(self, *a, **kw): pass
+
+	class UART:
+		def __init__(self, n, *a, **kw): self.dev = board.uarts[n]
+		def init(self, *a, **kw): pass
+		def write(self, bs): self.dev.write(bytes(bs)); return len(bs)
+		def any(self): return self.dev.any()
+		def read(self, n=-1): return self.dev.read(n)
+		def readinto(self, buf, n=-1):
+			if not (bs := self.read(len(buf) if n < 0 else min(n, len(buf)))): return None
+			buf[:len(bs)] = bs
+			return len(bs)
+
+	class I2C:
+		def __init__(self, n, *a, **kw): self.devs = board.i2c
+		def readfrom_mem(self, addr, reg, n):
+			if not (dev := self.devs.get(addr)): raise OSError(19) # ENODEV
+			return dev.read_regs(reg, n)
+		def writeto_mem(self, addr, reg, bs):
+			if not (dev := self.devs.get(addr)): raise OSError(19)
+			dev.write_regs(reg, bs)
+
+	class SPI:
+		def __init__(self, n, *a, **kw): pass
+		def init(self, *a, **kw): pass
+		def write(self, bs):
+			sim.count('spi_writes'); sim.count('spi_bytes', len(bs))
+			board.epd.spi_write(bytes(bs), board.pins)
+
+	class RTC:
+		def datetime(self, tt=None): pass
+
+	m.Pin, m.UART, m.I2C, m.SPI, m.RTC = Pin, UART, I2C, SPI, RTC
+	m.freq = lambda hz=None: 125_000_000
+	def lightsleep(ms=None): sim.count('sleep_ms', ms or 0); sim.advance((ms or 0) / 1000)
+	def deepsleep(ms=None): lightsleep(ms); sim.count('deepsleeps'); raise SimReset
+	m.lightsleep, m.deepsleep = lightsleep, deepsleep
+	m.reset = m.soft_reset = lambda: None
+	m.unique_id = lambda: b'\0sim\0'
+	return m
+
+
+## ppm value generators
+
+def ppm_func(spec):
+	kind, _, arg = spec.partition(':')
+	if kind == 'const': return lambda ts, v=float(arg or 800): v
+	if kind == 'walk':
+		state = [float(arg or 600)]
+		def ppm_walk(ts):
+			state[0] = max(400, min(5000, state[0] + sim.rng.gauss(0, 40)))
+			return state[0]
+		return ppm_walk
+	if kind == 'daily':
+		# Occupied room pattern - ppm goes up during daytime hours, drops at night
+		peak = float(arg or 1600)
+		def ppm_daily(ts):
+			hh = (ts % 86400) / 3600
+			v = 450 + (peak - 450) * max(0, min(1, (hh - 8) / 3, (20 - hh) / 2))
+			return v + sim.rng.gauss(0, 15)
+		return ppm_daily
+	raise ValueError(f'Unrecognized --ppm spec: {spec!r}')
+
+
+## Main entry point
+
+@cl.contextmanager
+def sys_modules_patched(**mods):
+	saved = {k: sys.modules.get(k) for k in mods}
+	sys.modules.update(mods)
+	try: yield
+	finally:
+		for k, mod in saved.items():
+			if mod is None: sys.modules.pop(k, None)
+			else: sys.modules[k] = mod
+
+def load_main(path, board):
+	'Imports main.py script with all mpy-specific modules replaced by shims'
+	import importlib.util
+	if not hasattr(sys, 'print_exception'):
+		import traceback
+		sys.print_exception = lambda err, file=None: traceback.print_exception(err, file=file)
+	with sys_modules_patched(
+			machine=machine_module(board), framebuf=framebuf_module(),
+			time=time_module(), gc=gc_module(), uasyncio=uasyncio_module() ):
+		# co2log_extras.py gets imported from same dir as main.py, and only uses stdlib modules
+		if (p := os.path.dirname(os.path.abspath(path))) not in sys.path: sys.path.insert(0, p)
+		spec = importlib.util.spec_from_file_location('co2log_main', path)
+		spec.loader.exec_module(main := importlib.util.module_from_spec(spec))
+	return main
+
+async def run_main(main):
+	'Runs main() from main.py script, restarting it after every machine.deepsleep() call'
+	while True:
+		tasks = asyncio.all_tasks()
+		try: return await main.main()
+		except SimReset: pass
+		for task in asyncio.all_tasks() - tasks: task.cancel() # leftovers from previous run
+		await asyncio.sleep(0)
+
+def td_parse(td_str):
+	for k, s in ('d', 86400), ('h', 3600), ('m', 60), ('s', 1):
+		if td_str.endswith(k): return float(td_str[:-1]) * s
+	return float(td_str)
+
+def td_window_parse(spec): # start:duration -> (vt0, vt1)
+	vt0, _, td = spec.partition(':')
+	return (vt0 := td_parse(vt0)), vt0 + td_parse(td or '1h')
+
+def main(args=None):
+	import argparse, textwrap, re, tempfile, pathlib as pl
+	dd = lambda text: re.sub( r' \t+', ' ',
+		textwrap.dedent(text).strip('\n') + '\n' ).replace('\t', '  ')
+	parser = argparse.ArgumentParser(
+		formatter_class=argparse.RawTextHelpFormatter, description=dd('''
+			Run main.py micropython script on a host with simulated hardware and virtual time.
+			Stand-in machine/framebuf modules emulate MH-Z19 UART, DS3231 I2C RTC and
+				SPI ePaper screen, and asyncio sleeps only advance virtual clock,
+				so that weeks of sensor readings can be processed in seconds.
+			Stats on hot-path CPU time, UART/I2C/SPI traffic are printed to stderr at the end.'''))
+	parser.add_argument('-m', '--main', metavar='file',
+		default=pl.Path(__file__).parent / 'main.py',
+		help='Path to main.py script to run. Default: %(default)s')
+	parser.add_argument('-c', '--conf', metavar='file', help=dd('''
+		config.ini file to use, same as on the device. Default is to use script defaults.
+		Script runs in a temporary directory (see -d/--dir), where it gets copied.'''))
+	parser.add_argument('-d', '--dir', metavar='dir', help=dd('''
+		Directory to use as cwd for the script, e.g. to keep [storage] files there.
+		Default is to use temporary directory, removed afterwards.'''))
+	parser.add_argument('-t', '--time', metavar='time', default='1d', help=dd('''
+		Virtual time to run simulation for, as number with s/m/h/d unit suffix.
+		Default: %(default)s'''))
+	parser.add_argument('-o', '--output', metavar='file', help=dd('''
+		File to write console output of the script to, e.g. to use with edp-png.py.
+		Default is to discard it, "-" can be used for stdout.'''))
+	parser.add_argument('--seed', type=int, help='Random seed, for reproducible runs.')
+
+	group = parser.add_argument_group('Simulated hardware')
+	group.add_argument('--ppm', metavar='spec', default='daily', help=dd('''
+		CO2 values for sensor to return, one of:
+			const[:ppm] - same value for every read, 800 by default.
+			walk[:ppm] - random walk starting from specified value (600).
+			daily[:peak] - occupied room pattern, rising to peak (1600) in daytime.
+		Default: %(default)s'''))
+	group.add_argument('--start', metavar='ts', type=int, default=1725700000,
+		help='Unix timestamp for RTC to start from. Default: %(default)s')
+	group.add_argument('--uart-latency', metavar='s', type=float, default=0.05,
+		help='Delay before MH-Z19 starts sending response. Default: %(default)ss')
+	group.add_argument('--uart-drop', metavar='p', type=float, default=0,
+		help='Probability of MH-Z19 not sending any response to a read.')
+	group.add_argument('--uart-garbage', metavar='p', type=float, default=0,
+		help='Probability of random bytes on UART line before response.')
+	group.add_argument('--uart-corrupt', metavar='p', type=float, default=0,
+		help='Probability of corrupted byte in MH-Z19 response frame.')
+	group.add_argument('--i2c-error', metavar='p', type=float, default=0,
+		help='Probability of DS3231 I2C read failing.')
+	group.add_argument('--rtc-drift', metavar='ppm', type=float, default=0,
+		help='DS3231 clock drift, in ppm.')
+	group.add_argument('--epd-refresh', metavar='s', type=float, default=15.0,
+		help='Time for ePaper screen to stay busy on refresh. Default: %(default)ss')
+	group.add_argument('--uart-outage', metavar='start:time', action='append', default=list(),
+		help=dd('''
+			Time window when MH-Z19 sensor(s) stop responding entirely, with
+				start/duration in same format as -t/--time option, e.g. 6h:30m.
+			Can be used multiple times, to test [supervisor] component restarts.'''))
+	group.add_argument('--epd-stuck', metavar='start:time', action='append', default=list(),
+		help=dd('''
+			Time window when ePaper screen busy line gets stuck on refreshes,
+				with start/duration same as for --uart-outage, e.g. 12h:10m.
+			Refreshes started within it end at the end of it. Can be used multiple times.'''))
+	group.add_argument('--stdin', action='store_true', help=dd('''
+		Pass stdin data to main script, polling it every 10s of virtual time.
+		Can be used to send history dump requests to it, e.g. from history-fetch.py.
+		Default is to have main script get EOF on any stdin reads.'''))
+	group.add_argument('--tracemalloc', action='store_true',
+		help='Track python heap use for gc.mem_alloc()/mem_free(), slows things down.'
+			' Also reports main script heap use change per reading after first 50 of them.')
+	opts = parser.parse_args(sys.argv[1:] if args is None else args)
+
+	global sim
+	sim = SimState(ts_wall=opts.start, seed=opts.seed)
+	random.seed(opts.seed) # for random values from main script, e.g. test-fill
+	if opts.stdin: StdinReader.fd = sys.stdin.fileno()
+	board = types.SimpleNamespace(pins=dict(), uarts=dict(), i2c=dict(), epd=None)
+	main = load_main(opts.main, board)
+
+	conf = main.CO2LogConf()
+	if opts.conf: conf = main.conf_parse(opts.conf)
+	for uart in set(sc['uart'] for name, sc in conf.sensors or [('', dict(uart=conf.sensor_uart))]):
+		board.uarts[uart] = MHZ19Device( ppm_func(opts.ppm),
+			latency=opts.uart_latency, p_drop=opts.uart_drop, p_garbage=opts.uart_garbage,
+			p_corrupt=opts.uart_corrupt, outages=list(map(td_window_parse, opts.uart_outage)) )
+	board.i2c[0x68] = DS3231Device(drift_ppm=opts.rtc_drift, p_error=opts.i2c_error)
+	board.epd = EPDDevice( conf.screen_pin_dc, conf.screen_pin_cs,
+		conf.screen_pin_busy, refresh_td=opts.epd_refresh,
+		stuck=list(map(td_window_parse, opts.epd_stuck)) )
+
+	# Hooks to count readings and compare screen RAM against epd buffers
+	put, heap_filter = main.ReadingsQueue.put, tracemalloc.Filter(True, main.__file__)
+	def readings_put(self, ts_rtc, *a, **kw):
+		if ts_rtc <= sim.ts_reading: return put(self, ts_rtc, *a, **kw) # replayed after reset
+		sim.count('readings'); sim.ts_reading = ts_rtc
+		if tracemalloc.is_tracing() and (n := sim.stats['readings']) >= 50: # skips init, fill-up
+			# Live heap allocated from main script, after previous reading was fully processed
+			gc.collect(); heap = tracemalloc.take_snapshot().filter_traces([heap_filter])
+			sim.heap[n > 50] = n, sum(st.size for st in heap.statistics('filename'))
+		return put(self, ts_rtc, *a, **kw)
+	main.ReadingsQueue.put = readings_put
+	epd_init = main.EPD_2in13_B_V4_Portrait.__init__
+	def epd_init_hook(self, *a, **kw): board.epd.epd = self; return epd_init(self, *a, **kw)
+	main.EPD_2in13_B_V4_Portrait.__init__ = epd_init_hook
+
+	with cl.ExitStack() as ctx:
+		if not (p := opts.dir): p = ctx.enter_context(tempfile.TemporaryDirectory(prefix='co2log-sim.'))
+		conf_text = pl.Path(opts.conf).read_bytes() if opts.conf else b''
+		(p := pl.Path(p)).mkdir(parents=True, exist_ok=True)
+		(p / 'config.ini').write_bytes(conf_text)
+		if opts.output == '-': out = open(sys.stdout.fileno(), 'wb', buffering=0, closefd=False)
+		elif opts.output: out = ctx.enter_context(open(opts.output, 'wb')) # before chdir
+		else: out = io.BytesIO()
+		ctx.callback(os.chdir, os.getcwd()); os.chdir(p)
+		class Console(io.TextIOWrapper):
+			def write(self, s): sim.count('console_bytes', len(s)); return super().write(s)
+		class ConsoleBuffer(io.BufferedWriter):
+			def write(self, bs): sim.count('console_bytes', len(bs)); return super().write(bs)
+		stdout = Console(ConsoleBuffer(out), write_through=True)
+		stdout.buffer.write = ConsoleBuffer.write.__get__(stdout.buffer)
+		ctx.callback(stdout.detach)
+
+		if opts.tracemalloc: tracemalloc.start(); ctx.callback(tracemalloc.stop)
+		loop = VirtualTimeLoop()
+		ts0, cpu0 = time.monotonic(), time.process_time()
+		try:
+			with cl.redirect_stdout(stdout), sys_modules_patched(_thread=thread_module()):
+				loop.run_until_complete(asyncio.wait_for(run_main(main), td_parse(opts.time)))
+		except (asyncio.TimeoutError, TimeoutError): pass
+		finally: loop.close()
+		td, cpu = time.monotonic() - ts0, time.process_time() - cpu0
+
+	st, days = sim.stats, sim.vt / 86400
+	p = lambda *a: print(*a, file=sys.stderr)
+	p( f'Simulated {sim.vt:,.0f}s ({days:,.2f} days)'
+		f' in {td:,.2f}s real time, cpu={cpu:,.2f}s' )
+	p( f'  readings: {st["readings"]:,d} [{st["readings"]/max(days, 1e-9):,.1f}/day]'
+		f' cpu={cpu/max(1, st["readings"])*1000:,.2f}ms/reading' )
+	p( f'  uart: cmds={st["uart_cmds"]:,d} ppm-reads={st["uart_ppm_reqs"]:,d}'
+		f' [{st["uart_ppm_reqs"]/max(days, 1e-9):,.1f}/day]'
+		f' rx={st["uart_rx"]:,d}B faults={st["uart_faults"]:,d}'
+		f' read-latency={st["uart_resp_ms"]/max(1, st["uart_resps"]):,.1f}ms' )
+	p(f'  i2c: reads={st["i2c_reads"]:,d} errors={st["i2c_errors"]:,d}')
+	p( f'  epd: refreshes={(n := st["epd_refreshes"]):,d} spi-writes={st["spi_writes"]:,d}'
+		f' spi-bytes={st["spi_bytes"]:,d} [{st["spi_bytes"]/max(1, n):,.0f}/refresh]'
+		f' ram-mismatch={st["epd_ram_mismatch"]:,d} faults={st["epd_faults"]:,d}' )
+	p(f'  console: {st["console_bytes"]:,d}B')
+	if st['sleep_ms']: p( f'  power: sleep={st["sleep_ms"]/1000:,.0f}s'
+		f' [{st["sleep_ms"]/10/max(1e-9, sim.vt):.1f}%] deepsleeps={st["deepsleeps"]:,d}' )
+	if sim.heap[1]:
+		(n0, m0), (n1, m1) = sim.heap
+		p( f'  heap [main script]: {m1:,d}B [{(m1 - m0) / (n1 - n0):+,.1f}B/reading'
+			f' over {n1 - n0:,d} readings after first {n0:,d}]' )
+
+if __name__ == '__main__':
+	try: sys.exit(main())
+	except BrokenPipeError: # stdout pipe closed
+		os.dup2(os.open(os.devnull, os.O_WRONLY), sys.stdout.fileno())
+		sys.exit(1)
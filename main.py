@@ -1,4 +1,4 @@
-import machine, time, framebuf, gc, math, re, collections as cs
+import machine, time, framebuf, gc, os, math, array, struct
 
 try: import uasyncio as asyncio
 except ImportError: import asyncio # newer mpy naming
@@ -13,16 +13,30 @@ class CO2LogConf:
 	sensor_pin_rx = 21
 	sensor_init_delay = 210.0
 	sensor_interval = 1021.0
+	sensor_interval_adapt_rate = 0.0
+	sensor_interval_min = 300.0
+	sensor_interval_max = 3600.0
 	sensor_detection_range = 2_000
 	sensor_self_calibration = True
 	sensor_ppm_offset = 0
 	sensor_median_read_delays = ''
+	sensor_aggregate = 'median'
+	sensor_aggregate_trim = 0.25
+	sensor_aggregate_ema = 0.3
+	sensor_aggregate_mad = 0.0
 	sensor_read_delays = '0.1 0.1 0.1 0.2 0.3 0.5 1.0'
 	sensor_read_retry_delays = '0.1 1 5 10 20 40 80 120 180'
+	sensor_merge = 'columns'
+	sensor_stagger = 0.2
+	sensors = None # list of (name, per-sensor values) from [sensor:name] sections
 
 	rtc_i2c = 0
 	rtc_pin_sda = 16
 	rtc_pin_scl = 17
+	rtc_verbose = False
+	rtc_sync_interval = 3593.0
+	rtc_sync_retry = 61.0
+	rtc_set_machine = False
 
 	screen_verbose = False
 	screen_spi = 1
@@ -33,15 +47,110 @@ class CO2LogConf:
 	screen_x0 = 1
 	screen_y0 = 3
 	screen_y_line = 10
+	screen_font_scale = '1x1'
+	screen_font_file = ''
 	screen_test_fill = False
 	screen_test_export = False
+	screen_test_export_format = 'b64'
+	screen_test_export_keyframes = 20
 	screen_timeout = 80.0
+	screen_partial_updates = 0
+	screen_worker = False
+	screen_refresh_min = 180.0
+	screen_refresh_batch = 5.0
+	screen_refresh_stale = 60.0
+	screen_mode = 'log'
+	screen_graph_row = 4
+	screen_graph_ppm_max = 2_000
+
+	storage_verbose = False
+	storage_enabled = False
+	storage_path = 'co2log'
+	storage_segments = 4
+	storage_segment_records = 2048
+	storage_dump = True
+
+	power_verbose = False
+	power_mode = 'off'
+	power_sleep_min = 5.0
+	power_sleep_max = 600.0
+	power_alarm_pin = -1
+	power_wake_replay = 30
+
+	metrics_enabled = False
+	metrics_interval = 3593.0
+
+	supervisor_verbose = False
+	supervisor_max_failures = 5
+	supervisor_window = 3600.0
+	supervisor_backoff_min = 5.0
+	supervisor_backoff_max = 600.0
 
 	ppm_thresholds = {800:'  hi', 1200:'BAD', 1700:'WARN', 2200:'!!!!'}
 
+# Keys that can be set in [sensor:name] sections, with defaults from [sensor]
+sensor_conf_keys = 'uart pin_tx pin_rx ppm_offset detection_range self_calibration'.split()
+
+# Days from 1970-01-01 to time.localtime(0), which is 2000-01-01 on most mpy ports
+ts_epoch_days = 0 if time.localtime(0)[0] == 1970 else 10_957
+
 p_err = lambda *a: print('ERROR:', *a)
 err_fmt = lambda err: f'[{err.__class__.__name__}] {err}'
 
+boot_marks = list() # (phase, ticks_ms, mem_free) tuples, printed and cleared on last one
+def boot_mark(phase, last=False):
+	if boot_marks and not boot_marks[-1]: return # already printed
+	boot_marks.append((phase, time.ticks_ms(), gc.mem_free()))
+	if not last: return
+	print('--- CO2Log boot timeline ---')
+	tk0 = 0
+	for phase, tk, mem in boot_marks:
+		print(f'  {phase:<8} {tk:>7,d}ms [+{tk-tk0:,d}ms] mem-free={mem:,d}B'); tk0 = tk
+	boot_marks.clear(); boot_marks.append(None)
+
+
+class Metrics:
+	# Fixed-size count/sum/max stats and histograms for hot-path values, in arrays
+	# Histogram buckets are log2 - 0, 1, 2-3, 4-7, ..., with last one for anything larger
+	# Printed and reset every interval as one line, see metrics-stats.py script
+	# Line: -mx- <uptime-s> <name>=<count>/<sum>/<min>/<max>/<bucket>:<count>,... for each one
+	# Global "metrics" is None when disabled, so that "metrics and metrics.add(...)" is no-op
+
+	names = 'uart_ms uart_retries rtc_retries epd_busy_ms spi_bytes queue_depth heap_free'.split()
+	buckets = 20
+
+	def __init__(self, interval=3593):
+		self.td, self.idx = interval, dict((k, n) for n, k in enumerate(self.names))
+		self.stats = array.array('I', bytes(4 * 4 * len(self.names))) # count, sum, min, max
+		self.hist = array.array('I', bytes(4 * self.buckets * len(self.names)))
+
+	def add(self, k, v):
+		st, n, b = self.stats, self.idx[k] * 4, 0
+		if not st[n] or v < st[n+2]: st[n+2] = v
+		if v > st[n+3]: st[n+3] = v
+		st[n] += 1; st[n+1] = min(0xffffffff, st[n+1] + v)
+		n = n // 4 * self.buckets
+		while v and b < self.buckets - 1: v >>= 1; b += 1
+		self.hist[n + b] += 1
+
+	def dump(self):
+		st, hist, nb = self.stats, self.hist, self.buckets
+		print(f'-mx- {time.ticks_ms() // 1000}', end='')
+		for n, k in enumerate(self.names):
+			if not st[n*4]: continue
+			print(f' {k}={st[n*4]}/{st[n*4+1]}/{st[n*4+2]}/{st[n*4+3]}/', end='')
+			print(','.join(f'{b}:{c}' for b in range(nb) if (c := hist[n*nb + b])), end='')
+		print()
+		for n in range(len(st)): st[n] = 0
+		for n in range(len(hist)): hist[n] = 0
+
+	async def run(self):
+		while True:
+			await asyncio.sleep(self.td)
+			self.dump()
+
+metrics = None # Metrics instance, if enabled in config
+
 
 def conf_parse(conf_file):
 	with open(conf_file, 'rb') as src:
@@ -64,17 +173,27 @@ def conf_parse(conf_file):
 	bool_map = {
 		'1': True, 'yes': True, 'y': True, 'true': True, 'on': True,
 		'0': False, 'no': False, 'n': False, 'false': False, 'off': False }
-	for sk in 'sensor', 'rtc', 'screen':
+	def conf_val(val, val_conf):
+		if isinstance(val_conf, bool): return bool_map[val.lower()]
+		elif isinstance(val_conf, (int, float)): return type(val_conf)(val)
+		elif not isinstance(val_conf, str): raise ValueError(val_conf)
+		return val
+	for sk in 'sensor', 'rtc', 'screen', 'storage', 'power', 'metrics', 'supervisor':
 		if not (sec := conf_lines.get(sk)): continue
 		for key_raw, key, val in sec:
 			key_conf = f'{sk}_{key}'
 			if (val_conf := getattr(conf, key_conf, None)) is None:
 				p_err(f'[conf.{sk}] Skipping unrecognized config key [ {key_raw} ]')
-			else:
-				if isinstance(val_conf, bool): val = bool_map[val.lower()]
-				elif isinstance(val_conf, (int, float)): val = type(val_conf)(val)
-				elif not isinstance(val_conf, str): raise ValueError(val_conf)
-				setattr(conf, key_conf, val)
+			else: setattr(conf, key_conf, conf_val(val, val_conf))
+	for sk in sorted(conf_lines): # mpy dicts are unordered, so sensors are sorted by name
+		if not sk.startswith('sensor:'): continue
+		sens = conf_vals(conf, 'sensor', sensor_conf_keys)
+		for key_raw, key, val in conf_lines[sk]:
+			if key not in sens:
+				p_err(f'[conf.{sk}] Skipping unrecognized per-sensor config key [ {key_raw} ]')
+			else: sens[key] = conf_val(val, sens[key])
+		if not conf.sensors: conf.sensors = list()
+		conf.sensors.append((sk[7:], sens))
 	if sec := conf_lines.get(sk := 'co2-ppm-thresholds'):
 		ppms = conf.ppm_thresholds = dict()
 		for key_raw, key, val in sec:
@@ -92,19 +211,149 @@ def conf_vals(conf, sec, keys, flat=False):
 
 
 class ReadingsQueue:
-	def __init__(self):
+	# Ring of preallocated (ts_rtc, ppm, ...) arrays, without allocations per reading
+	# overflow: "oldest" - drop oldest queued reading when full, "new" - drop new one
+	# rollups: ReadingsRollup objects to update with max ppm of every put() reading
+	def __init__(self, size=50, columns=1, overflow='oldest', rollups=()):
+		self.size, self.columns, self.drop_old = size, columns, overflow == 'oldest'
+		self.rollups = rollups
+		self.ts = array.array('I', bytes(4 * size))
+		self.ppms = array.array('H', bytes(2 * size * columns))
+		self.i = self.n = self.dropped = 0
 		# asyncio.Event seem to be crashing mpy, hence ThreadSafeFlag
-		self.data, self.ev = cs.deque((), 50), asyncio.ThreadSafeFlag()
-	def put(self, value): self.data.append(value); self.ev.set()
-	async def get(self):
-		while True:
-			await self.ev.wait()
-			try: value = self.data.popleft()
-			except IndexError: self.ev.clear(); continue
-			if not self.data: self.ev.clear()
-			else: self.ev.set() # for ThreadSafeFlag
-			return value
-	def is_empty(self): return not self.data
+		self.ev = asyncio.ThreadSafeFlag()
+	def put(self, ts_rtc, ppms): # missing ppm columns are filled by last value
+		if self.rollups:
+			ppm = max(0, min(0xffff, max(ppms)))
+			for rollup in self.rollups: rollup.add(ts_rtc, ppm)
+		if self.n == self.size:
+			self.dropped += 1
+			p_err(f'Readings queue overflow, dropped {self.dropped:,d} reading(s) so far')
+			if not self.drop_old: return
+			self.i = (self.i + 1) % self.size; self.n -= 1
+		k, cols, n = (self.i + self.n) % self.size, self.columns, len(ppms) - 1
+		self.ts[k] = ts_rtc
+		for c in range(cols): self.ppms[k*cols + c] = max(0, min(0xffff, ppms[min(c, n)]))
+		self.n += 1; self.ev.set()
+		metrics and metrics.add('queue_depth', self.n)
+	async def get(self, ppms): # copies ppm values into ppms array, returns ts_rtc
+		while not self.n: await self.ev.wait()
+		i, cols = self.i, self.columns
+		for c in range(cols): ppms[c] = self.ppms[i*cols + c]
+		self.i, self.n = (i + 1) % self.size, self.n - 1
+		return self.ts[i]
+	def is_empty(self): return not self.n
+
+
+class ReadingsLog:
+	# Ring of preallocated segment files with fixed-size (ts_rtc, ppm, ...) records
+	# Segment file: 12B header (magic, record size, seq) + records, ts_rtc=0 if unused
+	# Appends only seek/overwrite one record, new segment is zeroed on rotation only
+
+	hdr_fmt, rec_fmt, magic = '<4sII', '<IH', b'CO2L'
+
+	def __init__(self, path, segments=4, segment_records=2048, columns=1, verbose=False):
+		self.p_log = verbose and (lambda *a: print('[storage]', *a))
+		self.rec_fmt = '<I' + 'H'*columns # one ppm value per sensor column
+		self.path, self.segs, self.seg_n, self.src = path, segments, segment_records, None
+		self.hdr_sz, self.rec_sz = struct.calcsize(self.hdr_fmt), struct.calcsize(self.rec_fmt)
+		self.hdr, self.rec = bytearray(self.hdr_sz), bytearray(self.rec_sz)
+		self.seg_sz = self.hdr_sz + self.rec_sz * self.seg_n
+
+	def _seg_path(self, seg): return f'{self.path}.{seg}.bin'
+
+	def _seg_seq(self, seg): # returns -1 for missing or mismatched segments
+		try:
+			if os.stat(p := self._seg_path(seg))[6] != self.seg_sz: return -1
+			with open(p, 'rb') as src: src.readinto(self.hdr)
+		except OSError: return -1
+		magic, rec_sz, seq = struct.unpack(self.hdr_fmt, self.hdr)
+		return seq if magic == self.magic and rec_sz == self.rec_sz else -1
+
+	def _seg_init(self, seg, seq):
+		if self.src: self.src.close()
+		self.src = src = open(self._seg_path(seg), 'w+b')
+		struct.pack_into(self.hdr_fmt, self.hdr, 0, self.magic, self.rec_sz, seq)
+		src.write(self.hdr)
+		zeroes = memoryview(bytearray(min(512, sz := self.seg_sz - self.hdr_sz)))
+		for n in range(0, sz, len(zeroes)): src.write(zeroes[:min(len(zeroes), sz - n)])
+		src.flush()
+		self.seg, self.seq, self.n = seg, seq, 0
+		self.p_log and self.p_log(f'New segment: {seg} [seq={seq}]')
+
+	def _rec_ts(self, n):
+		self.src.seek(self.hdr_sz + n * self.rec_sz)
+		self.src.readinto(self.rec)
+		return struct.unpack_from('<I', self.rec)[0]
+
+	def open(self): # finds last write position via segment seqs and binary search
+		seg, seq = 0, -1
+		for n in range(self.segs):
+			if (n_seq := self._seg_seq(n)) > seq: seg, seq = n, n_seq
+		if seq < 0: return self._seg_init(0, 0)
+		self.seg, self.seq, self.src = seg, seq, open(self._seg_path(seg), 'r+b')
+		a, b = 0, self.seg_n
+		while a < b:
+			if self._rec_ts(m := (a + b) // 2): a = m + 1
+			else: b = m
+		self.n = a
+		self.p_log and self.p_log(f'Opened: segment={seg} seq={seq} records={a}')
+
+	def close(self):
+		if self.src: self.src.close()
+		self.src = None
+
+	def index(self): # absolute number of next record, which never decreases
+		return self.seq * self.seg_n + self.n
+
+	def index_first(self): # absolute number of oldest record still stored
+		seqs = list(seq for seg in range(self.segs) if (seq := self._seg_seq(seg)) >= 0)
+		return min(seqs) * self.seg_n if seqs else 0
+
+	def read_into(self, idx, buff): # returns number of records read from absolute idx
+		seq, n = divmod(idx, self.seg_n)
+		if self._seg_seq(seg := seq % self.segs) != seq: return 0 # overwritten or missing
+		n = min(len(buff) // self.rec_sz, self.seg_n - n, self.index() - idx)
+		with open(self._seg_path(seg), 'rb') as src:
+			src.seek(self.hdr_sz + (idx % self.seg_n) * self.rec_sz)
+			return src.readinto(memoryview(buff)[:n*self.rec_sz]) // self.rec_sz
+
+	def append(self, ts_rtc, *ppms):
+		if self.n >= self.seg_n: self._seg_init((self.seg + 1) % self.segs, self.seq + 1)
+		struct.pack_into( self.rec_fmt, self.rec, 0,
+			ts_rtc, *(max(0, min(0xffff, ppm)) for ppm in ppms) )
+		self.src.seek(self.hdr_sz + self.n * self.rec_sz)
+		self.src.write(self.rec); self.src.flush()
+		self.n += 1
+
+
+async def history_dump_task(rlog, marker=b'\x10', chunk=64, verbose=False):
+	# Waits for "<marker><record-index>\n" on stdin, and dumps records from that index
+	# Frames: 4B magic, <cH type/len, payload, <I crc32 of type/len/payload
+	#  H - <IIB first/next index and columns, R - <I index + records, E - <I next index
+	import sys, binascii
+	p_log = verbose and (lambda *a: print('[storage]', *a))
+	def frame(t, payload):
+		hdr = struct.pack('<cH', t, len(payload))
+		crc = binascii.crc32(payload, binascii.crc32(hdr))
+		sys.stdout.buffer.write(b'\x10CO2' + hdr)
+		sys.stdout.buffer.write(payload)
+		sys.stdout.buffer.write(struct.pack('<I', crc))
+	reader, buff = asyncio.StreamReader(sys.stdin), bytearray(chunk * rlog.rec_sz)
+	while True:
+		if not (c := await reader.read(1)): return # stdin closed
+		if c != marker: continue
+		try: idx = int((await reader.readline()).strip() or 0)
+		except ValueError: continue
+		idx, idx_end = max(idx, rlog.index_first()), rlog.index()
+		p_log and p_log(f'Dump: records {idx:,d} - {idx_end:,d}')
+		frame(b'H', struct.pack('<IIB', idx, idx_end, (rlog.rec_sz - 4) // 2))
+		while idx < idx_end:
+			if not (n := rlog.read_into(idx, buff)): # overwritten during dump
+				p_err(f'[storage] Dump interrupted at record {idx:,d}'); break
+			frame(b'R', struct.pack('<I', idx) + buff[:n*rlog.rec_sz])
+			idx += n; await asyncio.sleep_ms(0) # let other tasks run between chunks
+		frame(b'E', struct.pack('<I', idx))
 
 
 class RTC_DS3231:
@@ -127,37 +376,149 @@ class RTC_DS3231:
 			raise ValueError(f'Failed to encode time-tuple:\n    {p(tt)}\n to {p(tt_enc)}')
 		self.i2c.writeto_mem(0x68, 0x00, bs)
 
-	async def read(self): # uses hardcoded read-retry attempts
-		for td in 0.05, 0.1, 0.1, 0.2, 0.3, None:
+	async def read(self, errs=0): # uses hardcoded read-retry attempts, errs = earlier ones
+		for n, td in enumerate((0.05, 0.1, 0.1, 0.2, 0.3, None)):
 			try: bs = self.i2c.readfrom_mem(0x68, 0x00, 7)
 			except:
 				if td: await asyncio.sleep(td)
 				else: raise
-			else: return time.mktime(self._decode(bs))
+			else:
+				metrics and metrics.add('rtc_retries', errs + n)
+				return time.mktime(self._decode(bs))
 
+	async def read_edge(self, skip_ms=0, timeout_ms=2100, poll_ms=4):
+		# Polls seconds register until it changes, returning (ts, ticks_ms) of that edge
+		# skip_ms: delay before polling, if next edge is expected after it, to poll less
+		# Falls back to read() with ticks_ms=None, if edge can't be detected due to errors
+		if skip_ms: await asyncio.sleep_ms(skip_ms)
+		ss, errs, tk_end = None, 0, time.ticks_add(time.ticks_ms(), timeout_ms)
+		while time.ticks_diff(tk_end, time.ticks_ms()) > 0:
+			try: bs = self.i2c.readfrom_mem(0x68, 0x00, 7)
+			except: ss = None; errs += 1 # edge must be between two consecutive reads
+			else:
+				if ss is not None and bs[0] != ss:
+					metrics and metrics.add('rtc_retries', errs)
+					return time.mktime(self._decode(bs)), time.ticks_ms()
+				ss = bs[0]
+			await asyncio.sleep_ms(poll_ms)
+		return await self.read(errs), None
+
+	def set_alarm(self, ts): # alarm-1 on date/h/m/s match, pulls INT/SQW pin low
+		tt = time.localtime(ts); bs = bytearray((tt[5], tt[4], tt[3], tt[2])) # ss mm hh dd
+		for n, v in enumerate(bs): bs[n] = v + 6 * (v//10)
+		self.i2c.writeto_mem(0x68, 0x07, bs)
+		self.i2c.writeto_mem(0x68, 0x0e, b'\x1d') # INTCN + A1IE, default rate bits
+		self.i2c.writeto_mem(0x68, 0x0f, b'\x08') # clear alarm flags, keep 32kHz output
 
-class MHZ19:
 
-	def __init__(self, uart): self.uart = uart
+class RTCClock:
+	# Wall-clock time from ticks_ms() since last DS3231 read, synced in background
+	# RTC reads are aligned to its seconds-register changes, for ~poll_ms precision
+	# Rate of ticks vs RTC is measured over all ticks since first aligned sync,
+	#  accumulated between syncs to avoid ticks_ms wraparound, and is used to correct drift
+	# If sync fails, time keeps being calculated from ticks, and sync is retried sooner
 
-	def _res_bytes(self, cmd, bs):
-		if not bs: return
-		if csum := sum(bs[1:-1]) % 0x100: csum = 0xff - csum + 1
-		if ( bs and len(bs) == 9 and bs[0] == 0xff
-				and bs[1] == cmd and csum == bs[-1] ):
-			return bs[2:-1] # 6B of actual payload
+	def __init__( self, rtc, sync_interval=3593,
+			sync_retry=61, set_machine=False, verbose=False ):
+		self.p_log = verbose and (lambda *a: print('[rtc]', *a))
+		self.rtc, self.td_sync, self.td_retry = rtc, sync_interval, sync_retry
+		self.mrtc = set_machine and machine.RTC()
+		self.ts = self.tk = None; self.rate = 1.0 # rtc-ms per tick-ms
+		self.base_ts = self.base_td = None # rate baseline - rtc ts and tick-ms since then
 
-	async def read_ppm(self, read_delays=[0.1, 0.1, 0.2, 0.2, 0.5]):
-		bs = self.uart.write(b'\xff\x01\x86\x00\x00\x00\x00\x00\x79')
-		for td in read_delays:
+	def time(self): # returns None until first sync
+		if self.tk is None: return
+		return int(self.ts + self.rate * time.ticks_diff(time.ticks_ms(), self.tk) / 1000)
+
+	def _rebase(self): # keeps ticks_diff away from ticks_ms wraparound on sync failures
+		td = time.ticks_diff(tk := time.ticks_ms(), self.tk)
+		self.ts, self.tk = self.ts + self.rate * td / 1000, tk
+		if self.base_td is not None: self.base_td += td
+
+	async def sync(self, rate_td_min=600_000, rate_max_err=500e-6, edge_margin=50):
+		if self.tk is None: skip = 0 # last sync was at RTC seconds edge, so wait for next one
+		else: skip = 1000 - int(self.rate * time.ticks_diff(time.ticks_ms(), self.tk)) % 1000
+		ts, tk = await self.rtc.read_edge(max(0, skip - edge_margin))
+		if edge := tk is not None: err = ''
+		else: ts, tk, err = ts + 0.5, time.ticks_ms(), ' [no-edge]' # unknown sub-second phase
+		if self.tk is not None:
+			ts_est = self.ts + self.rate * (td := time.ticks_diff(tk, self.tk)) / 1000
+			if self.base_td is not None: self.base_td += td
+			if not edge: pass
+			elif self.base_td is None: self.base_ts, self.base_td = ts, 0
+			elif self.base_td > rate_td_min: # RTC jumps or bogus rate restart the baseline
+				rate = (ts - self.base_ts) * 1000 / self.base_td
+				if abs(rate - 1) <= rate_max_err: self.rate = rate
+				else:
+					self.base_ts, self.base_td = ts, 0
+					err += f' [rate-reset {(rate - 1) * 1e6:+,.0f}ppm]'
+			self.p_log and self.p_log( f'Sync: error={ts - ts_est:+.3f}s'
+				f' rate={self.rate:.6f} baseline={(self.base_td or 0) // 1000:,d}s{err}' )
+		else:
+			if edge: self.base_ts, self.base_td = ts, 0
+			self.p_log and self.p_log(f'Sync: initial ts={ts}{err}')
+		self.ts, self.tk = ts, tk
+		if self.mrtc:
+			yy, mo, dd, hh, mm, ss, wd = time.localtime(int(ts))[:7]
+			self.mrtc.datetime((yy, mo, dd, wd, hh, mm, ss, 0))
+		return int(ts)
+
+	async def run(self):
+		td = self.td_sync
+		while True:
 			await asyncio.sleep(td)
-			if bs := self._res_bytes(0x86, self.uart.read(9)): return bs[0]*256 + bs[1]
+			try: await self.sync()
+			except Exception as err:
+				p_err(f'[rtc] Failed to sync time from RTC: {err_fmt(err)}')
+				self._rebase(); td = self.td_retry
+			else: td = self.td_sync
+
+
+class MHZ19:
+
+	def __init__(self, uart):
+		# Response bytes are accumulated in preallocated buffer and scanned in-place
+		# 18B fits max 8B of partial frame left after scan + 9B chunk read on top of it
+		self.uart, self.buff, self.buff_n, self.chunk = uart, bytearray(18), 0, bytearray(9)
 
-	async def set_abc(self, state): # Automatic Baseline Correction
+	def _res_scan(self, cmd):
+		# Returns offset of valid response frame or -1, dropping bytes before frame start
+		bs, n, i = self.buff, self.buff_n, 0
+		while i < n:
+			if bs[i] != 0xff or (i + 1 < n and bs[i+1] != cmd): i += 1; continue
+			if n - i < 9: break # partial frame
+			csum = 0
+			for k in range(i+1, i+9): csum += bs[k]
+			if not csum & 0xff: return i
+			i += 1
+		if i:
+			for k in range(n - i): bs[k] = bs[i + k]
+			self.buff_n = n - i
+		return -1
+
+	async def read_ppm(self, timeout_ms=2300, poll_ms=10):
+		uart, bs, chunk = self.uart, self.buff, self.chunk
+		while uart.any(): uart.readinto(chunk) # drop any stale/unaligned data
+		self.buff_n = 0
+		uart.write(b'\xff\x01\x86\x00\x00\x00\x00\x00\x79')
+		ts_end = time.ticks_add(time.ticks_ms(), timeout_ms)
+		while time.ticks_diff(ts_end, time.ticks_ms()) > 0:
+			await asyncio.sleep_ms(poll_ms)
+			while uart.any():
+				if not (n := uart.readinto(chunk)): break
+				for k in range(n): bs[self.buff_n + k] = chunk[k]
+				self.buff_n += n
+				if (i := self._res_scan(0x86)) >= 0:
+					self.buff_n = 0
+					metrics and metrics.add( 'uart_ms',
+						timeout_ms - time.ticks_diff(ts_end, time.ticks_ms()) )
+					return bs[i+2] << 8 | bs[i+3]
+
+	def set_abc(self, state): # Automatic Baseline Correction
 		if state: self.uart.write(b'\xff\x01\x79\xa0\x00\x00\x00\x00\xe6')
 		else: self.uart.write(b'\xff\x01\x79\x00\x00\x00\x00\x00\x86')
 
-	async def set_range(self, ppm):
+	def set_range(self, ppm):
 		if ppm not in [2_000, 5_000, 10_000]: raise ValueError(ppm)
 		bs = bytearray(b'\xff\x01\x99\x00\x00\x00\x00\x00\x00')
 		bs[6], bs[7] = ppm // 256, ppm % 256
@@ -165,57 +526,205 @@ class MHZ19:
 		self.uart.write(bs)
 
 
-async def sensor_read(rtc, mhz19, read_delays, retry_delays, sample_tds):
-	retries, samples = 0, list()
+class SampleAgg:
+	# Aggregates multiple sensor samples into one datapoint value
+	# Running sum and EMA are updated on every add() in O(1), and samples are kept in
+	#  preallocated arrays, both as-added and sorted, via binary search + shift on insert,
+	#  so that median is always srt[n//2], and trimmed-mean only subtracts sorted ends
+	# MAD outlier rejection needs final median, so is done once in value(), in O(n),
+	#  with mean/ema then re-computed over remaining samples, if any were rejected
+
+	modes = 'median', 'mean', 'trimmed-mean', 'ema'
+
+	def __init__(self, size, mode='median', trim=0.25, ema=0.3, mad=0):
+		if mode not in self.modes: raise ValueError(f'Unknown aggregation mode: {mode}')
+		if not 0 <= trim < 0.5: raise ValueError(f'Aggregation trim must be in [0, 0.5) range: {trim}')
+		self.mode, self.trim, self.ema_a, self.mad_k = mode, trim, ema, mad
+		self.raw, self.srt = array.array('H', bytes(2*size)), array.array('H', bytes(2*size))
+		self.reset()
+
+	def reset(self): self.n = self.sum = 0; self.ema = None
+
+	def add(self, v):
+		srt, n, a, b = self.srt, self.n, 0, self.n
+		self.raw[n], self.sum = v, self.sum + v
+		self.ema = v if self.ema is None else self.ema + self.ema_a * (v - self.ema)
+		while a < b:
+			if srt[m := (a + b) // 2] <= v: a = m + 1
+			else: b = m
+		for k in range(n, a, -1): srt[k] = srt[k-1]
+		srt[a], self.n = v, n + 1
+
+	def _mad(self, med):
+		# Median absolute deviation - merges deviations on both sides of sorted median
+		srt, n = self.srt, self.n
+		l, r = (m := n // 2) - 1, m
+		for k in range(m + 1):
+			if r < n and (l < 0 or srt[r] - med <= med - srt[l]): dev = srt[r] - med; r += 1
+			else: dev = med - srt[l]; l -= 1
+		return dev
+
+	def value(self):
+		if not (n := self.n): return
+		srt, lo, hi, v, e = self.srt, 0, n, self.sum, self.ema
+		if self.mad_k and n >= 3: # reject outliers beyond mad_k * scaled-MAD from median
+			lim = self.mad_k * max(1, 1.4826 * self._mad(med := srt[n // 2]))
+			while med - srt[lo] > lim: v -= srt[lo]; lo += 1
+			while srt[hi-1] - med > lim: hi -= 1; v -= srt[hi]
+			if hi - lo < n and self.mode == 'ema':
+				vmin, vmax, e = srt[lo], srt[hi-1], None
+				for k in range(n):
+					if not vmin <= (s := self.raw[k]) <= vmax: continue
+					e = s if e is None else e + self.ema_a * (s - e)
+		if (mode := self.mode) == 'median': return srt[lo + (hi - lo) // 2]
+		if mode == 'ema': return round(e)
+		if mode == 'trimmed-mean':
+			t = min(int((hi - lo) * self.trim), (hi - lo - 1) // 2)
+			for k in range(t): v -= srt[lo + k] + srt[hi - 1 - k]
+			lo, hi = lo + t, hi - t
+		return round(v / (hi - lo))
+
+
+class ReadingsRollup:
+	# Incremental min/median/max stats for a ring of fixed time buckets (e.g. hours)
+	# Current bucket median is tracked via histogram of bin_w-wide value bins,
+	#  with median bin index and count of samples below it moved on every add()
+	# Each add() is O(1), except for bin-walks across empty bins, and reset per new bucket
+	# steps: total number of buckets that ring advanced by, to check for new ones
+
+	def __init__(self, td, n, bin_w=10, bin_n=500):
+		self.td, self.n, self.i, self.b, self.steps = td, n, 0, None, 0
+		self.vmin, self.vmed, self.vmax = (array.array('H', bytes(2*n)) for k in range(3))
+		self.bin_w, self.bins = bin_w, array.array('I', bytes(4*bin_n))
+		self.bc = self.bm = self.bm_cb = 0 # sample count, median bin, count below it
+
+	def add(self, ts, v): # returns number of buckets that ring advanced by
+		if (b := ts // self.td) == self.b: steps = 0
+		else:
+			if self.b is None or b < self.b: steps = 1 # first bucket or clock jump back
+			else: steps = b - self.b
+			for k in range(min(steps, self.n)):
+				self.i = i = (self.i + 1) % self.n
+				self.vmin[i] = self.vmed[i] = self.vmax[i] = 0
+			self.b, self.steps = b, self.steps + steps
+			bins = self.bins; self.bc = self.bm = self.bm_cb = 0
+			for k in range(len(bins)): bins[k] = 0
+		i = self.i
+		if not self.vmax[i] or v < self.vmin[i]: self.vmin[i] = v
+		if v > self.vmax[i]: self.vmax[i] = v
+		bins, m, cb = self.bins, self.bm, self.bm_cb
+		bins[k := min(v // self.bin_w, len(bins) - 1)] += 1
+		if k < m: cb += 1
+		self.bc = n = self.bc + 1; t = (n + 1) // 2 # rank of lower median
+		while cb + bins[m] < t: cb += bins[m]; m += 1
+		while cb >= t: m -= 1; cb -= bins[m]
+		self.bm, self.bm_cb = m, cb # bin center, clamped to min/max for exact 1-value bins
+		self.vmed[i] = max(self.vmin[i], min(self.vmax[i], m * self.bin_w + self.bin_w // 2))
+		return steps
+
+	def stats(self, k): # k buckets back from current one, vmax=0 for empty ones
+		return self.vmin[i := (self.i - k) % self.n], self.vmed[i], self.vmax[i]
+
+
+async def sensor_read(mhz19, agg, read_timeout, retry_delays, sample_tds, delay=0):
+	if delay: await asyncio.sleep(delay) # staggered start with multiple sensors
+	retries = 0; agg.reset()
 	for td in sample_tds:
 		if td: await asyncio.sleep(td)
 		for n, td_retry in enumerate(retry_delays):
-			if ppm := await mhz19.read_ppm(read_delays):
-				samples.append(ppm); retries += n; break
+			if ppm := await mhz19.read_ppm(read_timeout):
+				agg.add(ppm); retries += n
+				metrics and metrics.add('uart_retries', n); break
 			if td_retry: await asyncio.sleep(td_retry)
 		else: raise RuntimeError(
 			f'CO2 sensor read failed after {len(retry_delays)} attempt(s)' )
-	ts_rtc = await rtc.read(); samples.sort()
-	return retries, ts_rtc, samples[len(samples) // 2]
+	return retries, agg.value()
 
-async def sensor_poller( conf, mhz19, rtc,
-		readings, init_delay=0, abc_repeat=12*3593*1000, verbose=False ):
+async def sensor_poller( conf, sensors, clock, readings, rlog=None,
+		power=None, wake=None, restart=False, abc_repeat=12*3593*1000, verbose=False ):
+	# sensors: list of (name, mhz19, sensor_conf_keys dict) tuples
+	# All sensors are read concurrently, then merged into one (ts_rtc, ppm, ...) reading
+	# wake: interval stored before deepsleep, to restore state after it
+	# restart: started again by Supervisor after failure, with sensors still powered-on
 	p_log = verbose and (lambda *a: print('[sensor]', *a))
-	read_delays = list(map(float, conf.sensor_read_delays.split()))
+	read_timeout = round(1000 * sum(map(float, conf.sensor_read_delays.split())))
 	read_retry_delays = list(map(float, conf.sensor_read_retry_delays.split())) + [None]
 	median_tds = [0] + list(map(float, conf.sensor_median_read_delays.split()))
 	median_td_ms = round(1000 * sum(median_tds))
 	median_info = p_log and ( ( f'samples={len(median_tds)}' +
-		f' timespan={median_td_ms/1000:,.1f}s' ) if median_td_ms else 'single-read' )
-	mhz19_read = lambda: sensor_read(
-		rtc, mhz19, read_delays, read_retry_delays, median_tds )
+		f' timespan={median_td_ms/1000:,.1f}s {conf.sensor_aggregate}' )
+		if median_td_ms else 'single-read' )
+	if (merge := conf.sensor_merge) not in ('columns', 'median'):
+		raise ValueError(f'Unrecognized [sensor] merge value: {merge}')
+	merge = merge == 'median' and len(sensors) > 1
+	aggs = list( SampleAgg( len(median_tds), conf.sensor_aggregate,
+		**conf_vals(conf, 'sensor_aggregate', 'trim ema mad') ) for s in sensors )
+	mhz19_read = lambda: asyncio.gather(*( sensor_read( mhz19, agg,
+			read_timeout, read_retry_delays, median_tds, n * conf.sensor_stagger )
+		for n, ((name, mhz19, sc), agg) in enumerate(zip(sensors, aggs)) ))
 
-	p_log and p_log('Init: configuration')
+	p_log and p_log(f'Init: configuration [sensors={len(sensors)}]')
 	td_cycle = int(conf.sensor_interval * 1000)
-	await asyncio.sleep(0.2)
-	mhz19.set_abc(abc := conf.sensor_self_calibration)
-	if not abc: ts_abc_repeat = time.ticks_ms()
-	await asyncio.sleep(0.2)
-	mhz19.set_range(conf.sensor_detection_range)
-	if (delay := conf.sensor_init_delay - time.ticks_ms() / 1000) > 0:
+	if adapt_rate := conf.sensor_interval_adapt_rate: # ppm/h rate to halve interval at
+		td_min, td_max = (int(td * 1000) for td in (conf.sensor_interval_min, conf.sensor_interval_max))
+		td_cycle, ppm_last = max(td_min, min(td_max, wake or td_cycle)), None
+	for name, mhz19, sc in sensors:
+		await asyncio.sleep(0.2)
+		mhz19.set_abc(sc['self_calibration'])
+		await asyncio.sleep(0.2)
+		mhz19.set_range(sc['detection_range'])
+	abc_off = list(mhz19 for name, mhz19, sc in sensors if not sc['self_calibration'])
+	ts_abc_repeat = time.ticks_ms()
+	if wake: p_log and p_log('Init: skipping preheat delay after deepsleep')
+	elif restart: p_log and p_log('Init: skipping preheat delay on restart')
+	elif (delay := conf.sensor_init_delay - time.ticks_ms() / 1000) > 0:
 		p_log and p_log(f'Init: preheat delay [{delay:,.1f}s]')
 		await asyncio.sleep(delay)
 	else: p_log and p_log('Init: skipping preheat delay due to uptime')
+	if wake and rlog and (n := conf.power_wake_replay): # restore screen contents from storage
+		buff, idx_end = bytearray(rlog.rec_sz), rlog.index()
+		idx0 = max(rlog.index_first(), idx_end - n) & ~1 # same line colors on every wake
+		for idx in range(idx0, idx_end):
+			if not rlog.read_into(idx, buff): continue
+			ts_rtc, *ppms = struct.unpack(rlog.rec_fmt, buff)
+			readings.put(ts_rtc, ppms); await asyncio.sleep_ms(0) # scroller gets to process it
+			if adapt_rate: ppm_last = ts_rtc, ppms
+		p_log and p_log(f'Init: replayed {idx_end - idx0:,d} stored reading(s)')
 
-	p_log and p_log(f'Starting poller loop ({td_cycle/1000:,.1f}s interval)...')
+	p_log and p_log( f'Starting poller loop ({td_cycle/1000:,.1f}s interval' +
+		(f' adaptive={td_min/1000:,.0f}-{td_max/1000:,.0f}s' if adapt_rate else '') + ')...' )
 	while True:
 		ts = time.ticks_ms()
-		if not abc and time.ticks_diff(ts, ts_abc_repeat) > abc_repeat:
+		if abc_off and time.ticks_diff(ts, ts_abc_repeat) > abc_repeat:
 			# Arduino MH-Z19 code repeats this every 12h to "skip next ABC cycle"
 			# Not sure if it actually needs to be repeated, but why not
-			mhz19.set_abc(abc); ts_abc_repeat = ts
+			for mhz19 in abc_off: mhz19.set_abc(False)
+			ts_abc_repeat = ts
 		p_log and p_log(f'datapoint read [{median_info}]')
-		n, ts_rtc, ppm = await mhz19_read()
-		p_log and p_log(f'datapoint [retries={n}]: ts={ts_rtc} ppm={ppm:,d}')
-		readings.put((ts_rtc, ppm + conf.sensor_ppm_offset))
-		delay = max(0, td_cycle - median_td_ms - time.ticks_diff(time.ticks_ms(), ts))
-		p_log and p_log(f'delay: {delay/1000:,.1f} ms')
-		await asyncio.sleep_ms(delay)
+		res = await mhz19_read()
+		ts_rtc = clock.time() # one timestamp for all sensors
+		ppms = list(ppm + sc['ppm_offset'] for (n, ppm), (name, mhz19, sc) in zip(res, sensors))
+		p_log and p_log( f'datapoint [retries={sum(n for n, ppm in res)}]: ts={ts_rtc} '
+			+ ' '.join(f'ppm{"."+name if name else ""}={ppm:,d}' for (name, m, sc), ppm in zip(sensors, ppms)) )
+		if merge: ppms.sort(); ppms = [(ppms[len(ppms)//2] + ppms[(len(ppms)-1)//2]) // 2]
+		readings.put(ts_rtc, ppms)
+		boot_mark('reading', last=True)
+		if rlog:
+			try: rlog.append(ts_rtc, *ppms)
+			except OSError as err: p_err(f'[storage] Failed to store reading: {err_fmt(err)}')
+		if adapt_rate: # shorten interval on fast ppm changes, stretch it back when stable
+			if ppm_last and (td := ts_rtc - ppm_last[0]) > 0:
+				rate = max(abs(a - b) for a, b in zip(ppms, ppm_last[1])) * 3600 / td
+				if rate > adapt_rate: td_cycle = max(td_min, td_cycle // 2)
+				elif rate < adapt_rate / 2: td_cycle = min(td_max, td_cycle * 3 // 2)
+				p_log and p_log(f'interval: {td_cycle/1000:,.1f}s [rate={rate:,.0f} ppm/h]')
+			ppm_last = ts_rtc, ppms
+		# td_cycle is between datapoints, so includes time spent on median reads
+		delay = max(0, td_cycle - time.ticks_diff(time.ticks_ms(), ts))
+		p_log and p_log(f'delay: {delay/1000:,.1f} s')
+		metrics and metrics.add('heap_free', gc.mem_free())
+		if power: await power.sleep(delay, td_cycle)
+		else: await asyncio.sleep_ms(delay)
 
 
 class EPD_2in13_B_V4_Portrait:
@@ -228,15 +737,37 @@ class EPD_2in13_B_V4_Portrait:
 
 	class EPDInterface: # hides all implementation internals
 		def __init__(self, epd):
-			for k in 'black red display clear w h'.split():
+			for k in 'black red display clear dirty hw_reset w h'.split():
 				setattr(self, k, getattr(epd, k))
 
-	def __init__(self, w=122, h=250, timeout=120, verbose=False):
+	def __init__( self, w=122, h=250, timeout=120, partial_updates=0, worker=False,
+			export_format='b64', export_keyframes=20, verbose=False ):
 		self.p_log = verbose and (lambda *a: print('[epd]', *a))
 		self.h, self.w, self.active, self.timeout = h, math.ceil(w/8)*8, None, timeout
+		self.worker = worker # use thread on other core for all screen updates
 		for c in 'black', 'red': # can also be implemented as one GS2_HMSB buffer
 			setattr(self, f'{c}_buff', buff := bytearray(math.ceil(self.w * self.h / 8)))
 			setattr(self, c, framebuf.FrameBuffer(buff, self.w, self.h, framebuf.MONO_HLSB))
+		# Rows marked via dirty() get sent on next display(), or all if none are marked
+		# Every partial_updates+1'th display() sends both full buffers regardless
+		self.rows_dirty, self.partial_updates = bytearray(h), partial_updates
+		self.partial_n = partial_updates # first update is always a full one
+		# Same dirty rows are used to only export changed ones, with export_format=delta
+		self.export_delta, self.export_keyframes = export_format == 'delta', export_keyframes
+		self.export_n = 0
+		if export_format not in ('b64', 'delta'):
+			raise ValueError(f'Unrecognized [screen] test-export-format value: {export_format}')
+		if export_keyframes < 1:
+			raise ValueError(f'[screen] test-export-keyframes must be 1 or more: {export_keyframes}')
+
+	# Init sequence and other command tables, as (cmd, data-len, data...) entries for cmd_seq()
+	seq_init = bytes((
+		0x01, 3, 0xf9, 0, 0, # output control
+		0x11, 1, 0x03, # data entry mode, landscape mode uses 0x07
+		0x3c, 1, 0x05, # border waveform
+		0x18, 1, 0x80, # read built-in temperature sensor
+		0x21, 2, 0x80, 0x80 )) # display update control
+	seq_swreset, seq_update, seq_sleep = b'\x12\0', b'\x20\0', b'\x10\x01\x01'
 
 	async def hw_init(self, spi=None, **pins):
 		if spi and pins: # first init
@@ -246,74 +777,102 @@ class EPD_2in13_B_V4_Portrait:
 			for k in 'reset', 'cs', 'dc':
 				setattr(pins, k, Pin(getattr(pins, k), Pin.OUT))
 			pins.busy = Pin(pins.busy, Pin.IN, Pin.PULL_UP)
-			self.spi = spi
+			self.spi, self.b1 = spi, bytearray(1)
+			self.seq_win = bytearray(( # RAM window/counters, updated by ram_window()
+				0x44, 2, 0, (self.w-1)>>3, 0x45, 4, 0, 0, 0, 0, 0x4e, 1, 0, 0x4f, 2, 0, 0 ))
 			spi.init(baudrate=4000_000)
 			if time.ticks_ms() < 20: await asyncio.sleep_ms(20)
 			epd_iface = self.EPDInterface(self)
-		else:
-			spi, pins = self.spi, self.p
-			p_log = epd_iface = None
+			if self.worker: # worker does hw init before every update
+				self.worker_start(); p_log and p_log('Init: started worker thread')
+				return epd_iface
+		else: p_log = epd_iface = None
 		if self.active: return # no need for init
 
-		async def wait_ready(_p_busy=pins.busy):
-			while _p_busy.value(): await asyncio.sleep_ms(10)
-			await asyncio.sleep_ms(20)
-		def cmd(b, _p_dc=pins.dc, _p_cs=pins.cs, _spi=spi):
-			_p_dc.value(0); _p_cs.value(0)
-			_spi.write(bytes([b])); _p_cs.value(1)
-		def data(bs, _p_dc=pins.dc, _p_cs=pins.cs, _spi=spi):
-			if isinstance(bs, int): bs = bytes([bs])
-			elif isinstance(bs, list): bs = bytes(b&0xff for b in bs)
-			_p_dc.value(1); _p_cs.value(0)
-			_spi.write(bs); _p_cs.value(1)
-		self.wait_ready, self.cmd, self.data = wait_ready, cmd, data
-
-		p_log and p_log('Init: reset')
-		pins.reset.value(1); await asyncio.sleep_ms(50)
-		pins.reset.value(0); await asyncio.sleep_ms(2)
-		pins.reset.value(1); await asyncio.sleep_ms(50)
-		await wait_ready()
-		cmd(0x12) # swreset
-		await wait_ready()
-
-		p_log and p_log('Init: configuration')
-		# Output control
-		cmd(0x01); data(b'\xf9\0\0')
-		# Data entry mode
-		cmd(0x11); data(0x03) # landscape mode uses 0x07
-		# Window configuration
-		cmd(0x44) # set_ram_x_address_start_end_position
-		data([(x0 := 0)>>3, (x1 := self.w-1)>>3])
-		cmd(0x45) # set_ram_y_address_start_end_position
-		data([y0 := 0, y0>>8, y1 := self.h-1, y1>>8])
-		# Cusor position - not sure if x0/y0 are window or abs coordinates
-		cmd(0x4e); data(x0 & 0xff) # set_ram_x_address_counter
-		cmd(0x4f); data([y0, y0 >> 8]) # set_ram_y_address_counter
-		# BorderWaveform
-		cmd(0x3c); data(0x05)
-		# Read built-in temperature sensor
-		cmd(0x18); data(0x80)
-		# Display update control
-		cmd(0x21); data(b'\x80\x80')
-		await wait_ready()
-
+		p_log and p_log('Init: reset/configuration')
+		for td in self.init_steps(): await (asyncio.sleep_ms(td) if td else self.wait_ready())
 		p_log and p_log('Init: finished')
-		self.active = True
 		return epd_iface
 
+	def init_steps(self):
+		# Yields ms delays or 0 to wait for busy line, to run from async code or worker thread
+		# Reset line is already held low after sleep_mode(), so only needs to be released,
+		#  but there's no way to leave deep sleep without hw reset, which resets config too
+		p_reset = self.p.reset
+		if self.active is None: # first init or after close() - full reset pulse
+			p_reset.value(1); yield 50
+			p_reset.value(0); yield 2
+		p_reset.value(1); yield 50; yield 0
+		self.cmd_seq(self.seq_swreset); yield 0
+		self.cmd_seq(self.seq_init); yield 0 # RAM window is set before every write
+		self.active = True
+
+	async def wait_ready(self, metric=None): # metric - key to record busy-time under
+		_p_busy, tk = self.p.busy, metric and metrics and time.ticks_ms()
+		while _p_busy.value(): await asyncio.sleep_ms(10)
+		metric and metrics and metrics.add(metric, time.ticks_diff(time.ticks_ms(), tk))
+		await asyncio.sleep_ms(20)
+
+	def cmd_seq(self, seq, c=None, bs=None):
+		# Sends all command/data entries from seq, and optional c command
+		#  with bs data after those, all within one CS-held SPI transaction
+		spi, p_dc, b1, seq, n = self.spi, self.p.dc, self.b1, memoryview(seq), 0
+		self.p.cs.value(0)
+		while n < len(seq):
+			b1[0], m = seq[n], seq[n+1]
+			p_dc.value(0); spi.write(b1)
+			if m: p_dc.value(1); spi.write(seq[n+2:n+2+m])
+			n += 2 + m
+		if c is not None:
+			b1[0] = c; p_dc.value(0); spi.write(b1)
+			if bs: p_dc.value(1); spi.write(bs)
+		self.p.cs.value(1)
+
+	def ram_window(self, y0, y1):
+		# Full-width RAM window for rows y0 to y1-1, with address counters at its start
+		struct.pack_into('<HH', win := self.seq_win, 6, y0, y1-1)
+		struct.pack_into('<H', win, 15, y0)
+		return win
+
 	def close(self):
-		self.cmd = self.data = self.wait_ready = self.active = None
+		self.active = None
+		self.partial_n = self.partial_updates # force full update after reset
 		self.p_log and self.p_log('Closed')
 
+	async def hw_reset(self): # full reset/init after failed update, e.g. from Supervisor
+		self.close()
+		if not self.worker: await asyncio.wait_for(self.hw_init(), self.timeout)
+
+	def dirty(self, y0=0, y1=None):
+		rows, y1 = self.rows_dirty, self.h if y1 is None else min(y1, self.h)
+		for y in range(max(0, y0), y1): rows[y] = 1
+
+	def transfer(self, rows, black, red):
+		# Sends contiguous runs of dirty rows to RAM windows, clearing those, and starts update
+		wb, y0 = self.w // 8, None
+		for y in range(self.h + 1):
+			if y < self.h and rows[y]:
+				if y0 is None: y0 = y
+				rows[y] = 0; continue
+			if y0 is None: continue
+			for c, buff in (0x24, black), (0x26, red):
+				self.cmd_seq(self.ram_window(y0, y), c, memoryview(buff)[y0*wb:y*wb])
+			y0 = None
+		self.cmd_seq(self.seq_update) # activate display update sequence
+
 	async def display(self, op='Display', final=False):
-		self.p_log and self.p_log(op)
-		await self.hw_init()
-		self.cmd(0x24)
-		self.data(self.black_buff)
-		self.cmd(0x26)
-		self.data(self.red_buff)
-		self.cmd(0x20) # activate display update sequence
-		try: await asyncio.wait_for(self.wait_ready(), self.timeout)
+		rows = self.rows_dirty
+		if self.partial_n >= self.partial_updates or not any(rows):
+			for y in range(self.h): rows[y] = 1
+			self.partial_n, mode = 0, 'full'
+		else: self.partial_n += 1; mode = 'partial'
+		if tx := (self.p_log or metrics) and self.w // 4 * sum(rows):
+			self.p_log and self.p_log(f'{op} [{mode} tx={tx:,d}B]')
+			metrics and metrics.add('spi_bytes', tx)
+		if self.worker: return await self.worker_display()
+		await asyncio.wait_for(self.hw_init(), self.timeout) # busy line can get stuck there too
+		self.transfer(rows, self.black_buff, self.red_buff)
+		try: await asyncio.wait_for(self.wait_ready('epd_busy_ms'), self.timeout)
 		except asyncio.TimeoutError:
 			if final: raise
 			self.close() # force reset
@@ -322,8 +881,7 @@ class EPD_2in13_B_V4_Portrait:
 
 	async def sleep_mode(self):
 		self.p_log and self.p_log('Sleep mode')
-		self.cmd(0x10)
-		self.data(0x01)
+		self.cmd_seq(self.seq_sleep)
 		await asyncio.sleep(2) # not sure why, was in example code
 		self.p.reset.value(0)
 		self.active = False
@@ -331,133 +889,514 @@ class EPD_2in13_B_V4_Portrait:
 	async def clear(self, color=1):
 		self.black.fill(color)
 		self.red.fill(color)
+		self.dirty()
 		await self.display('Clear')
 
-	def export_image_buffers(self, line_bytes=90):
-		import sys, binascii
-		if flush := getattr(sys.stdout, 'flush', None): flush() # not used in mpy atm
-		for bt, buff in zip(['BK', 'RD'], [self.black_buff, self.red_buff]):
-			sys.stdout.buffer.write(f'\n-epd-:{bt} {self.w} {self.h} {len(buff)}\n'.encode())
-			for n in range(0, len(buff), line_bytes):
-				sys.stdout.buffer.write(b'-epd-:')
-				sys.stdout.buffer.write(binascii.b2a_base64(buff[n:n+line_bytes]))
-		sys.stdout.buffer.write(b'\n')
-		if flush := getattr(sys.stdout.buffer, 'flush', None): flush()
-
-
-def co2_log_fake_gen(ts_rtc=None, td=673):
-	import random
-	values, ts_rtc = list(), ts_rtc or 1725673478
-	for n in range(30):
-		if random.random() > 0.6: ppm = random.randint(400, 900)
-		elif random.random() > 0.4: ppm = random.randint(500, 3000)
-		else: ppm = random.randint(500, 8000)
-		values.append((int(ts_rtc), ppm))
-		ts_rtc -= td
-	return reversed(values)
-
-def co2_log_text(tt, ppm, ppm_msgs):
-	ts_rtc = f'{tt[3]:02d}:{tt[4]:02d}'
+	def worker_start(self):
+		# Worker thread on second core does all SPI transfers, busy-waits and sleep mode
+		# display() copies frame into w_* buffers under lock, and sets w_req flag for worker,
+		#  which then sets w_flag when done, with busy-time or exception in w_res
+		import _thread
+		self.w_lock, self.w_flag = _thread.allocate_lock(), asyncio.ThreadSafeFlag()
+		self.w_black, self.w_red = bytearray(len(self.black_buff)), bytearray(len(self.red_buff))
+		self.w_rows, self.w_req, self.w_res = bytearray(self.h), False, None
+		_thread.start_new_thread(self.worker_loop, ())
+
+	async def worker_display(self):
+		with self.w_lock: # worker is idle here, as display() calls never overlap
+			memoryview(self.w_black)[:] = self.black_buff
+			memoryview(self.w_red)[:] = self.red_buff
+			memoryview(self.w_rows)[:] = rows = self.rows_dirty
+			for y in range(self.h): rows[y] = 0
+			self.w_req = True
+		await self.w_flag.wait()
+		res, self.w_res = self.w_res, None
+		if isinstance(res, Exception): raise res
+		metrics and metrics.add('epd_busy_ms', res)
+
+	def worker_loop(self):
+		while True:
+			if not self.w_req: time.sleep_ms(100); continue # polled, as refreshes are rare
+			try: self.w_res = self.worker_refresh()
+			except Exception as err: self.w_res = err
+			self.w_req = False; self.w_flag.set()
+
+	def worker_refresh(self): # blocking display() + sleep_mode(), returns busy-time
+		p_busy, timeout = self.p.busy, round(self.timeout * 1000)
+		for final in False, True:
+			for td in self.init_steps():
+				if td: time.sleep_ms(td); continue
+				tk = time.ticks_ms()
+				while p_busy.value():
+					if time.ticks_diff(time.ticks_ms(), tk) > timeout: raise asyncio.TimeoutError
+					time.sleep_ms(10)
+				time.sleep_ms(20)
+			with self.w_lock: self.transfer(self.w_rows, self.w_black, self.w_red)
+			tk = time.ticks_ms()
+			while p_busy.value() and time.ticks_diff(time.ticks_ms(), tk) < timeout:
+				time.sleep_ms(10)
+			if not p_busy.value(): break
+			if final: raise asyncio.TimeoutError
+			self.active = None # force reset, and full update for retry
+			for y in range(self.h): self.w_rows[y] = 1
+		td = time.ticks_diff(time.ticks_ms(), tk)
+		time.sleep_ms(20)
+		self.cmd_seq(self.seq_sleep)
+		time.sleep(2) # same as in sleep_mode()
+		self.p.reset.value(0)
+		self.active = False
+		return td
+
+	def export_image_buffers(self): # only used with test-export option
+		import co2log_extras; co2log_extras.export_image_buffers(self)
+
+class RefreshScheduler:
+	# Coalesces screen refresh requests into rate-limited epd.display() calls
+	# Refresh is delayed until no new requests for td_batch, but not more than
+	#  td_stale since first pending one, and never less than td_min since last refresh
+	# Requests made while refresh is pending or in progress are merged into next one
+
+	def __init__(self, epd, td_min=180, td_batch=5, td_stale=60, verbose=False):
+		self.p_log = verbose and (lambda *a: print('[refresh]', *a))
+		self.epd, self.ev = epd, asyncio.ThreadSafeFlag()
+		self.td_min, self.td_batch, self.td_stale = (
+			round(td * 1000) for td in (td_min, td_batch, td_stale) )
+		self.ts_req = self.ts_req0 = self.ts_last = None
+		self.n_refresh = self.n_merged = self.n_deferred = 0
+		self.active = False
+
+	def busy(self): return self.ts_req0 is not None or self.active
+
+	def request(self):
+		self.ts_req = ts = time.ticks_ms()
+		if self.ts_req0 is None: self.ts_req0 = ts
+		else: self.n_merged += 1
+		self.ev.set()
+
+	async def run(self, restart=False):
+		td_min, td_batch, td_stale = self.td_min, self.td_batch, self.td_stale
+		if restart: self.request() # redo failed refresh
+		while True:
+			await self.ev.wait()
+			deferred = False
+			while self.ts_req0 is not None:
+				ts = time.ticks_ms()
+				delay = min( td_batch - time.ticks_diff(ts, self.ts_req),
+					td_stale - time.ticks_diff(ts, self.ts_req0) )
+				if self.ts_last is not None and (
+						td := td_min - time.ticks_diff(ts, self.ts_last) ) > max(0, delay):
+					delay, deferred = td, True
+				if delay <= 0: break
+				await asyncio.sleep_ms(delay)
+			else: continue # flag was set by already-handled request
+			self.ts_req0, self.n_refresh = None, self.n_refresh + 1
+			if deferred: self.n_deferred += 1
+			self.p_log and self.p_log( f'Refresh #{self.n_refresh:,d}'
+				f' [merged={self.n_merged:,d} deferred={self.n_deferred:,d}]' )
+			self.active = True
+			try: await self.epd.display()
+			finally: self.active = False
+			if self.n_refresh == 1: boot_mark('clear')
+			self.ts_last = time.ticks_ms()
+
+
+class PowerManager:
+	# Puts MCU into lightsleep/deepsleep for sensor_poller delays between readings
+	# Only sleeps when none of the checks() report something in progress, e.g. screen refresh,
+	#  otherwise waits via asyncio, re-checking these every second until deadline
+	# deepsleep resets the board on wake, so stores state for wake_state() in a file
+	# Sensor ABC-off setting is re-sent on every boot, so its 12h repeat timer isn't stored
+	# Awake/sleep time is accounted between end of one sleep() call and the next one
+
+	state_fmt, state_magic = '<4sIIIII', b'CO2W'
+
+	def __init__( self, mode='off', sleep_min=5, sleep_max=600,
+			alarm_pin=-1, clock=None, state_path=None, verbose=False ):
+		self.p_log = verbose and (lambda *a: print('[power]', *a))
+		if mode not in ('lightsleep', 'deepsleep'):
+			raise ValueError(f'Unrecognized [power] mode value: {mode}')
+		self.deep, self.clock, self.state_path = mode == 'deepsleep', clock, state_path
+		self.td_min, self.td_max = round(sleep_min * 1000), round(sleep_max * 1000)
+		self.checks, self.hooks = list(), list() # busy-checks, funcs to run before deepsleep
+		self.alarm = alarm_pin >= 0 and machine.Pin(alarm_pin, machine.Pin.IN, machine.Pin.PULL_UP)
+		if self.alarm: self.alarm.irq(lambda pin: None, machine.Pin.IRQ_FALLING)
+		self.tk_wake, self.n_cycles, self.td_awake, self.td_sleep = time.ticks_ms(), 0, 0, 0
+
+	def wake_state(self): # returns td_cycle stored before deepsleep, removing the file
+		try:
+			with open(self.state_path, 'rb') as src: bs = src.read()
+			os.remove(self.state_path)
+			magic, ts, td_cycle, cycles, awake, slept = struct.unpack(self.state_fmt, bs)
+		except (OSError, ValueError): return
+		if magic != self.state_magic: return
+		self.n_cycles, self.td_awake, self.td_sleep = cycles, awake * 1000, slept * 1000 # in seconds
+		self.p_log and self.p_log(f'Wake from deepsleep [ts={ts} interval={td_cycle/1000:,.1f}s]')
+		return td_cycle
+
+	async def sleep(self, td, td_cycle=0):
+		tk_end, slept = time.ticks_add(time.ticks_ms(), td), 0
+		while True:
+			await asyncio.sleep_ms(0) # let any runnable tasks run first
+			if (td := time.ticks_diff(tk_end, time.ticks_ms())) <= 0: break
+			busy = td < self.td_min
+			for check in self.checks: busy = busy or check()
+			if busy: await asyncio.sleep_ms(min(td, 1000)); continue
+			if self.deep: self.deepsleep(td, td_cycle, slept)
+			machine.lightsleep(td := min(td, self.td_max))
+			slept += td
+		td = time.ticks_diff(time.ticks_ms(), self.tk_wake)
+		self.account(td - slept, slept)
+		self.tk_wake = time.ticks_ms()
+
+	def account(self, awake, slept):
+		self.n_cycles += 1; self.td_awake += awake; self.td_sleep += slept
+		self.p_log and self.p_log( f'Cycle #{self.n_cycles:,d}:'
+			f' awake={awake/1000:,.1f}s sleep={slept/1000:,.1f}s [total:'
+			f' awake={self.td_awake/1000:,.0f}s sleep={self.td_sleep/1000:,.0f}s'
+			f' {100 * self.td_sleep / max(1, self.td_awake + self.td_sleep):.1f}%]' )
+
+	def deepsleep(self, td, td_cycle, slept):
+		self.account(time.ticks_diff(time.ticks_ms(), self.tk_wake) - slept, slept + td)
+		ts = self.clock.time() or 0
+		if self.alarm and ts: self.clock.rtc.set_alarm(ts + td // 1000)
+		with open(self.state_path, 'wb') as dst: dst.write(struct.pack( self.state_fmt,
+			self.state_magic, ts, td_cycle, self.n_cycles,
+			self.td_awake // 1000, self.td_sleep // 1000 ))
+		self.p_log and self.p_log(f'Deepsleep [{td/1000:,.1f}s]')
+		for hook in self.hooks: hook() # last, so that nothing is closed if above fails
+		machine.deepsleep(td) # resets the board on wake
+
+
+class GlyphCache:
+	# Text glyphs pre-rendered into MONO_HLSB FrameBuffer tiles, to draw via blit()
+	# Glyphs are from built-in 8x8 font or a binary font file, scaled by WxH on init
+	# Font file: 8B header (magic, glyph w/h, first char, count) + w/8*h bytes per glyph
+	# Only chars passed on init are cached, and drawn as 0 (black/red) pixels
+
+	font_fmt, font_magic = '<4sBBBB', b'CO2F'
+
+	def __init__(self, chars, scale=(1, 1), font_file=None):
+		w = h = 8; font = None
+		if font_file:
+			with open(font_file, 'rb') as src:
+				if len(hdr := src.read(8)) < 8: raise ValueError(f'Font file header truncated: {font_file}')
+				magic, w, h, c0, cn = struct.unpack(self.font_fmt, hdr)
+				if magic != self.font_magic: raise ValueError(f'Font file magic mismatch: {magic}')
+				if len(font := src.read(cn * (gsz := (w + 7) // 8 * h))) < cn * gsz: raise ValueError(
+					f'Font file truncated: {font_file} [{len(font):,d} < {cn:,d} glyphs x {gsz:,d}B]' )
+		gsz = (w + 7) // 8 * h; gbuf = bytearray(gsz)
+		gsrc = framebuf.FrameBuffer(gbuf, w, h, framebuf.MONO_HLSB)
+		self.w, self.h, (sx, sy) = w * scale[0], h * scale[1], scale
+		self.glyphs = dict()
+		for c in set(chars + '0123456789'):
+			if not font: gsrc.fill(0); gsrc.text(c, 0, 0, 1)
+			elif 0 <= (n := ord(c) - c0) < cn: gbuf[:] = font[n*gsz:(n+1)*gsz]
+			else: continue
+			g = framebuf.FrameBuffer(
+				bytearray((self.w + 7) // 8 * self.h), self.w, self.h, framebuf.MONO_HLSB )
+			g.fill(1)
+			for y in range(h):
+				for x in range(w):
+					if gsrc.pixel(x, y): g.fill_rect(x*sx, y*sy, sx, sy, 0)
+			self.glyphs[c] = g
+		if missing := ''.join(c for c in '0123456789' if c not in self.glyphs):
+			raise ValueError(f'Font file is missing digit glyph(s): {font_file} [{missing}]')
+		self.digits = list(self.glyphs[c] for c in '0123456789')
+
+	def text(self, buff, s, x, y): # returns x after last glyph
+		for c in s:
+			if g := self.glyphs.get(c): buff.blit(g, x, y, 1)
+			x += self.w
+		return x
+
+	def num(self, buff, v, digits, x, y, pad=True):
+		# Draws non-negative int, zero- or space-padded to digits, without str formatting
+		v = max(0, v); k, n = 1, v
+		while n >= 10: n //= 10; k += 1
+		x = x_end = x + self.w * max(k, digits)
+		for n in range(max(k, digits)):
+			x -= self.w
+			if n < k or pad: buff.blit(self.digits[v % 10], x, y, 1)
+			v //= 10
+		return x_end
+
+	def date(self, buff, ts, x, y): # yy-mm-dd
+		ymd = ts_ymd(ts)
+		x = self.text(buff, '-', self.num(buff, ymd // 10000 % 100, 2, x, y), y)
+		x = self.text(buff, '-', self.num(buff, ymd // 100 % 100, 2, x, y), y)
+		return self.num(buff, ymd % 100, 2, x, y)
+
+def ts_ymd(ts):
+	# Returns yyyymmdd int for timestamp, same as from time.localtime() but without tuple
+	# Uses civil_from_days algorithm from https://howardhinnant.github.io/date_algorithms.html
+	z = ts // 86400 + ts_epoch_days + 719_468
+	doe = z - (era := z // 146_097) * 146_097
+	yoe = (doe - doe // 1460 + doe // 36_524 - doe // 146_096) // 365
+	doy = doe - (365 * yoe + yoe // 4 - yoe // 100)
+	mp = (5 * doy + 2) // 153; mo = mp + 3 if mp < 10 else mp - 9
+	return (yoe + era * 400 + (mo <= 2)) * 10000 + mo * 100 + doy - (153 * mp + 2) // 5 + 1
+
+def co2_log_line(font, buff, x, y, ts, ppms, ppm_msgs, kc=1, ys=0):
+	# HH:MM ppm [ppm...] [msg] - after kc ppm columns, rest wrap to next ys-spaced rows
+	# msg is always drawn on first row, after kc columns, to the right of scroller vline
+	ppm = 0
+	for c in range(len(ppms)): ppm = max(ppm, ppms[c])
 	for ppm_chk, msg in ppm_msgs:
 		if ppm >= ppm_chk: break
 	else: msg = ''
-	return f'{ts_rtc} {ppm: >04d} {msg}'
+	x = font.num(buff, ts // 3600 % 24, 2, x, y)
+	x = xc = font.num(buff, ts // 60 % 60, 2, font.text(buff, ':', x, y), y)
+	for c in range(len(ppms)):
+		if c and not c % kc: x = xc # wrap to next row
+		font.num(buff, ppms[c], 4, x + font.w, y + ys * (c // kc), pad=False); x += font.w * 5
+	if msg: font.text(buff, msg, xc + font.w * (5*kc + 1), y)
 
-async def co2_log_scroller( epd, readings,
-		x0=1, y0=3, y_line=10, export=False, ppm_msgs=dict() ):
+async def co2_log_scroller( epd, readings, font, font_hdr, refresh=None,
+		x0=1, y0=3, y_line=10, export=False, ppm_msgs=dict(), state=None ):
 	# x: 0 <x0> text <epd.w-1>
 	# y: 0 <y0> header hline <yh> lines[0] ... <yt> lines[lines_n-1] <epd.h-1>
+	# Header always uses 8px font_hdr, lines are spaced for font height
+	# Multiple ppm columns wrap into more rows per line, if they don't fit with labels
+	# state: list to keep line ring in, so that all lines get redrawn from it on restart
 	buffs, ppm_msgs = (epd.black, epd.red), sorted(ppm_msgs.items(), reverse=True)
-	if not export: await epd.clear()
-	else:
-		for buff in buffs: buff.fill(1)
-	ys = y_line; yh = y0 + ys + 3
+	cols, ppms = readings.columns, array.array('H', bytes(2*readings.columns))
+	msg_len = max([0] + list(len(msg) + 1 for ppm, msg in ppm_msgs))
+	kc = max(1, min(cols, ((epd.w - x0) // font.w - 5 - msg_len) // 5)) # columns per row
+	ys_row = y_line + font.h - 8; ys = ys_row * ((cols + kc - 1) // kc); yh = y0 + y_line + 3
 	lines_n = (epd.h - yh) // ys; yt = yh + ys * (lines_n - 1)
-	lines, line_t = list(), cs.namedtuple('Line', 'red tt ppm text')
+	# Lines are stored in a ring of ts/ppm/color arrays, starting at li, with ln lines
+	if state is None: state = list()
+	if state: li, ln, line_ts, line_red, line_ppms = state
+	else:
+		li, ln, line_ts, line_red = 0, 0, array.array('I', bytes(4*lines_n)), bytearray(lines_n)
+		line_ppms = array.array('H', bytes(2*cols*lines_n))
+		state.extend((li, ln, line_ts, line_red, line_ppms))
 	for ysv in 5, 4, 3, 2, 0: # pick vline step that will work with scrolling
 		if not ysv or ys%ysv == 0: break
+
+	def header_draw():
+		buff = buffs[not line_red[li]]
+		font_hdr.text(buff, ' CO2ppm', font_hdr.date(buff, line_ts[li], x0, y0), y0)
+		epd.black.hline(0, y0 + y_line, epd.w, 0)
+		if ysv:
+			for y in range(y0 + y_line + ysv//2, epd.h - y0 + 1, ysv):
+				epd.black.pixel(x0 + font.w*(5 + 5*kc) + font.w//2, y, 0)
+
+	for buff in buffs: buff.fill(1)
+	for n in range(ln): # restart - redraw lines from ring
+		k = (li + n) % lines_n
+		co2_log_line( font, buffs[line_red[k]], x0, yh + ys * n,
+			line_ts[k], memoryview(line_ppms)[k*cols:(k+1)*cols], ppm_msgs, kc, ys_row )
+	if ln: header_draw()
+	if not export: epd.dirty(); refresh() # clear screen
 	while True:
 		# Wait for new reading
-		ts_rtc, ppm = await readings.get()
-		tt, red = time.localtime(ts_rtc), bool(lines) and lines[-1].red
-		lines.append(line := line_t( not red,
-			tt, ppm, co2_log_text(tt, ppm, ppm_msgs) ))
+		ts_rtc = await readings.get(ppms)
+		red = not ln or not line_red[(li + ln - 1) % lines_n]
 		# Scroll lines up in both buffers, scrub top/bottom
-		if len(lines) > lines_n:
-			lines[:] = lines[1:]
+		if ln == lines_n:
+			li = (li + 1) % lines_n
 			for buff in buffs:
 				buff.scroll(0, -ys)
 				buff.fill_rect(0, 0, epd.w, yh, 1)
 				buff.fill_rect(0, yt, epd.w, yt + ys, 1)
-		# Replace header line
-		yy, mo, dd = lines[0].tt[:3]
-		buff = buffs[not lines[0].red]
-		buff.text(f'{yy%100:02d}-{mo:02d}-{dd:02d} CO2ppm', x0, y0, 0)
-		epd.black.hline(0, y0 + ys, epd.w, 0)
-		if ysv:
-			for y in range(y0 + ys + ysv//2, epd.h - y0 + 1, ysv):
-				epd.black.pixel(x0+8*10+4, y, 0)
+			epd.dirty()
+		elif (ln := ln + 1) == 1: epd.dirty() # vline dots get drawn for whole screen
+		else: epd.dirty(0, yh)
+		line_ts[k := (li + ln - 1) % lines_n], line_red[k] = ts_rtc, red
+		for c in range(cols): line_ppms[k*cols + c] = ppms[c]
+		state[0], state[1] = li, ln
+		header_draw() # replace header line
 		# Add new line at the end
-		buffs[line.red].text(line.text, x0, yh + ys * (len(lines) - 1), 0)
+		co2_log_line( font, buffs[red], x0,
+			y := yh + ys * (ln - 1), ts_rtc, ppms, ppm_msgs, kc, ys_row )
+		epd.dirty(y, y + ys)
 		# Display/dump buffers
-		if not export:
-			if readings.is_empty(): await epd.display() # batch updates otherwise
+		if not export: refresh() # scheduler merges/delays these as necessary
 		else: epd.export_image_buffers()
 
 
-async def main_err_print(epd, fail, x0=0, y0=1, ys=8, export=False):
-	# Traceback is compressed into one long line with alternating colors
-	# Standard "File <name>, line <n>, in" traceback-lines are shortened
-	# If it's still too long, only tail end is printed
-	cw, ch = (epd.w - 2*x0) // 8, (epd.h - 2*y0) // ys
-	hdr = '~ FATAL ERROR ~'[:cw]
-	if (n := cw - len(hdr) - 1) > 0: hdr += ' '*n
-	lines = [hdr]
-	lines.extend( re.sub(r'File "([^"]+)", line (\d+), in ', r'\1:\2: ', s) for s in
-		(re.sub(r'\s+', ' ', s.strip()) for s in re.sub('\n+', '\n', fail).splitlines()) )
-	for bn, buff in enumerate([epd.red, epd.black]):
-		buff.fill(1); fail = list()
-		for ln, line in enumerate(lines):
-			if ln & 1 == bn: line = ' '*len(line)
-			fail.append(line)
-		fail = ' '.join(fail)
-		fail = list(fail[n:n+cw] for n in range(0, len(fail), cw))[-ch:]
-		for line, y in zip(fail, range(y0, epd.h, ys)): buff.text(line, x0, y, 0)
-	if not export: await epd.display()
-	else: epd.export_image_buffers()
-
-def main_co2log(conf, epd, rtc): # split to gc its context on error
-	mhz19, components, readings = None, list(), ReadingsQueue()
+async def co2_graph_scroller( epd, readings, rollup, label, font_hdr, refresh=None,
+		x0=1, y0=3, y_line=10, y_row=4, ppm_max=2_000, export=False, ppm_msgs=dict(), restart=False ):
+	# Bar chart of min-max (black) and median (red) values from rollup buckets
+	# y: 0 <y0> header hline <yh> rows[rows_n-1] (oldest) ... rows[0] (newest) <epd.h-1>
+	# Only newest row gets redrawn on each update, others are scrolled up with new buckets
+	# rollup is updated by readings queue, so new buckets are detected via its steps counter
+	# restart: all rows are redrawn from rollup, header gets drawn on next reading
+	buffs = epd.black, epd.red
+	yh = y0 + y_line + 3; rows_n = min(rollup.n, (epd.h - yh) // y_row)
+	ppm_min, xw = 400, epd.w - 2*x0 - 1
+	ppm_x = lambda v: x0 + (max(ppm_min, min(ppm_max, v)) - ppm_min) * xw // (ppm_max - ppm_min)
+	xs_ppm = list(ppm_x(v) for v in ppm_msgs if ppm_min < v < ppm_max)
+	ppms, steps_last = array.array('H', bytes(2*readings.columns)), 0
+
+	def row_draw(k):
+		y = yh + y_row * (rows_n - 1 - k)
+		for buff in buffs: buff.fill_rect(0, y, epd.w, y_row, 1)
+		for x in xs_ppm: epd.black.pixel(x, y + y_row//2, 0) # dotted threshold lines
+		epd.dirty(y, y + y_row)
+		vmin, vmed, vmax = rollup.stats(k)
+		if not vmax: return
+		epd.black.fill_rect(x1 := ppm_x(vmin), y, ppm_x(vmax) - x1 + 1, y_row - 1, 0)
+		epd.black.fill_rect(x := ppm_x(vmed) - 1, y, 3, y_row - 1, 1)
+		epd.red.fill_rect(x, y, 3, y_row - 1, 0)
+
+	for buff in buffs: buff.fill(1)
+	if restart: # up to oldest non-empty row, as ones above it were never drawn
+		ks = list(k for k in range(rows_n) if rollup.stats(k)[2])
+		for k in range(ks[-1] + 1 if ks else 0): row_draw(k)
+		steps_last = rollup.steps
+	if not export: epd.dirty(); refresh() # clear screen
+	while True:
+		ts_rtc = await readings.get(ppms)
+		if steps := rollup.steps - steps_last: # new bucket(s) - scroll rows up
+			steps_last = rollup.steps
+			for buff in buffs:
+				buff.scroll(0, -y_row * min(steps, rows_n))
+				buff.fill_rect(0, 0, epd.w, yh, 1)
+			for k in range(min(steps, rows_n) - 1, 0, -1): row_draw(k)
+			epd.dirty()
+		row_draw(0)
+		# Replace header line
+		epd.black.fill_rect(0, 0, epd.w, yh, 1)
+		font_hdr.text(epd.black, label, font_hdr.date(epd.black, ts_rtc, x0, y0), y0)
+		epd.black.hline(0, y0 + y_line, epd.w, 0)
+		epd.dirty(0, yh)
+		# Display/dump buffers
+		if not export: refresh() # scheduler merges/delays these as necessary
+		else: epd.export_image_buffers()
+
+
+class Supervisor:
+	# Runs component tasks, restarting failed ones after exponential backoff delay
+	# Components are added as start(restart) funcs returning coroutine, with optional
+	#  async reinit() func, called before restart to re-init hardware used by that component
+	# Shared state like ReadingsQueue is kept by caller, so is not lost on restarts
+	# Failure is raised from run() after >max_failures for same component within window
+
+	def __init__( self, max_failures=5, window=3600,
+			backoff_min=5, backoff_max=600, verbose=False ):
+		self.p_log = verbose and (lambda *a: print('[supervisor]', *a))
+		self.max_failures, self.td_window = max_failures, round(window * 1000)
+		self.td_min, self.td_max = round(backoff_min * 1000), round(backoff_max * 1000)
+		self.components = list()
+
+	def add(self, name, start, reinit=None): self.components.append((name, start, reinit))
+
+	async def run(self): # cancels all other tasks when one of them fails
+		tasks = list(asyncio.create_task(self.supervise(*c)) for c in self.components)
+		try: return await asyncio.gather(*tasks)
+		finally:
+			for task in tasks: task.cancel()
+
+	async def supervise(self, name, start, reinit):
+		p_log, fails, restart = self.p_log, list(), False # fails = ticks_ms of recent ones
+		while True:
+			try:
+				if restart and reinit: await reinit()
+				return await start(restart)
+			except Exception as err:
+				fails.append(tk := time.ticks_ms())
+				while time.ticks_diff(tk, fails[0]) > self.td_window: fails.pop(0)
+				if len(fails) > self.max_failures: raise
+				delay = min(self.td_max, self.td_min << (len(fails) - 1))
+				p_err( f'[supervisor] Component {name} failed'
+					f' [{len(fails)}/{self.max_failures}]: {err_fmt(err)}' )
+				if p_log: import sys; sys.print_exception(err)
+			p_log and p_log(f'Restarting {name} in {delay/1000:,.1f}s')
+			await asyncio.sleep_ms(delay)
+			restart = True
+
+async def main_co2log(conf, epd, clock): # split to gc its context on error
+	sensors, power = list(), None
+	sup = Supervisor(**conf_vals( conf, 'supervisor',
+		'max_failures window backoff_min backoff_max verbose' ))
+	if metrics: sup.add('metrics', lambda restart: metrics.run())
 	if conf.sensor_enabled:
-		uart_id, rx, tx = conf_vals(conf, 'sensor', 'uart pin_rx pin_tx', flat=True)
-		mhz19 = MHZ19(machine.UART(
-			uart_id, rx=machine.Pin(rx), tx=machine.Pin(tx),
-			baudrate=9600, bits=8, stop=1, parity=None ))
-		components.append(sensor_poller(
-			conf, mhz19, rtc, readings, verbose=conf.sensor_verbose ))
+		uart_kws = lambda sc: dict( rx=machine.Pin(sc['pin_rx']),
+			tx=machine.Pin(sc['pin_tx']), baudrate=9600, bits=8, stop=1, parity=None )
+		for name, sc in conf.sensors or [('', conf_vals(conf, 'sensor', sensor_conf_keys))]:
+			sensors.append((name, MHZ19(machine.UART(sc['uart'], **uart_kws(sc))), sc))
+		async def sensors_reinit(): # drops any stuck UART state, sensors stay powered-on
+			for name, mhz19, sc in sensors: mhz19.uart.init(**uart_kws(sc))
+	columns = 1 if conf.sensor_merge == 'median' else max(1, len(sensors))
+	rollups = dict(hourly=ReadingsRollup(3600, 64), daily=ReadingsRollup(86400, 64))
+	readings = ReadingsQueue(columns=columns, rollups=tuple(rollups.values()))
+	if sensors:
+		await clock.sync()
+		boot_mark('rtc-sync')
+		sup.add('rtc', lambda restart: clock.run())
+		if rlog := conf.storage_enabled:
+			rlog = ReadingsLog(**conf_vals(
+				conf, 'storage', 'path segments segment_records verbose' ), columns=columns)
+			rlog.open()
+			if conf.storage_dump: sup.add( 'dump',
+				lambda restart: history_dump_task(rlog, verbose=conf.storage_verbose) )
+		if wake := conf.power_mode != 'off':
+			power = PowerManager(
+				**conf_vals(conf, 'power', 'mode sleep_min sleep_max alarm_pin verbose'),
+				clock=clock, state_path=f'{conf.storage_path}.wake' )
+			if power.deep and not rlog:
+				raise ValueError('[power] mode=deepsleep requires [storage] to be enabled')
+			if conf.screen_worker: # lightsleep stops clocks for both cores
+				raise ValueError('[power] sleep modes cannot be used with [screen] worker=yes')
+			if rlog: power.hooks.append(rlog.close)
+			power.checks.append(lambda: not readings.is_empty())
+			wake = power.deep and power.wake_state()
+		sup.add('sensor', lambda restart: sensor_poller(
+			conf, sensors, clock, readings, rlog=rlog, power=power,
+			wake=not restart and wake, restart=restart, verbose=conf.sensor_verbose ), sensors_reinit)
 	if conf.screen_test_fill:
-		ts_rtc = rtc and await rtc.read()
+		ts_rtc = clock.time()
+		from co2log_extras import co2_log_fake_gen
 		co2_gen = co2_log_fake_gen(ts_rtc=ts_rtc, td=conf.sensor_interval)
-		for ts_rtc, ppm in co2_gen: readings.put((ts_rtc, ppm))
-	components.append(co2_log_scroller(
-		epd, readings, export=conf.screen_test_export,
-		ppm_msgs=conf.ppm_thresholds, **conf_vals(conf, 'screen', 'x0 y0 y_line') ))
+		for ts_rtc, ppm in co2_gen: readings.put(ts_rtc, [ppm])
+	if not (export := conf.screen_test_export):
+		sched = RefreshScheduler(epd, *conf_vals(
+			conf, 'screen_refresh', 'min batch stale', flat=True ), verbose=conf.screen_verbose)
+		sup.add('refresh', sched.run, epd.hw_reset)
+		if power: power.checks.append(sched.busy)
+	scroller_kws = dict( export=export, refresh=not export and sched.request,
+		ppm_msgs=conf.ppm_thresholds, **conf_vals(conf, 'screen', 'x0 y0 y_line') )
+	font_hdr = GlyphCache('-: CO2pmhd' + ''.join(conf.ppm_thresholds.values()))
+	if (mode := conf.screen_mode) == 'log':
+		font_scale = tuple(map(int, conf.screen_font_scale.split('x')))
+		font = font_hdr
+		if font_scale != (1, 1) or conf.screen_font_file: font = GlyphCache(
+			':' + ''.join(conf.ppm_thresholds.values()), font_scale, conf.screen_font_file )
+		state = list() # line ring, kept between restarts
+		sup.add('screen', lambda restart: co2_log_scroller(
+			epd, readings, font, font_hdr, state=state, **scroller_kws ))
+	elif mode in ('graph-hourly', 'graph-daily'):
+		if mode == 'graph-hourly': rollup, label = rollups['hourly'], ' CO2 1h'
+		else: rollup, label = rollups['daily'], ' CO2 1d'
+		sup.add('screen', lambda restart: co2_graph_scroller(
+			epd, readings, rollup, label, font_hdr, restart=restart,
+			y_row=conf.screen_graph_row, ppm_max=conf.screen_graph_ppm_max, **scroller_kws ))
+	else: raise ValueError(f'Unrecognized [screen] mode value: {mode}')
 	print('--- CO2Log start ---')
-	try: return await asyncio.gather(*components)
+	boot_mark('start', last=not sensors) # printed after first reading otherwise
+	try: return await sup.run()
 	finally: print('--- CO2Log stop ---')
 
 async def main():
+	global metrics
 	print('--- CO2Log init ---')
 	conf = conf_parse('config.ini')
+	boot_mark('conf')
+	if conf.metrics_enabled: metrics = Metrics(conf.metrics_interval)
 	i2c, sda, scl = conf_vals(conf, 'rtc', 'i2c pin_sda pin_scl', flat=True)
 	rtc = RTC_DS3231(machine.I2C(i2c, sda=machine.Pin(sda), scl=machine.Pin(scl)))
+	clock = RTCClock(rtc, **conf_vals(conf, 'rtc', 'sync_interval sync_retry set_machine verbose'))
 	epd = EPD_2in13_B_V4_Portrait(
-		timeout=conf.screen_timeout, verbose=conf.screen_verbose )
+		**conf_vals(conf, 'screen', 'timeout partial_updates worker verbose'),
+		**conf_vals(conf, 'screen_test', 'export_format export_keyframes') )
 	if not (epd_export := conf.screen_test_export):
 		epd = await epd.hw_init( machine.SPI(conf.screen_spi),
 			**conf_vals(conf, 'screen_pin', 'dc cs reset busy') )
+		boot_mark('hw-init')
 
-	try: return await main_co2log(conf, epd, rtc)
+	try: return await main_co2log(conf, epd, clock)
 	except Exception as err: fail = err
 	gc.collect() # in case it was a mem shortage
 	gc.threshold(gc.mem_free() // 4 + gc.mem_alloc())
@@ -469,12 +1408,12 @@ async def main():
 	err = io.StringIO()
 	sys.print_exception(fail, err)
 	err, fail = None, err.getvalue()
-	if rtc:
-		try:
-			yy, mo, dd, hh, mm = time.localtime(await rtc.read())[:5]
-			fail += f'\n[at {yy%100:02d}-{mo:02d}-{dd:02d} {hh:02d}:{mm:02d}]'
-		except: pass
-	await main_err_print(epd, fail, export=epd_export)
+	if ts_rtc := clock.time():
+		yy, mo, dd, hh, mm = time.localtime(ts_rtc)[:5]
+		fail += f'\n[at {yy%100:02d}-{mo:02d}-{dd:02d} {hh:02d}:{mm:02d}]'
+	import co2log_extras
+	await co2log_extras.main_err_print(epd, fail, export=epd_export)
 
+boot_mark('import')
 def run(): asyncio.run(main())
 if __name__ == '__main__': run()
@@ -0,0 +1,94 @@
+#!/usr/bin/env python
+
+import os, sys, re
+
+
+def parse_line(line):
+	'''Returns (uptime, {name: (count, sum, min, max, {bucket: count})})
+		for "-mx- ..." line from main.py script output, or None for any other line.'''
+	if (n := line.find('-mx- ')) < 0: return
+	uptime, *vals = line[n+5:].split()
+	metrics = dict()
+	for val in vals:
+		k, _, val = val.partition('=')
+		*nums, hist = val.split('/', 4)
+		hist = dict(map(int, b.split(':')) for b in hist.split(',') if b)
+		metrics[k] = *map(int, nums), hist
+	return int(uptime), metrics
+
+def bucket_range(b):
+	'Range of values [a, b] counted in log2 histogram bucket, as used in main.py'
+	return (0, 0) if not b else (2**(b-1), 2**b - 1)
+
+def hist_percentile(hist, count, vmin, vmax, p):
+	'Estimates p-th percentile from bucket counts, interpolating within bucket and min/max'
+	rank, n = p / 100 * count, 0
+	for b in sorted(hist):
+		if n + hist[b] >= rank:
+			a, z = bucket_range(b)
+			a, z = max(a, vmin), min(z, vmax)
+			return a + (z - a) * max(0, rank - n) / hist[b]
+		n += hist[b]
+	return vmax
+
+
+def main(args=None):
+	import argparse, textwrap
+	dd = lambda text: re.sub( r' \t+', ' ',
+		textwrap.dedent(text).strip('\n') + '\n' ).replace('\t', '  ')
+	parser = argparse.ArgumentParser(
+		formatter_class=argparse.RawTextHelpFormatter, description=dd('''
+			Summarize metrics lines from main.py script console output.
+			Requires [metrics] enabled=yes option, which makes script print
+				"-mx- ..." lines with stats for each interval, which are aggregated here.
+			Example: mpremote run main.py | tee co2log.txt; %(prog)s co2log.txt'''))
+	parser.add_argument('logs', nargs='*', help=dd('''
+		Log file(s) with main.py console output. Default is to read stdin.'''))
+	parser.add_argument('-n', '--last', metavar='n', type=int, help=dd('''
+		Only summarize last N metrics intervals, e.g. to only look at recent values.'''))
+	parser.add_argument('-p', '--percentiles', metavar='list', default='50 90 99', help=dd('''
+		Space-separated list of percentiles to estimate from histograms.
+		These are approximate, as histogram buckets are powers of two.
+		Default: %(default)s'''))
+	parser.add_argument('-i', '--intervals', action='store_true', help=dd('''
+		Print per-interval count/mean/max table for each metric as well.'''))
+	opts = parser.parse_args(sys.argv[1:] if args is None else args)
+
+	lines = list()
+	for p in opts.logs or ['-']:
+		src = sys.stdin if p == '-' else open(p, errors='replace')
+		with src: lines.extend(filter(None, map(parse_line, src)))
+	if opts.last: lines = lines[-opts.last:]
+	if not lines: parser.error('No metrics lines found in the input')
+	pcs = list(map(float, opts.percentiles.split()))
+
+	stats = dict() # name: [count, sum, min, max, hist]
+	for uptime, metrics in lines:
+		for k, (count, vsum, vmin, vmax, hist) in metrics.items():
+			if not (st := stats.get(k)): st = stats[k] = [0, 0, vmin, vmax, dict()]
+			st[0] += count; st[1] += vsum; st[2] = min(st[2], vmin); st[3] = max(st[3], vmax)
+			for b, n in hist.items(): st[4][b] = st[4].get(b, 0) + n
+
+	print(f'Intervals: {len(lines):,d}')
+	cols = ['metric', 'count', 'mean', 'min', 'max'] + list(f'p{pc:g}' for pc in pcs)
+	rows = list()
+	for k, (count, vsum, vmin, vmax, hist) in stats.items():
+		rows.append([k, f'{count:,d}', f'{vsum / count:,.1f}', f'{vmin:,d}', f'{vmax:,d}'] + list(
+			f'{hist_percentile(hist, count, vmin, vmax, pc):,.0f}' for pc in pcs ))
+	ws = list(max(len(row[n]) for row in [cols] + rows) for n in range(len(cols)))
+	for row in [cols] + rows:
+		print('  ' + '  '.join(v.ljust(w) if not n else v.rjust(w) for n, (v, w) in enumerate(zip(row, ws))))
+
+	if opts.intervals:
+		for k in stats:
+			print(f'\n{k} [uptime count mean min max]:')
+			for uptime, metrics in lines:
+				if not (m := metrics.get(k)): continue
+				print( f'  {uptime:>9,d}s {m[0]:>6,d}'
+					f' {m[1] / m[0]:>12,.1f} {m[2]:>10,d} {m[3]:>10,d}' )
+
+if __name__ == '__main__':
+	try: sys.exit(main())
+	except BrokenPipeError: # stdout pipe closed
+		os.dup2(os.open(os.devnull, os.O_WRONLY), sys.stdout.fileno())
+		sys.exit(1)
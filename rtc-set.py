@@ -1,5 +1,7 @@
 import machine, time
 
+p_err = lambda *a: print('ERROR:', *a)
+
 def rtc_conf_parse(conf_file):
 	with open(conf_file, 'rb') as src:
 		sec, conf_lines = None, dict()
@@ -43,18 +45,20 @@ class RTC_DS3231:
 		bs = self.i2c.readfrom_mem(0x68, 0x00, 7)
 		return time.mktime(self._decode(bs))
 
-if __name__ == '__main__':
-	tt_now = (2024, 9, 7, 19, 2, 6, 5, 251)
-
+def rtc_init(conf_file='config.ini'): # also used by rtc-sync.py, which sends code above to board
 	conf = dict(i2c=0, pin_sda=16, pin_scl=17)
-	try: conf_lines = rtc_conf_parse('config.ini')
+	try: conf_lines = rtc_conf_parse(conf_file)
 	except OSError: pass
 	else:
 		for key_raw, key, val in conf_lines.get('rtc') or list():
 			if key in conf: conf[key] = int(val)
-
-	rtc = RTC_DS3231(machine.I2C( conf['i2c'],
+	return RTC_DS3231(machine.I2C( conf['i2c'],
 		sda=machine.Pin(conf['pin_sda']), scl=machine.Pin(conf['pin_scl']) ))
+
+if __name__ == '__main__':
+	tt_now = (2024, 9, 7, 19, 2, 6, 5, 251)
+
+	rtc = rtc_init()
 	rtc.set(tt_now)
 
 	ts = rtc.read()
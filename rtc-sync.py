@@ -0,0 +1,232 @@
+#!/usr/bin/env python
+
+import pathlib as pl, contextlib as cl, statistics as st
+import os, sys, time, select, calendar, subprocess
+
+
+class RawREPL:
+	'''Micropython raw REPL protocol over read(n)/write(bs) functions.
+		Ctrl-A enters raw mode, then each "<code> Ctrl-D" gets "OK", stdout,
+			Ctrl-D, stderr, Ctrl-D and ">" prompt back from the board.
+		read(n) should return None if there's no data within some short timeout.'''
+
+	def __init__(self, read, write, timeout=10.0):
+		self.read, self.write, self.timeout, self.buff, self.ts_recv = read, write, timeout, b'', 0
+
+	def read_until(self, end):
+		'Returns (data-before-end, time when end was received), raises TimeoutError/EOFError'
+		ts_end = time.monotonic() + self.timeout
+		while (n := self.buff.find(end)) < 0:
+			if bs := self.read(4096): self.buff += bs; self.ts_recv = time.time()
+			elif bs is not None: raise EOFError('Board connection closed')
+			elif time.monotonic() > ts_end:
+				raise TimeoutError(f'No {end!r} from board for {self.timeout:,.1f}s')
+		bs, self.buff = self.buff[:n], self.buff[n+len(end):]
+		return bs, self.ts_recv
+
+	def enter(self):
+		self.write(b'\r\x03\x03') # interrupt running script, if any
+		while self.read(4096): pass
+		self.buff = b''; self.write(b'\x01')
+		self.read_until(b'raw REPL; CTRL-B to exit\r\n>')
+
+	def exit(self, reset=False):
+		self.write(b'\x02' + b'\x04' * reset) # soft-reset from normal REPL runs main.py again
+
+	def exec(self, code, chunk=256):
+		'''Runs code on the board, returning (stdout, ts_sent, ts_recv) tuple,
+			where ts_sent/ts_recv are times of Ctrl-D sent and stdout end received.'''
+		for n in range(0, len(bs := code.encode()), chunk): # small chunks for older firmwares
+			if n: time.sleep(0.01)
+			self.write(bs[n:n+chunk])
+		ts_sent = time.time(); self.write(b'\x04')
+		if (res := self.read_until(b'OK')[0]).strip():
+			raise RuntimeError(f'Unexpected raw REPL response: {res!r}')
+		out, ts_recv = self.read_until(b'\x04')
+		if (err := self.read_until(b'\x04>')[0]).strip():
+			raise RuntimeError(f'Board error:\n{err.decode(errors="replace").strip()}')
+		return out.decode(errors='replace'), ts_sent, ts_recv
+
+
+# Code for the board, after RTC_DS3231 and rtc_init() from rtc-set.py
+# _rs_read() prints time registers as hex, after they change with edge=True
+board_code = '''
+import binascii
+rtc, _rs_buf = rtc_init(), bytearray(7)
+def _rs_read(edge):
+	rd = rtc.i2c.readfrom_mem_into; rd(0x68, 0, _rs_buf)
+	if edge:
+		s0 = _rs_buf[0]
+		while _rs_buf[0] == s0: rd(0x68, 0, _rs_buf)
+	print(binascii.hexlify(_rs_buf).decode())
+def _rs_write(bs): rtc.i2c.writeto_mem(0x68, 0, bs); print()
+'''
+
+def rtc_regs_decode(bs):
+	'Returns timestamp from DS3231 time registers, in same timezone as RTC itself'
+	bcd = lambda v: v - 6 * (v >> 4)
+	ss, mm, hh, wd, dd, mo, yy = (bcd(b & m) for m, b in zip(b'\x7f\x7f\x3f\x07\x3f\x1f\xff', bs))
+	if bs[2] & 0x40: hh = bcd(bs[2] & 0x1f) % 12 + 12 * bool(bs[2] & 0x20) # 12h mode
+	return calendar.timegm((yy + 2000, mo, dd, hh, mm, ss))
+
+def rtc_regs_encode(tt): # same as RTC_DS3231.set() in rtc-set.py, from host time-tuple
+	yy, mo, dd, hh, mm, ss, wd = tt[:7]
+	return bytes(v + 6 * (v // 10) for v in (ss, mm, hh, wd, dd, mo, yy - 2000))
+
+
+class RTCSync:
+	'''Sets/compares DS3231 time against host clock, over RawREPL.
+		Board latency is estimated as half of median round-trip time for _rs_read() calls,
+			and is used both ways - to send time write so that it executes on the exact
+			second boundary, which resets RTC sub-second counter, and to get host time
+			when RTC seconds change in _rs_read(edge=True), to compare clocks.'''
+
+	def __init__(self, repl, utc=False, verbose=False):
+		self.repl, self.utc, self.lat = repl, utc, None
+		self.p_log = verbose and (lambda *a: print('[rtc-sync]', *a, file=sys.stderr))
+
+	def ts_host(self, ts): # unix time to same timezone as RTC, keeping fractional part
+		return ts if self.utc else calendar.timegm(time.localtime(int(ts))) + ts % 1
+
+	def setup(self, rtc_set_code):
+		self.repl.enter()
+		self.repl.exec(rtc_set_code.split('\nif __name__ ==', 1)[0] + board_code)
+
+	def probe(self, n):
+		rtts = list()
+		for _ in range(n):
+			out, ts_sent, ts_recv = self.repl.exec('_rs_read(0)')
+			rtts.append(ts_recv - ts_sent)
+		self.lat = st.median(rtts) / 2
+		self.p_log and self.p_log( f'Round-trip latency [{n}]: min={min(rtts)*1e3:,.1f}'
+			f' med={st.median(rtts)*1e3:,.1f} max={max(rtts)*1e3:,.1f} ms' )
+		return rtts
+
+	def offset(self):
+		'Returns (ts_host, rtc_offset) for next RTC seconds edge, offset = rtc - host time'
+		out, ts_sent, ts_recv = self.repl.exec('_rs_read(1)')
+		ts_rtc, ts = rtc_regs_decode(bytes.fromhex(out.strip())), ts_recv - self.lat
+		return ts, ts_rtc - self.ts_host(ts)
+
+	def set(self, margin=0.5):
+		'Writes time to RTC on next whole second after margin, returns target unix time'
+		ts = int(time.time() + self.lat + margin) + 1
+		bs = rtc_regs_encode((time.gmtime if self.utc else time.localtime)(ts))
+		self.p_log and self.p_log(f'Writing {bs.hex()} at {ts} - {self.lat*1e3:,.1f}ms')
+		time.sleep(max(0, ts - self.lat - time.time()))
+		self.repl.exec(f'_rs_write({bs!r})')
+		return ts
+
+
+def main(args=None):
+	import argparse, textwrap, re
+	dd = lambda text: re.sub( r' \t+', ' ',
+		textwrap.dedent(text).strip('\n') + '\n' ).replace('\t', '  ')
+	parser = argparse.ArgumentParser(
+		formatter_class=argparse.RawTextHelpFormatter, description=dd('''
+			Set DS3231 RTC time from host clock via micropython raw REPL, or measure its drift.
+			Interrupts any running script on the board, e.g. main.py, see -r/--reset option.
+			Round-trip latency to the board is measured first, to time the write so that
+				it lands on the exact second boundary, after which next RTC seconds change
+				is used to check how far RTC is from the host clock.
+			Example: %(prog)s -p /dev/ttyACM0 -s rtc.state -r'''))
+	group = parser.add_argument_group('Device connection')
+	group.add_argument('-p', '--port', metavar='path', help=dd('''
+		Serial port device (e.g. /dev/ttyACM0) or pty connected to micropython REPL.
+		Will be switched to raw mode if it's a tty.'''))
+	group.add_argument('-c', '--cmd', metavar='command', help=dd('''
+		Shell command to run and talk to over its stdin/stdout pipes, instead of -p/--port.
+		Intended for testing, with something emulating micropython raw REPL.'''))
+	group.add_argument('--timeout', metavar='seconds', type=float, default=10.0,
+		help='Timeout for any response from the board. Default: %(default)ss')
+	group.add_argument('--rtc-set', metavar='file', default=pl.Path(__file__).parent / 'rtc-set.py',
+		help=dd('''
+			rtc-set.py file with RTC_DS3231 and rtc_init() code to send to the board.
+			It uses config.ini on the board for [rtc] i2c/pin settings, if any.
+			Default: %(default)s'''))
+	group.add_argument('-r', '--reset', action='store_true', help=dd('''
+		Soft-reset the board when done, e.g. to restart main.py script on it.'''))
+	group = parser.add_argument_group('Time sync')
+	group.add_argument('-m', '--measure', action='store_true', help=dd('''
+		Only compare RTC with host clock, without setting it,
+			printing offset for every sample, and drift rate in ppm from those.
+		Drift within one run is only accurate to a few ppm with default samples/interval,
+			but with -s/--state file, it is also calculated since last time RTC was set.'''))
+	group.add_argument('-n', '--samples', metavar='n', type=int, default=5,
+		help='Number of RTC vs host clock samples for -m/--measure. Default: %(default)s')
+	group.add_argument('-i', '--interval', metavar='seconds', type=float, default=30.0,
+		help='Interval between -m/--measure samples. Default: %(default)ss')
+	group.add_argument('--probes', metavar='n', type=int, default=8,
+		help='Number of round-trip latency probes to do first. Default: %(default)s')
+	group.add_argument('--max-error', metavar='ms', type=float, default=100.0, help=dd('''
+		Exit with error if RTC is further than this from host clock after setting it.
+		Default: %(default)sms'''))
+	group.add_argument('-u', '--utc', action='store_true', help=dd('''
+		Set/compare RTC time in UTC instead of local time, which main.py uses by default.'''))
+	group.add_argument('-s', '--state', metavar='file', help=dd('''
+		File to store host time of last RTC set in, to report drift since then with -m/--measure.'''))
+	group.add_argument('-v', '--verbose', action='store_true',
+		help='Print latency probe stats and other debug info to stderr.')
+	opts = parser.parse_args(sys.argv[1:] if args is None else args)
+
+	if bool(opts.port) == bool(opts.cmd):
+		parser.error('Exactly one of -p/--port or -c/--cmd options must be specified')
+	p_state = opts.state and pl.Path(opts.state)
+
+	with cl.ExitStack() as ctx:
+		if opts.port:
+			fd = os.open(opts.port, os.O_RDWR | os.O_NOCTTY)
+			ctx.callback(os.close, fd)
+			if os.isatty(fd): import tty; tty.setraw(fd)
+			fd_in = fd_out = fd
+		else:
+			proc = ctx.enter_context(subprocess.Popen(
+				opts.cmd, shell=True, stdin=subprocess.PIPE, stdout=subprocess.PIPE ))
+			ctx.callback(proc.kill)
+			fd_in, fd_out = proc.stdout.fileno(), proc.stdin.fileno()
+		def read(n):
+			if not select.select([fd_in], [], [], 0.2)[0]: return None
+			return os.read(fd_in, n)
+
+		repl = RawREPL(read, lambda bs: os.write(fd_out, bs), timeout=opts.timeout)
+		sync = RTCSync(repl, utc=opts.utc, verbose=opts.verbose)
+		sync.setup(pl.Path(opts.rtc_set).read_text())
+		ctx.callback(repl.exit, opts.reset)
+		rtts = sync.probe(opts.probes)
+		print( f'Board round-trip latency: {st.median(rtts)*1e3:,.1f}ms'
+			f' [{min(rtts)*1e3:,.1f} - {max(rtts)*1e3:,.1f}ms]' )
+
+		if not opts.measure:
+			ts_set = sync.set()
+			ts, offset = sync.offset()
+			print( 'RTC set to {} [{}], check offset: {:+,.1f}ms'.format( time.strftime(
+				'%Y-%m-%d %H:%M:%S', (time.gmtime if opts.utc else time.localtime)(ts_set) ),
+				'UTC' if opts.utc else 'local time', offset * 1e3 ) )
+			if abs(offset) * 1e3 > opts.max_error:
+				print(f'ERROR: RTC offset is above --max-error={opts.max_error:,.1f}ms', file=sys.stderr)
+				return 1
+			if p_state: p_state.write_text(f'{ts_set}\n')
+			return
+
+		samples = list()
+		for n in range(opts.samples):
+			if n: time.sleep(max(0, samples[-1][0] + opts.interval - time.time()))
+			samples.append(sample := sync.offset()); ts, offset = sample
+			print(f'Sample {n+1}/{opts.samples}: RTC offset {offset*1e3:+,.1f}ms')
+		offsets = list(offset for ts, offset in samples)
+		print( f'RTC offset: mean={st.mean(offsets)*1e3:+,.1f}ms'
+			f' [{min(offsets)*1e3:+,.1f} - {max(offsets)*1e3:+,.1f}ms]' )
+		if len(samples) > 1 and (td := samples[-1][0] - samples[0][0]) > 0:
+			slope = st.linear_regression(*zip(*samples)).slope
+			print(f'Drift over {td:,.0f}s: {slope*1e6:+,.1f} ppm')
+		try: ts_set = int(p_state.read_text().strip()) if p_state else None
+		except FileNotFoundError: ts_set = None
+		if ts_set and (td := ts - ts_set) > 0:
+			print( f'Drift since last set {td/86400:,.1f} days ago:'
+				f' {offset/td*1e6:+,.2f} ppm [offset={offset:+,.3f}s]' )
+
+if __name__ == '__main__':
+	try: sys.exit(main())
+	except BrokenPipeError: # stdout pipe closed
+		os.dup2(os.open(os.devnull, os.O_WRONLY), sys.stdout.fileno())
+		sys.exit(1)
@@ -0,0 +1,47 @@
+import pathlib as pl, importlib.util, subprocess, types, sys, re
+
+import pytest
+
+
+root = pl.Path(__file__).resolve().parent.parent
+
+def load_script(name):
+	'Imports one of the repo scripts, which have dashes in names, as a module'
+	spec = importlib.util.spec_from_file_location(name.replace('-', '_'), root / f'{name}.py')
+	spec.loader.exec_module(mod := importlib.util.module_from_spec(spec))
+	return mod
+
+def run_sim(*args, conf=None, tmp_path=None, output=None, timeout=300):
+	'''Runs main-sim.py with args and optional config.ini text,
+		returning (stats, console) with stats parsed from its stderr as {key: value} strings.'''
+	if conf is not None:
+		(p := tmp_path / 'config.ini').write_text(conf); args = ['-c', str(p), *args]
+	if output is None and tmp_path: output = tmp_path / 'console.txt'
+	if output: args = ['-o', str(output), *args]
+	proc = subprocess.run( [sys.executable, root / 'main-sim.py', *map(str, args)],
+		capture_output=True, text=True, timeout=timeout )
+	assert proc.returncode == 0, proc.stderr
+	stats = dict(re.findall(r'\b([-\w]+)=([-+\w.,]+)', proc.stderr))
+	stats['readings'] = re.search(r'readings: ([\d,]+)', proc.stderr)[1]
+	return ( {k: v.replace(',', '') for k, v in stats.items()},
+		output.read_text(errors='replace') if output else '' )
+
+
+@pytest.fixture
+def co2log(tmp_path, monkeypatch):
+	'''main.py loaded with main-sim.py shims and simulated board, running in tmp_path.
+		run(coro, timeout) runs coroutine in virtual-time event loop.'''
+	ms = load_script('main-sim')
+	ms.sim = ms.SimState(seed=1)
+	board = types.SimpleNamespace(pins=dict(), uarts=dict(), i2c=dict(), epd=None)
+	board.i2c[0x68] = ms.DS3231Device()
+	main = ms.load_main(root / 'main.py', board)
+	conf = main.CO2LogConf
+	board.epd = ms.EPDDevice(conf.screen_pin_dc, conf.screen_pin_cs, conf.screen_pin_busy)
+	monkeypatch.chdir(tmp_path)
+	loop = ms.VirtualTimeLoop()
+	def run(coro, timeout=None):
+		if timeout: coro = ms.asyncio.wait_for(coro, timeout)
+		with ms.sys_modules_patched(_thread=ms.thread_module()): return loop.run_until_complete(coro)
+	yield types.SimpleNamespace(sim=ms, main=main, board=board, run=run, path=tmp_path)
+	loop.close()
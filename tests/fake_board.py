@@ -0,0 +1,75 @@
+#!/usr/bin/env python
+# Micropython raw REPL stand-in for rtc-sync.py tests, over stdin/stdout or a pty
+# Runs sent code in CPython, with machine.I2C emulating DS3231 time registers,
+#  which run from host clock with specified offset/drift, in local time like on the board
+
+import os, sys, io, time, types, calendar, traceback, contextlib as cl
+
+
+class RTC:
+	def __init__(self, offset, drift_ppm, read_only):
+		self.drift, self.read_only = drift_ppm / 1e6, read_only
+		self.ts_set = time.time()
+		self.ts_base = calendar.timegm(time.localtime(int(self.ts_set))) + self.ts_set % 1 + offset
+
+	def regs(self):
+		ts = self.ts_base + (time.time() - self.ts_set) * (1 + self.drift)
+		yy, mo, dd, hh, mm, ss, wd = time.gmtime(int(ts))[:7]
+		return bytes((v // 10) << 4 | v % 10 for v in (ss, mm, hh, wd + 1, dd, mo, yy - 2000))
+
+	def set(self, bs):
+		if self.read_only: return
+		ss, mm, hh, wd, dd, mo, yy = ((b >> 4) * 10 + (b & 15) for b in bs)
+		self.ts_base, self.ts_set = calendar.timegm((yy + 2000, mo, dd, hh, mm, ss)), time.time()
+
+def machine_module(rtc):
+	class I2C:
+		def __init__(self, *a, **kw): pass
+		def readfrom_mem_into(self, addr, reg, buf):
+			time.sleep(0.0005); buf[:] = rtc.regs()[reg:reg+len(buf)]
+		def readfrom_mem(self, addr, reg, n): return rtc.regs()[reg:reg+n]
+		def writeto_mem(self, addr, reg, bs): rtc.set(bs)
+	m = types.ModuleType('machine')
+	m.I2C, m.Pin = I2C, lambda *a, **kw: None
+	return m
+
+
+def main(args=None):
+	import argparse
+	parser = argparse.ArgumentParser(description='Micropython raw REPL stand-in with DS3231 RTC.')
+	parser.add_argument('--offset', type=float, default=0, help='Initial RTC offset from host clock.')
+	parser.add_argument('--drift', metavar='ppm', type=float, default=0, help='RTC drift rate.')
+	parser.add_argument('--latency', metavar='s', type=float, default=0.005,
+		help='Delay before sending any response.')
+	parser.add_argument('--read-only', action='store_true', help='Ignore RTC time writes.')
+	parser.add_argument('--pty', action='store_true',
+		help='Create pty to talk over, printing its path to stdout, instead of using stdin/stdout.')
+	opts = parser.parse_args(sys.argv[1:] if args is None else args)
+
+	sys.modules['machine'] = machine_module(RTC(opts.offset, opts.drift, opts.read_only))
+	if not opts.pty: fd_in, fd_out = sys.stdin.fileno(), sys.stdout.fileno()
+	else:
+		import tty
+		fd_in, fd_pty = os.openpty(); tty.setraw(fd_in); fd_out = fd_in
+		print(os.ttyname(fd_pty), flush=True)
+
+	def send(bs): time.sleep(opts.latency); os.write(fd_out, bs)
+	ns, raw, code = dict(__name__='board'), False, b''
+	while True:
+		try: bs = os.read(fd_in, 4096)
+		except OSError: bs = b'' # pty closed
+		if not bs: break
+		for b in bs:
+			if not raw:
+				if b == 1: raw, code = True, b''; send(b'raw REPL; CTRL-B to exit\r\n>')
+			elif b == 2: raw = False
+			elif b != 4: code += bytes([b])
+			else:
+				send(b'OK'); out, err = io.StringIO(), ''
+				try:
+					with cl.redirect_stdout(out): exec(code.decode(), ns)
+				except Exception: err = traceback.format_exc()
+				send(out.getvalue().replace('\n', '\r\n').encode() + b'\x04' + err.encode() + b'\x04>')
+				code = b''
+
+if __name__ == '__main__': sys.exit(main())
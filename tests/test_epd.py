@@ -0,0 +1,137 @@
+import asyncio
+
+import pytest
+
+
+def epd_init(co2log, **kw):
+	main, conf = co2log.main, co2log.main.CO2LogConf
+	co2log.board.epd.epd = epd = main.EPD_2in13_B_V4_Portrait(**kw)
+	epd_iface = co2log.run(epd.hw_init( main.machine.SPI(conf.screen_spi),
+		dc=conf.screen_pin_dc, cs=conf.screen_pin_cs,
+		reset=conf.screen_pin_reset, busy=conf.screen_pin_busy ))
+	return epd, epd_iface
+
+def epd_display(co2log, epd, timeout=None):
+	st = co2log.sim.sim.stats; bs0 = st['spi_bytes']
+	co2log.run(epd.display(), timeout)
+	return st['spi_bytes'] - bs0
+
+def epd_ram_check(co2log, epd):
+	ram = co2log.board.epd.ram
+	assert ram[0] == epd.black_buff and ram[1] == epd.red_buff
+	assert not co2log.sim.sim.stats['epd_ram_mismatch']
+
+
+def test_full_update(co2log):
+	epd, epd_iface = epd_init(co2log)
+	assert epd_iface.w == epd.w == 128 and epd_iface.h == epd.h == 250
+	epd.black.fill(1); epd.red.fill(1)
+	epd.black.fill_rect(10, 20, 30, 40, 0); epd.red.hline(0, 100, 128, 0)
+	assert epd_display(co2log, epd) > 2 * 16 * 250 # both full buffers
+	epd_ram_check(co2log, epd)
+	assert epd.active is False and not co2log.board.pins[epd.p.reset.pin]
+	assert co2log.sim.sim.stats['epd_refreshes'] == 1
+
+def test_partial_updates(co2log):
+	epd, epd_iface = epd_init(co2log, partial_updates=2)
+	epd.black.fill(1); epd.red.fill(1)
+	full = epd_display(co2log, epd)
+	for n in range(2):
+		epd.black.fill_rect(0, y := 50 + n*20, 64, 8, 0); epd.dirty(y, y + 8)
+		tx = epd_display(co2log, epd)
+		assert 2 * 16 * 8 <= tx < full // 10 # only dirty rows, in both buffers
+		epd_ram_check(co2log, epd)
+	epd.red.fill_rect(0, 200, 64, 8, 0); epd.dirty(200, 208)
+	assert epd_display(co2log, epd) >= full # every partial_updates+1'th is full
+	epd_ram_check(co2log, epd)
+	epd.black.pixel(0, 0, 0); epd.dirty(0, 1); epd.black.pixel(0, 249, 0); epd.dirty(249, 250)
+	assert epd_display(co2log, epd) < full // 10 # two separate RAM windows
+	epd_ram_check(co2log, epd)
+
+def test_no_dirty_rows_full_update(co2log):
+	epd, epd_iface = epd_init(co2log, partial_updates=8)
+	full = epd_display(co2log, epd)
+	assert epd_display(co2log, epd) >= full # nothing marked - sends everything
+	epd_ram_check(co2log, epd)
+
+def test_spi_transactions(co2log):
+	# Counts CS-held SPI transactions, spi.write() calls and virtual time for each step
+	cs, st, tx = co2log.main.CO2LogConf.screen_pin_cs, co2log.sim.sim.stats, [0]
+	class Pins(dict):
+		def __setitem__(self, k, v):
+			if k == cs and not v and self.get(k, 1): tx[0] += 1
+			super().__setitem__(k, v)
+	co2log.board.pins = Pins(co2log.board.pins)
+	def step(func):
+		n0, wn0, vt0 = tx[0], st['spi_writes'], co2log.sim.sim.vt
+		res = func()
+		return tx[0] - n0, st['spi_writes'] - wn0, co2log.sim.sim.vt - vt0, res
+	# Init - swreset, then whole init table in one transaction
+	n, wn, td, (epd, epd_iface) = step(lambda: epd_init(co2log, partial_updates=4))
+	assert (n, wn) == (2, 1 + 5*2) and td < 0.25
+	# Full update of already-initialized screen - two RAM windows, update, sleep-mode
+	n, wn, td, tx_bytes = step(lambda: epd_display(co2log, epd))
+	assert (n, wn) == (4, 2*(4*2 + 2) + 1 + 2)
+	# Partial update after sleep - only releases reset line, same init, same number of
+	#  transactions/writes for a contiguous run of dirty rows, but less data
+	epd.black.pixel(3, 3, 0); epd.dirty(3, 4)
+	n, wn, td, tx_partial = step(lambda: epd_display(co2log, epd))
+	assert (n, wn) == (2 + 4, 11 + 23) and tx_partial < tx_bytes // 50
+	epd_ram_check(co2log, epd)
+	n, wn, td_wake, res = step(lambda: co2log.run(epd.hw_init()))
+	assert (n, wn) == (2, 11) and td_wake < 0.15 # no full reset pulse on wake
+	n, wn, td, res = step(lambda: co2log.run(epd.hw_init()))
+	assert (n, wn) == (0, 0) # already active
+
+def test_busy_stuck_timeout(co2log):
+	epd, epd_iface = epd_init(co2log, timeout=30)
+	co2log.board.epd.stuck = [(0, 10**6)]
+	with pytest.raises(asyncio.TimeoutError): epd_display(co2log, epd)
+	assert co2log.sim.sim.stats['epd_faults'] >= 1
+	co2log.board.epd.stuck, co2log.board.epd.busy_until = list(), 0
+	epd_display(co2log, epd) # works after stuck busy line recovers
+	epd_ram_check(co2log, epd)
+
+def test_sim_run(tmp_path):
+	from conftest import run_sim
+	stats = dict()
+	for n in 0, 8:
+		st, out = run_sim( '-t', '1d', '--seed', '1',
+			conf=f'[screen]\npartial-updates = {n}\n', tmp_path=tmp_path )
+		assert int(st['refreshes']) > 20 and st['ram-mismatch'] == '0'
+		stats[n] = int(st['spi-bytes']) / int(st['refreshes'])
+	assert stats[0] > 8_000 and stats[8] < stats[0] * 0.9
+
+
+def test_worker_updates(co2log):
+	epd, epd_iface = epd_init(co2log, partial_updates=2, worker=True)
+	epd.black.fill(1); epd.red.fill(1)
+	epd.black.fill_rect(10, 20, 30, 40, 0)
+	full = epd_display(co2log, epd)
+	epd_ram_check(co2log, epd)
+	assert epd.active is False and co2log.sim.sim.stats['epd_refreshes'] == 1
+	epd.black.fill_rect(0, 50, 64, 8, 0); epd.dirty(50, 58)
+	assert 2 * 16 * 8 <= epd_display(co2log, epd) < full // 10
+	epd_ram_check(co2log, epd)
+	assert not any(epd.rows_dirty) and not any(epd.w_rows)
+
+def test_worker_busy_stuck(co2log):
+	epd, epd_iface = epd_init(co2log, timeout=30, worker=True)
+	co2log.board.epd.stuck = [(0, 10**6)]
+	with pytest.raises(asyncio.TimeoutError): epd_display(co2log, epd)
+	co2log.board.epd.stuck, co2log.board.epd.busy_until = list(), 0
+	co2log.run(epd.hw_reset())
+	epd.black.pixel(5, 5, 0); epd.dirty(5, 6)
+	epd_display(co2log, epd) # worker thread is still running, re-inits display
+	epd_ram_check(co2log, epd)
+
+def test_worker_sim_run(tmp_path):
+	from conftest import run_sim
+	stats = dict()
+	for worker in 'no', 'yes':
+		st, out = run_sim( '-t', '8h', '--seed', '1', '--epd-stuck', '3h:30m',
+			conf=f'[screen]\nworker = {worker}\npartial-updates = 4\n', tmp_path=tmp_path )
+		assert int(st['refreshes']) > 10 and st['ram-mismatch'] == '0'
+		assert int(st['faults']) > 0 # epd stats line is last one with it
+		stats[worker] = st['refreshes'], st['spi-bytes'], st['readings']
+	assert stats['yes'] == stats['no']
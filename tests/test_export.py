@@ -0,0 +1,133 @@
+import subprocess, sys, time, re
+
+import pytest
+
+from conftest import root, run_sim
+
+pytest.importorskip('PIL')
+
+
+def edp_png(*args, stdin=None):
+	proc = subprocess.run( [sys.executable, root / 'edp-png.py', *map(str, args)],
+		stdin=stdin and open(stdin), capture_output=True, text=True, timeout=120 )
+	assert proc.returncode == 0, proc.stderr
+	return proc.stderr
+
+def frames_split(text, prefix='-epd-:DX '):
+	'Returns list of console chunks, each ending right before next delta-frame start'
+	lines, chunks = text.splitlines(keepends=True), ['']
+	for line in lines:
+		if line.startswith(prefix): chunks.append('')
+		chunks[-1] += line
+	return chunks
+
+@pytest.fixture(scope='module')
+def exports(tmp_path_factory):
+	'Same simulated run with b64 and delta export formats'
+	outs, p = dict(), tmp_path_factory.mktemp('export')
+	for fmt in 'b64', 'delta':
+		(d := p / fmt).mkdir()
+		run_sim( '-t', '8h', '--seed', '1', tmp_path=d, conf='[screen]\ntest-export = yes\n'
+			f'test-export-format = {fmt}\ntest-export-keyframes = 5\n' )
+		outs[fmt] = d / 'console.txt'
+	return outs
+
+
+def pngs_read(p): return list((p.name, p.read_bytes()) for p in sorted(p.iterdir()))
+
+def test_batch_dedup_decoded(exports, tmp_path):
+	# Each frame gets repeated with different base64 line-wrapping, which should be skipped
+	def rewrap(m):
+		blocks = re.findall(r'(?s)(-epd-:(?:BK|RD) [^\n]+\n)(.+?)\n\n', frame := m[0])
+		for hdr, data in blocks:
+			data = ''.join(line.removeprefix('-epd-:') for line in data.splitlines())
+			frame += '\n' + hdr + ''.join(f'-epd-:{data[n:n+100]}\n' for n in range(0, len(data), 100))
+		return frame + '\n'
+	text = re.sub(r'(?s)-epd-:BK .+?-epd-:RD .+?\n\n', rewrap, exports['b64'].read_text())
+	(p := tmp_path / 'twice.txt').write_text(text)
+	edp_png('-i', exports['b64'], '-d', tmp_path / 'once')
+	edp_png('-i', p, '-d', tmp_path / 'twice')
+	pngs = dict((k, pngs_read(tmp_path / k)) for k in ['once', 'twice'])
+	assert len(pngs['once']) > 20
+	assert list(png for name, png in pngs['twice']) == list(png for name, png in pngs['once'])
+
+@pytest.mark.parametrize('frame_range', ['2:-3', '-5:', '-8:-2', ':4', '-5:27'])
+def test_batch_range_stdin(exports, tmp_path, frame_range):
+	for fmt, p in exports.items():
+		edp_png('-i', p, f'-r={frame_range}', '-d', tmp_path / f'{fmt}-file')
+		edp_png(f'-r={frame_range}', '-d', tmp_path / f'{fmt}-stdin', stdin=p)
+		pngs = pngs_read(tmp_path / f'{fmt}-file')
+		assert pngs and pngs == pngs_read(tmp_path / f'{fmt}-stdin')
+	assert pngs_read(tmp_path / 'b64-file') == pngs_read(tmp_path / 'delta-file')
+
+def test_batch_stdin_memory(exports, tmp_path):
+	# Frames from non-seekable input are streamed, not all kept in memory
+	run = ( 'import sys, runpy, resource\nsys.argv[0] = sys.argv.pop(1)\n'
+		'try: runpy.run_path(sys.argv[0], run_name="__main__")\n'
+		'finally: print(f"maxrss={resource.getrusage(resource.RUSAGE_SELF).ru_maxrss}", file=sys.stderr)' )
+	text, rss = exports['delta'].read_text(), dict()
+	for n in 1, 100:
+		(p := tmp_path / f'x{n}.txt').write_text(text * n)
+		proc = subprocess.run( [ sys.executable, '-c', run, root / 'edp-png.py',
+			'-r=-2:', '-d', tmp_path / f'x{n}', '-j', '1' ], stdin=p.open(), capture_output=True, text=True )
+		assert proc.returncode == 0, proc.stderr
+		rss[n] = int(re.search(r'maxrss=(\d+)', proc.stderr)[1])
+	assert rss[100] - rss[1] < 10_000, rss # KiB, ~3k frames would be ~25M of lines
+
+def test_delta_all_frames(exports, tmp_path):
+	for fmt, p in exports.items(): edp_png('-i', p, '-d', tmp_path / fmt)
+	pngs = dict((fmt, sorted((tmp_path / fmt).iterdir())) for fmt in exports)
+	assert len(pngs['b64']) > 20
+	assert list(p.name for p in pngs['b64']) == list(p.name for p in pngs['delta'])
+	for p1, p2 in zip(pngs['b64'], pngs['delta']): assert p1.read_bytes() == p2.read_bytes()
+
+def test_delta_size(tmp_path):
+	# Delta export of test-fill replay, where whole screen scrolls, is smaller than full frames
+	sizes = dict()
+	for fmt in 'b64', 'delta':
+		st, out = run_sim( '-t', '4h', '--seed', '1', tmp_path=tmp_path,
+			conf='[screen]\ntest-fill = yes\ntest-export = yes\n'
+				f'test-export-format = {fmt}\ntest-export-keyframes = 20\n' )
+		sizes[fmt] = sum(len(line) for line in out.splitlines() if line.startswith('-epd-:'))
+	assert sizes['delta'] < sizes['b64'] / 2, sizes
+
+def test_export_keyframes_conf(co2log):
+	with pytest.raises(ValueError, match='test-export-keyframes'):
+		co2log.main.EPD_2in13_B_V4_Portrait(export_format='delta', export_keyframes=0)
+
+def test_delta_bad_frame(exports, tmp_path):
+	# Corrupted delta-frame and ones after it are skipped until next keyframe
+	chunks = frames_split(exports['delta'].read_text())
+	assert ' D 7 ' in chunks[8] and ' K 10 ' in chunks[11]
+	lines = chunks[8].splitlines(keepends=True) # DX header, then base64 lines
+	lines[1] = lines[1][:10] + ('A' if lines[1][10] != 'A' else 'B') + lines[1][11:]
+	chunks[8] = ''.join(lines)
+	(p := tmp_path / 'bad.txt').write_text(''.join(chunks))
+	err = edp_png('-i', p, '-d', tmp_path / 'bad')
+	assert 'Skipping bad delta-frame' in err and err.count('WARNING') == 1, err # once per run
+	edp_png('-i', exports['delta'], '-d', tmp_path / 'ok')
+	pngs = dict((k, sorted((tmp_path / k).iterdir())) for k in ['ok', 'bad'])
+	assert len(pngs['ok']) - len(pngs['bad']) == 3 # D7-D9 are not decoded
+	assert pngs['ok'][6].read_bytes() == pngs['bad'][6].read_bytes()
+	assert pngs['ok'][10].read_bytes() == pngs['bad'][7].read_bytes() # K10 frame
+	assert pngs['ok'][-1].read_bytes() == pngs['bad'][-1].read_bytes()
+
+def test_delta_follow(exports, tmp_path):
+	chunks = frames_split(exports['delta'].read_text())
+	(p := tmp_path / 'follow.txt').write_text(''.join(chunks[:8])) # up to D-frame #6
+	edp_png('-i', exports['b64'], '-n', 6, '-o', png6 := tmp_path / 'n6.png')
+	edp_png('-i', exports['b64'], '-n', 8, '-o', png8 := tmp_path / 'n8.png')
+	proc = subprocess.Popen( [ sys.executable, root / 'edp-png.py', '-i', p,
+		'-o', png := tmp_path / 'out.png', '-f', '--follow-interval', '0.1' ],
+		stderr=subprocess.PIPE, text=True )
+	def png_wait(png_exp, timeout=30):
+		for n in range(int(timeout / 0.1)):
+			if png.exists() and png.read_bytes() == png_exp.read_bytes(): return True
+			time.sleep(0.1)
+	try:
+		assert png_wait(png6)
+		with p.open('a') as dst: # D-frames #7 and #8 only, without next keyframe
+			for chunk in chunks[8:10]: dst.write(chunk); dst.flush()
+		assert png_wait(png8) # delta-frame state is kept from prescan
+	finally: proc.terminate(); err = proc.communicate(timeout=10)[1]
+	assert 'WARNING' not in err, err
@@ -0,0 +1,76 @@
+import subprocess, sys, csv
+
+import pytest
+
+from conftest import root, run_sim
+
+
+def fetch(tmp_path, sim_time='1h', out=('-o', 'out.csv')):
+	sim_cmd = ( f'{sys.executable} {root / "main-sim.py"} -c {tmp_path / "config.ini"}'
+		f' -d {tmp_path / "sim"} -t {sim_time} --stdin -o -' )
+	proc = subprocess.run( [ sys.executable, root / 'history-fetch.py',
+		*out, '--epoch', '1970', '-c', sim_cmd ],
+		capture_output=True, text=True, timeout=120, cwd=tmp_path )
+	assert proc.returncode == 0, proc.stderr
+	return proc.stderr
+
+def sim_fill(tmp_path, td='1d'): # runs sim without stdin to store some readings
+	run_sim('-d', tmp_path / 'sim', '-t', td, '--seed', '1', tmp_path=tmp_path,
+		conf='[storage]\nenabled = yes\nsegments = 3\nsegment-records = 32\n')
+
+def csv_rows(tmp_path):
+	with (tmp_path / 'out.csv').open() as src: return list(csv.DictReader(src))
+
+
+def test_fetch_resume(tmp_path):
+	sim_fill(tmp_path)
+	err = fetch(tmp_path)
+	assert 'Fetched 85 record(s), next index: 85' in err, err
+	rows = csv_rows(tmp_path)
+	assert list(int(row['index']) for row in rows) == list(range(85))
+	assert all(400 <= int(row['ppm']) < 2000 for row in rows)
+	assert (tmp_path / 'out.csv.state').read_text() == '85\n'
+	sim_fill(tmp_path, '3h') # 11 more readings, plus ones stored during first fetch
+	err = fetch(tmp_path)
+	n = int((tmp_path / 'out.csv.state').read_text())
+	assert n > 85 + 11 and f'Fetched {n-85} record(s), next index: {n}' in err, err
+	rows = csv_rows(tmp_path)
+	assert list(int(row['index']) for row in rows) == list(range(n))
+
+def test_fetch_overwritten(tmp_path):
+	sim_fill(tmp_path, '2d') # 170 records, only last 64-96 are kept
+	err = fetch(tmp_path)
+	assert 'WARNING: Records 0 - 95 were already overwritten' in err, err
+	assert int(csv_rows(tmp_path)[0]['index']) == 96
+
+def test_fetch_index_reset(tmp_path):
+	sim_fill(tmp_path)
+	fetch(tmp_path)
+	for p in (tmp_path / 'sim').glob('*.bin'): p.unlink() # storage wiped on the device
+	sim_fill(tmp_path, '3h')
+	err = fetch(tmp_path, sim_time='1d') # to still be running when re-fetch is requested
+	assert 'WARNING: Record index 85 is past last one on the device (11)' in err, err
+	n = int((tmp_path / 'out.csv.state').read_text())
+	assert n >= 11 and f'Fetched {n} record(s), next index: {n}' in err, err
+	assert list(int(row['index']) for row in csv_rows(tmp_path))[85:] == list(range(n))
+
+def test_fetch_parquet(tmp_path):
+	pq = pytest.importorskip('pyarrow.parquet')
+	sim_fill(tmp_path)
+	fetch(tmp_path) # same records to compare against
+	err = fetch(tmp_path, out=['-P', 'pq', '--from', '0'])
+	m = int((tmp_path / 'pq.state').read_text()) # 85 + ones stored during csv fetch
+	assert m >= 85 and f'Fetched {m} record(s), next index: {m}' in err, err
+	sim_fill(tmp_path, '3h')
+	err = fetch(tmp_path, out=['-P', 'pq'])
+	n = int((tmp_path / 'pq.state').read_text())
+	assert n > m + 11 and f'Fetched {n-m} record(s), next index: {n}' in err, err
+	assert sorted(p.name.split('.', 1)[1] for p in (tmp_path / 'pq').iterdir()) == [
+		f'0-{m}.parquet', f'{m}-{n}.parquet' ]
+	table = pq.read_table(tmp_path / 'pq').sort_by('index')
+	assert table.column_names == ['index', 'ts', 'time', 'ppm']
+	assert list(map(str, table.schema.types)) == ['uint32', 'uint32', 'timestamp[ms]', 'uint16']
+	assert table['index'].to_pylist() == list(range(n))
+	rows = list( [str(v) for v in row.values()]
+		for row in table.slice(0, 85).to_pylist() )
+	assert rows == list(list(row.values()) for row in csv_rows(tmp_path))
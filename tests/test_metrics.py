@@ -0,0 +1,105 @@
+import asyncio, random
+
+import pytest
+
+from conftest import load_script
+
+
+def metrics_ref(vals, buckets=20):
+	'Brute-force count/sum/min/max/log2-histogram of values, same as Metrics line'
+	hist = dict()
+	for v in vals: b = min(v.bit_length(), buckets - 1); hist[b] = hist.get(b, 0) + 1
+	return len(vals), sum(vals), min(vals), max(vals), hist
+
+def metrics_dump(co2log, mx, capsys):
+	capsys.readouterr(); mx.dump()
+	line, = capsys.readouterr().out.splitlines()
+	return line
+
+def metrics_set(co2log, monkeypatch):
+	monkeypatch.setattr(co2log.main, 'metrics', mx := co2log.main.Metrics())
+	return mx
+
+
+def test_metrics_add_dump(co2log, capsys):
+	mx, mxs, rng = co2log.main.Metrics(), load_script('metrics-stats'), random.Random(1)
+	vals = dict( uart_ms=[rng.randint(40, 300) for n in range(200)],
+		rtc_retries=[0] * 50 + [1, 3, 5], heap_free=[rng.randint(1, 3_000_000) for n in range(30)] )
+	for k, vs in vals.items():
+		for v in vs: mx.add(k, v)
+	co2log.sim.sim.vt = 3600.7
+	uptime, stats = mxs.parse_line(line := metrics_dump(co2log, mx, capsys))
+	assert line.startswith('-mx- 3600 uart_ms=') and uptime == 3600
+	assert stats == dict((k, metrics_ref(vs)) for k, vs in vals.items())
+	assert stats['rtc_retries'][4] == {0: 50, 1: 1, 2: 1, 3: 1}
+	assert max(stats['heap_free'][4]) == 19 # last bucket for anything larger
+
+	assert mxs.parse_line(metrics_dump(co2log, mx, capsys)) == (3600, dict()) # reset
+	mx.add('spi_bytes', 4000); mx.add('spi_bytes', 4000)
+	assert metrics_dump(co2log, mx, capsys) == '-mx- 3600 spi_bytes=2/8000/4000/4000/12:2'
+
+
+def test_stats_parse():
+	mxs = load_script('metrics-stats')
+	assert mxs.parse_line('some other line') is None
+	assert mxs.parse_line('[12:00] -mx- 73 epd_busy_ms=1/15020/15020/15020/14:1\n') == (
+		73, dict(epd_busy_ms=(1, 15020, 15020, 15020, {14: 1})) )
+	assert mxs.parse_line('-mx- 0') == (0, dict())
+
+@pytest.mark.parametrize('dist', ['uniform', 'expo', 'const'])
+def test_stats_percentiles(dist):
+	mxs, rng = load_script('metrics-stats'), random.Random(dist)
+	vals = dict( uniform=lambda: rng.randint(0, 5000),
+		expo=lambda: int(rng.expovariate(1/200)), const=lambda: 77 )[dist]
+	vals = sorted(vals() for n in range(3000))
+	count, vsum, vmin, vmax, hist = metrics_ref(vals)
+	for p in 0, 10, 50, 90, 99, 100:
+		v = vals[min(count - 1, int(p / 100 * count))]
+		a, z = mxs.bucket_range(min(v.bit_length(), 19))
+		est = mxs.hist_percentile(hist, count, vmin, vmax, p)
+		assert max(a, vmin) <= est <= min(z, vmax), [p, v, est] # within same bucket
+
+def test_stats_summary(co2log, capsys, tmp_path):
+	mx, mxs, rng = co2log.main.Metrics(), load_script('metrics-stats'), random.Random(2)
+	vals, lines = list(), list()
+	for n in range(5):
+		co2log.sim.sim.vt += 3593
+		for m in range(100): mx.add('uart_ms', v := rng.randint(50, 150 + 100 * n)); vals.append(v)
+		lines.append('console noise\n' + metrics_dump(co2log, mx, capsys) + '\n')
+	(p := tmp_path / 'co2log.txt').write_text(''.join(lines))
+
+	def summary(*args):
+		capsys.readouterr(); mxs.main([str(p), '-p', '50 90', *args])
+		out = capsys.readouterr().out.splitlines()
+		assert out[1].split() == 'metric count mean min max p50 p90'.split()
+		return out[0], out[2].split()
+	head, row = summary()
+	assert head == 'Intervals: 5'
+	assert row[:5] == ['uart_ms', '500', f'{sum(vals)/500:.1f}', str(min(vals)), str(max(vals))]
+	assert 64 <= float(row[5]) <= 255 and 128 <= float(row[6]) <= max(vals)
+	head, row = summary('-n', '1')
+	assert head == 'Intervals: 1' and row[:2] == ['uart_ms', '100']
+	assert row[4] == str(max(vals[-100:]))
+
+
+def test_rtc_retries(co2log, monkeypatch):
+	main, ms, mx = co2log.main, co2log.sim, metrics_set(co2log, monkeypatch)
+	co2log.board.i2c[0x68] = ms.DS3231Device(p_error=0.3)
+	rtc = main.RTC_DS3231(main.machine.I2C(0))
+	async def reads():
+		for n in range(20): await rtc.read(); await rtc.read_edge(); await asyncio.sleep(1.3)
+	co2log.run(reads())
+	n, st = mx.idx['rtc_retries'] * 4, mx.stats
+	assert st[n] == 40 and st[n+3] > 0
+	assert st[n+1] == ms.sim.stats['i2c_errors'] > 40 # read_edge poll errors counted too
+
+def test_epd_busy(co2log, monkeypatch):
+	main, mx = co2log.main, metrics_set(co2log, monkeypatch)
+	conf = main.CO2LogConf
+	co2log.board.epd.epd = epd = main.EPD_2in13_B_V4_Portrait()
+	co2log.run(epd.hw_init( main.machine.SPI(conf.screen_spi), dc=conf.screen_pin_dc,
+		cs=conf.screen_pin_cs, reset=conf.screen_pin_reset, busy=conf.screen_pin_busy ))
+	for n in range(3): co2log.run(epd.display())
+	n, st = mx.idx['epd_busy_ms'] * 4, mx.stats
+	assert st[n] == 3 # init/wake waits are not counted
+	assert st[n+2] == pytest.approx(15_000, abs=100) # --epd-refresh default
@@ -0,0 +1,76 @@
+import asyncio
+
+import pytest
+
+
+def clock_init(co2log, drift_ppm=0, **kw):
+	main, ms = co2log.main, co2log.sim
+	co2log.board.i2c[0x68] = dev = ms.DS3231Device(drift_ppm=drift_ppm)
+	rtc = main.RTC_DS3231(main.machine.I2C(0))
+	return main.RTCClock(rtc, **kw), dev
+
+def clock_syncs(co2log, clock, n, td=3593):
+	async def syncs():
+		await clock.sync()
+		for k in range(n):
+			await asyncio.sleep(td); await clock.sync()
+	co2log.run(syncs())
+
+
+def test_read_edge(co2log):
+	clock, dev = clock_init(co2log)
+	co2log.sim.sim.vt = 0.437
+	ts, tk = co2log.run(clock.rtc.read_edge())
+	assert ts == dev.ts() == co2log.sim.sim.ts_wall + 1
+	assert tk == pytest.approx(1000, abs=5) # within poll_ms after edge
+	ts, tk = co2log.run(clock.rtc.read_edge(skip_ms=900)) # skips to right before next edge
+	assert ts == co2log.sim.sim.ts_wall + 2 and tk == pytest.approx(2000, abs=5)
+	assert co2log.sim.sim.stats['i2c_reads'] < 300 + 30
+
+@pytest.mark.parametrize('drift_ppm', [0, 50, -120, 400])
+def test_clock_drift(co2log, drift_ppm):
+	clock, dev = clock_init(co2log, drift_ppm)
+	clock_syncs(co2log, clock, 24)
+	assert clock.rate == pytest.approx(1 + drift_ppm / 1e6, abs=2e-6)
+	assert clock.base_td > 24 * 3593_000
+	async def check():
+		await asyncio.sleep(1800.5)
+		return clock.time() - dev.ts()
+	assert co2log.run(check()) == 0
+
+def test_clock_jump(co2log):
+	clock, dev = clock_init(co2log, 50)
+	clock_syncs(co2log, clock, 4)
+	rate = clock.rate
+	dev.offset += 30 # RTC time gets set to a different value
+	co2log.run(clock.sync())
+	assert clock.rate == rate and clock.base_td == 0 # baseline restarted
+	assert clock.time() == dev.ts()
+	clock_syncs(co2log, clock, 4)
+	assert clock.rate == pytest.approx(1.00005, abs=2e-6)
+
+def test_clock_max_rate(co2log):
+	clock, dev = clock_init(co2log, 800) # beyond 500ppm rate limit
+	clock_syncs(co2log, clock, 4)
+	assert clock.rate == 1.0
+	assert clock.time() == dev.ts() # still synced on every read
+
+def test_set_alarm(co2log):
+	main, writes = co2log.main, list()
+	class I2C:
+		def writeto_mem(self, addr, reg, bs): writes.append((addr, reg, bytes(bs)))
+	main.RTC_DS3231(I2C()).set_alarm(1725745318) # 2024-09-07 21:41:58
+	assert writes == [
+		(0x68, 0x07, b'\x58\x41\x21\x07'), # ss mm hh dd in BCD, no mask bits
+		(0x68, 0x0e, b'\x1d'), (0x68, 0x0f, b'\x08') ]
+
+def test_deepsleep_alarm_sim(tmp_path):
+	# Cycle counter and totals should be kept over deepsleep resets
+	from conftest import run_sim
+	import re
+	stats, out = run_sim( '-t', '12h', '--seed', '1', conf='[storage]\nenabled = yes\n'
+		'[power]\nmode = deepsleep\nalarm-pin = 14\nverbose = yes\n', tmp_path=tmp_path )
+	assert int(stats['deepsleeps']) > 30
+	cycles = list(map(int, re.findall(r'\[power\] Cycle #(\d+):', out)))
+	assert cycles == list(range(1, len(cycles) + 1))
+	assert 'Traceback' not in out and 'ERROR' not in out
@@ -0,0 +1,58 @@
+import subprocess, time, sys, re
+
+import pytest
+
+from conftest import root
+
+
+def rtc_sync(tmp_path, *args, board=(), tz='UTC', code=0):
+	board_cmd = ' '.join([sys.executable, str(root / 'tests/fake_board.py'), *map(str, board)])
+	proc = subprocess.run( [ sys.executable, root / 'rtc-sync.py',
+			'-c', board_cmd, '--probes', '4', *map(str, args) ],
+		capture_output=True, text=True, timeout=120, cwd=tmp_path, env=dict(TZ=tz) )
+	assert proc.returncode == code, proc.stdout + proc.stderr
+	return proc.stdout, proc.stderr
+
+def offsets_ms(out):
+	return list(float(v.replace(',', '')) for v in re.findall(r'RTC offset ([-+][\d,.]+)ms', out))
+
+
+@pytest.mark.parametrize('tz, utc', [('UTC', False), ('Asia/Kathmandu', False), ('Asia/Kathmandu', True)])
+def test_set(tmp_path, tz, utc):
+	board = ['--offset', '-3723.4', '--drift', '50']
+	out, err = rtc_sync(tmp_path, *['-u']*utc, '-s', 'rtc.state', board=board, tz=tz)
+	offset, = re.findall(r'check offset: ([-+][\d,.]+)ms', out)
+	assert abs(float(offset)) < 20, out
+	assert int((tmp_path / 'rtc.state').read_text()) > 0
+	if utc: return # board RTC always emulates local time
+	out, err = rtc_sync(tmp_path, '-m', '-n', '2', '-i', '1', board=['--drift', '50'], tz=tz)
+	assert all(abs(v) < 20 for v in offsets_ms(out)), out
+
+def test_set_error(tmp_path):
+	out, err = rtc_sync( tmp_path, '-s', 'rtc.state',
+		board=['--offset', '2.5', '--read-only'], code=1 )
+	assert 'ERROR: RTC offset is above --max-error' in err, err
+	assert not (tmp_path / 'rtc.state').exists()
+
+def test_measure(tmp_path):
+	(tmp_path / 'rtc.state').write_text(f'{int(time.time()) - 86400}\n')
+	out, err = rtc_sync( tmp_path, '-m', '-n', '3', '-i', '2',
+		'-s', 'rtc.state', board=['--offset', '2.5', '--drift', '20000'] )
+	assert len(vs := offsets_ms(out)) == 3 and abs(vs[0] - 2500) < 20, out
+	drift, = re.findall(r'Drift over \d+s: ([-+][\d,.]+) ppm', out)
+	assert abs(float(drift.replace(',', '')) - 20000) < 1000, out
+	drift, offset = re.findall( r'Drift since last set 1\.0 days ago:'
+		r' ([-+][\d.]+) ppm \[offset=([-+][\d.]+)s\]', out )[0]
+	assert abs(float(offset) - vs[-1] / 1e3) < 0.002 and abs(float(drift) - vs[-1] / 86.4) < 1, out
+
+def test_pty(tmp_path):
+	board = subprocess.Popen( [ sys.executable, root / 'tests/fake_board.py',
+		'--pty', '--offset', '-1.3' ], stdout=subprocess.PIPE, text=True )
+	try:
+		pty = board.stdout.readline().strip()
+		proc = subprocess.run( [ sys.executable, root / 'rtc-sync.py', '-p', pty,
+				'--probes', '4', '-m', '-n', '1', '-r' ],
+			capture_output=True, text=True, timeout=60, cwd=tmp_path, env=dict(TZ='UTC') )
+		assert proc.returncode == 0, proc.stdout + proc.stderr
+		assert abs(offsets_ms(proc.stdout)[0] + 1300) < 20, proc.stdout
+	finally: board.kill(); board.wait()
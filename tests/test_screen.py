@@ -0,0 +1,212 @@
+import array, asyncio
+
+import pytest
+
+
+def run_for(co2log, coro, td):
+	try: co2log.run(coro, td)
+	except (asyncio.TimeoutError, TimeoutError): pass
+
+def scroller_init(co2log, cols=1):
+	main = co2log.main
+	epd, readings = main.EPD_2in13_B_V4_Portrait(), main.ReadingsQueue(columns=cols)
+	font = main.GlyphCache('-: CO2pmhd' + ''.join(main.CO2LogConf.ppm_thresholds.values()))
+	return epd, readings, font
+
+
+def test_queue_put_get(co2log):
+	main = co2log.main
+	queue, ppms = main.ReadingsQueue(size=4, columns=2), array.array('H', [0, 0])
+	for n in range(6): queue.put(1000 + n, [400 + n]) # missing column filled, 2 dropped
+	assert queue.dropped == 2
+	assert co2log.run(queue.get(ppms)) == 1002 and list(ppms) == [402, 402]
+	queue.put(1006, [500, 600])
+	vals = list((co2log.run(queue.get(ppms)), list(ppms)) for n in range(4))
+	assert vals[-1] == (1006, [500, 600]) and queue.is_empty()
+
+def test_queue_overflow_new(co2log):
+	main = co2log.main
+	queue, ppms = main.ReadingsQueue(size=2, overflow='new'), array.array('H', [0])
+	for n in range(4): queue.put(1000 + n, [70_000 if n else 400])
+	assert queue.dropped == 2
+	assert co2log.run(queue.get(ppms)) == 1000 and list(ppms) == [400]
+	assert co2log.run(queue.get(ppms)) == 1001 and list(ppms) == [0xffff]
+
+def test_queue_get_wait(co2log):
+	main = co2log.main
+	queue, ppms = main.ReadingsQueue(), array.array('H', [0])
+	async def put_later():
+		await asyncio.sleep(5); queue.put(1234, [567])
+	async def get():
+		asyncio.create_task(put_later())
+		return await queue.get(ppms), co2log.sim.sim.vt
+	assert co2log.run(get()) == (1234, 5.0)
+
+def test_log_scroller_restart(co2log):
+	# Restarted scroller should redraw exactly same screen from state ring
+	main = co2log.main
+	epd, readings, font = scroller_init(co2log)
+	state, ppm_msgs = list(), main.CO2LogConf.ppm_thresholds
+	scroller = lambda: main.co2_log_scroller( epd,
+		readings, font, font, refresh=lambda: None, ppm_msgs=ppm_msgs, state=state )
+	for n in range(40): readings.put(1725700000 + n * 600, [400 + n * 50])
+	run_for(co2log, scroller(), 10)
+	assert readings.is_empty()
+	li, ln, line_ts, line_red, line_ppms = state
+	assert ln == len(line_ts) < 40 and line_ts[(li + ln - 1) % ln] == 1725700000 + 39 * 600
+	bufs = bytes(epd.black_buff), bytes(epd.red_buff)
+	for buff in epd.black, epd.red: buff.fill(0)
+	run_for(co2log, scroller(), 10)
+	assert (bytes(epd.black_buff), bytes(epd.red_buff)) == bufs
+	readings.put(1725700000 + 40 * 600, [1000])
+	run_for(co2log, scroller(), 10) # with restart and one more line
+	assert state[0] == (li + 1) % ln and bytes(epd.black_buff) != bufs[0]
+
+def test_log_scroller_columns(co2log):
+	# Columns that don't fit with threshold labels should wrap into more rows per line
+	main = co2log.main
+	lines = dict()
+	for cols in 1, 2, 3:
+		epd, readings, font = scroller_init(co2log, cols)
+		state = list()
+		for n in range(3): readings.put(1725700000 + n * 600, [2500, 1500, 900][:cols])
+		run_for(co2log, main.co2_log_scroller( epd, readings, font, font,
+			refresh=lambda: None, ppm_msgs=main.CO2LogConf.ppm_thresholds, state=state ), 10)
+		lines[cols] = len(state[2])
+		# Nothing should be drawn past visible width below header, except for its hline
+		for buff in epd.black, epd.red:
+			assert not any(not buff.pixel(x, y) for x in range(122, epd.w) for y in range(16, epd.h))
+	assert (lines[2], lines[3]) == (lines[1] // 2, lines[1] // 3) # (250 - 16) // (10 * rows)
+
+def test_rollup_median(co2log):
+	rollup = co2log.main.ReadingsRollup(3600, 4)
+	for n in range(16): rollup.add(n, 400)
+	for n in range(44): rollup.add(100 + n, 2000)
+	assert rollup.stats(0) == (400, 2000, 2000)
+	rollup.add(3600, 800) # new bucket
+	assert rollup.steps == 2 and rollup.stats(0) == (800, 800, 800)
+	assert rollup.stats(1) == (400, 2000, 2000)
+	for n, v in enumerate([650, 900, 1500, 420, 1010, 700]): rollup.add(3601 + n, v)
+	assert rollup.stats(0) == (420, 805, 1500) # 800 bin center, actual median_low=800
+	rollup.add(3600 * 6, 500) # skips 4 buckets, overwriting all old ones
+	assert rollup.steps == 7 and list(rollup.stats(k)[2] for k in range(4)) == [500, 0, 0, 0]
+
+def test_graph_scroller_rollups(co2log):
+	main = co2log.main
+	rollups = dict(hourly=main.ReadingsRollup(3600, 64), daily=main.ReadingsRollup(86400, 64))
+	epd, readings, font = scroller_init(co2log)
+	readings.rollups = tuple(rollups.values())
+	ts0 = 1725700000 // 86400 * 86400
+	for n in range(12): readings.put(ts0 + n * 1200, [400 + n * 100]) # 4h
+	assert rollups['daily'].stats(0) == (400, 905, 1500) # 10ppm histogram bin centers
+	assert list(rollups['hourly'].stats(k) for k in range(4)) == [
+		(1300, 1405, 1500), (1000, 1105, 1200), (700, 805, 900), (400, 505, 600) ]
+	graph = lambda restart=False: main.co2_graph_scroller( epd, readings,
+		rollups['hourly'], ' CO2 1h', font, refresh=lambda: None, restart=restart )
+	run_for(co2log, graph(), 10)
+	bufs = bytes(epd.black_buff), bytes(epd.red_buff)
+	for buff in epd.black, epd.red: buff.fill(0)
+	run_for(co2log, graph(restart=True), 10)
+	# Header only gets drawn on next reading after restart, rows should be same
+	assert (bytes(epd.black_buff)[16*16:], bytes(epd.red_buff)[16*16:]) == (
+		bufs[0][16*16:], bufs[1][16*16:] )
+
+
+def sched_run(co2log, reqs, td, restart=False, refresh_td=15, **kw):
+	'''Runs RefreshScheduler with fake epd for td seconds, calling request() at reqs times,
+		returning scheduler and list of (start, end) virtual times of epd.display() calls.'''
+	sim, refreshes = co2log.sim.sim, list()
+	class EPD:
+		async def display(self):
+			vt0 = sim.vt; await asyncio.sleep(refresh_td); refreshes.append((vt0, sim.vt))
+	sched = co2log.main.RefreshScheduler(EPD(), **kw)
+	async def requests():
+		vt0, task = sim.vt, asyncio.create_task(sched.run(restart))
+		for vt in reqs: await asyncio.sleep(vt0 + vt - sim.vt); sched.request()
+		await asyncio.sleep(vt0 + td - sim.vt); task.cancel()
+		return vt0
+	vt0 = co2log.run(requests())
+	return sched, list((round(a - vt0, 1), round(b - vt0, 1)) for a, b in refreshes)
+
+def test_refresh_batch(co2log):
+	sched, refreshes = sched_run(co2log, [0, 2, 4, 7], 100, td_batch=5)
+	assert refreshes == [(12, 27)] # 5s after last request
+	assert (sched.n_refresh, sched.n_merged, sched.n_deferred) == (1, 3, 0)
+	assert not sched.busy()
+
+def test_refresh_stale(co2log):
+	sched, refreshes = sched_run( co2log, range(0, 100, 3), 300,
+		td_min=100, td_batch=5, td_stale=60 )
+	# Requests every 3s never allow batch delay to pass, and ones after start of the
+	#  first refresh are stale by then, so second one is only delayed by td_min
+	assert refreshes == [(60, 75), (175, 190)]
+	assert sched.n_refresh == 2 and sched.n_deferred == 1
+
+def test_refresh_min_interval(co2log):
+	sched, refreshes = sched_run( co2log, [0, 30, 40, 450],
+		600, td_min=180, td_batch=5, td_stale=60 )
+	# Second refresh is deferred until td_min after end of the first one, third is not
+	assert refreshes == [(5, 20), (200, 215), (455, 470)]
+	assert (sched.n_refresh, sched.n_merged, sched.n_deferred) == (3, 1, 1)
+
+def test_refresh_merged_in_progress(co2log):
+	sched, refreshes = sched_run( co2log, [0, 10], 300,
+		td_min=20, td_batch=5, td_stale=60, refresh_td=15 )
+	assert refreshes == [(5, 20), (40, 55)] # request made during refresh is not lost
+	sched, refreshes = sched_run(co2log, [], 100, restart=True, td_batch=5)
+	assert refreshes == [(5, 20)] and sched.n_refresh == 1 # failed refresh gets redone
+
+
+def fb_new(co2log, w=128, h=64):
+	fb = co2log.main.framebuf.FrameBuffer(buff := bytearray(w * h // 8), w, h, 3)
+	fb.fill(1); return fb, buff
+
+def test_glyph_blit(co2log):
+	# Cached glyphs should draw same pixels as FrameBuffer.text() and per-pixel scaling
+	font = co2log.main.GlyphCache(':-CO2')
+	(fb1, b1), (fb2, b2) = fb_new(co2log), fb_new(co2log)
+	assert font.text(fb1, '12:34 CO2-', 3, 5) == 3 + 10*8
+	fb2.text('12:34 CO2-', 3, 5, 0)
+	assert b1 == b2
+	fb1.fill(1); fb2.fill(1)
+	font.num(fb1, 78, 4, 0, 20, pad=False); font.num(fb1, 905, 5, 0, 30)
+	fb2.text('  78', 0, 20, 0); fb2.text('00905', 0, 30, 0)
+	assert b1 == b2
+	font2 = co2log.main.GlyphCache(':', scale=(2, 3))
+	(fb1, b1), (fb2, b2), (fb3, b3) = fb_new(co2log), fb_new(co2log), fb_new(co2log)
+	assert (font2.w, font2.h) == (16, 24)
+	font2.text(fb1, '09:', 1, 2)
+	fb3.text('09:', 0, 0, 0)
+	for y in range(8):
+		for x in range(24):
+			if not fb3.pixel(x, y): fb2.fill_rect(1 + x*2, 2 + y*3, 2, 3, 0)
+	assert b1 == b2
+
+def font_file(path, w=6, h=10, c0=ord('0'), chars=11, magic=b'CO2F', trunc=0):
+	import random, struct
+	rng, gsz = random.Random(1), (w + 7) // 8 * h
+	glyphs = bytes(rng.randrange(256) & (0xff << (8 - w % 8 if w % 8 else 0)) for n in range(chars * gsz))
+	path.write_bytes((struct.pack('<4sBBBB', magic, w, h, c0, chars) + glyphs)[:-trunc or None])
+	return glyphs, gsz
+
+def test_glyph_font_file(co2log, tmp_path):
+	glyphs, gsz = font_file(p := tmp_path / 'font.bin') # 0-9 and ":"
+	font = co2log.main.GlyphCache(':xyz', font_file=p)
+	assert (font.w, font.h) == (6, 10) and set(font.glyphs) == set('0123456789:')
+	fb, buff = fb_new(co2log)
+	font.text(fb, '7:', 10, 3)
+	for n, c in enumerate('7:'):
+		g, k = glyphs[(ord(c) - ord('0')) * gsz:][:gsz], 10 + n * 6
+		for y in range(10):
+			for x in range(6): assert fb.pixel(k + x, 3 + y) == (not g[y] & (0x80 >> x)), (c, x, y)
+
+def test_glyph_font_file_errors(co2log, tmp_path):
+	GlyphCache, p = co2log.main.GlyphCache, tmp_path / 'font.bin'
+	for kws, err in [
+			(dict(trunc=11*10 + 1), 'header truncated'),
+			(dict(magic=b'FONT'), 'magic mismatch'),
+			(dict(trunc=3), r'truncated: .* \[107 < 11 glyphs x 10B\]'),
+			(dict(c0=ord('2')), r'missing digit glyph\(s\): .* \[01\]'),
+			(dict(chars=9), r'missing digit glyph\(s\): .* \[9\]') ]:
+		font_file(p, **kws)
+		with pytest.raises(ValueError, match=err): GlyphCache(':', font_file=p)
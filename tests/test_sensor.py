@@ -0,0 +1,126 @@
+import random, re
+
+import pytest
+
+
+def mhz19_init(co2log, ppm='const:812', **kw):
+	ms = co2log.sim
+	co2log.board.uarts[0] = dev = ms.MHZ19Device(ms.ppm_func(ppm), **kw)
+	return co2log.main.MHZ19(co2log.main.machine.UART(0)), dev
+
+def mhz19_frame(dev, ppm):
+	return bytes(dev._frame(0x86, bytes([ppm >> 8, ppm & 0xff, 0x40, 0, 0, 0])))
+
+def agg_ref(vs, mode, trim=0.25, ema=0.3, mad=0):
+	'Brute-force version of SampleAgg.value() from all samples'
+	if not vs: return
+	if mad and len(vs) >= 3:
+		med = sorted(vs)[len(vs) // 2]
+		lim = mad * max(1, 1.4826 * sorted(abs(v - med) for v in vs)[len(vs) // 2])
+		vs = list(v for v in vs if abs(v - med) <= lim)
+	srt = sorted(vs)
+	if mode == 'median': return srt[len(srt) // 2]
+	if mode == 'ema':
+		e = vs[0]
+		for v in vs[1:]: e += ema * (v - e)
+		return round(e)
+	if mode == 'trimmed-mean':
+		t = min(int(len(srt) * trim), (len(srt) - 1) // 2)
+		srt = srt[t:len(srt)-t]
+	return round(sum(srt) / len(srt))
+
+
+@pytest.mark.parametrize('mode', ['median', 'mean', 'trimmed-mean', 'ema'])
+@pytest.mark.parametrize('mad', [0, 2])
+def test_sample_agg(co2log, mode, mad):
+	rng, kws = random.Random(1), dict(trim=0.2, ema=0.4, mad=mad)
+	agg = co2log.main.SampleAgg(size := 9, mode, **kws)
+	assert agg.value() is None
+	for n in range(300):
+		agg.reset()
+		vs = list(rng.randint(400, 1200) for k in range(rng.randint(1, size)))
+		if rng.random() < 0.3: vs = list(v if rng.random() < 0.8 else v * 3 for v in vs)
+		if rng.random() < 0.3: vs = list(vs[0] + rng.randint(-3, 3) for v in vs) # near-constant
+		for v in vs: agg.add(v)
+		assert agg.value() == agg_ref(vs, mode, **kws), vs
+		assert list(agg.srt[:len(vs)]) == sorted(vs)
+	agg.reset(); agg.add(777)
+	assert agg.value() == 777 # single sample
+	agg.reset()
+	assert agg.value() is None
+
+def test_sample_agg_outliers(co2log):
+	for mode in 'median', 'mean', 'trimmed-mean', 'ema':
+		agg = co2log.main.SampleAgg(5, mode, mad=3)
+		for v in 800, 805, 5000, 798, 802: agg.add(v) # one garbage sample
+		assert 798 <= agg.value() <= 805, mode
+
+def test_sample_agg_conf(co2log):
+	with pytest.raises(ValueError): co2log.main.SampleAgg(3, 'mode')
+	with pytest.raises(ValueError): co2log.main.SampleAgg(3, 'trimmed-mean', trim=0.5)
+
+def test_read(co2log):
+	mhz19, dev = mhz19_init(co2log)
+	assert list(co2log.run(mhz19.read_ppm()) for n in range(3)) == [812] * 3
+	assert co2log.sim.sim.stats['uart_ppm_reqs'] == 3
+
+def test_read_garbage(co2log):
+	mhz19, dev = mhz19_init(co2log, p_garbage=1)
+	assert list(co2log.run(mhz19.read_ppm()) for n in range(20)) == [812] * 20
+
+def test_read_corrupt_drop(co2log):
+	mhz19, dev = mhz19_init(co2log, p_corrupt=1)
+	assert co2log.run(mhz19.read_ppm()) is None # checksum mismatch, never a wrong value
+	mhz19, dev = mhz19_init(co2log, p_drop=1)
+	vt0 = co2log.sim.sim.vt
+	assert co2log.run(mhz19.read_ppm(timeout_ms=500)) is None
+	assert co2log.sim.sim.vt - vt0 == pytest.approx(0.5, abs=0.02)
+
+@pytest.mark.parametrize('prefix', [
+	b'\xff', b'\xff\x86', b'\xff\x86\x01\x02', b'\x00\xff\xff\x86\x03\x20\xff',
+	b'\xff\x86\x03\x20\x40\x00\x00\x00\x00', # bad checksum, overlapping with real frame
+	b'\x01' * 30 ])
+def test_read_resync(co2log, prefix):
+	mhz19, dev = mhz19_init(co2log, latency=0.2)
+	dev.write = lambda bs, write=dev.write: (write(bs), dev.rx.extend(
+		(co2log.sim.sim.vt + 0.1 + n * dev.byte_td, b) for n, b in enumerate(prefix) ))
+	dev.rx.sort(key=lambda vt_b: vt_b[0])
+	assert co2log.run(mhz19.read_ppm()) == 812
+
+def test_read_stale_data(co2log):
+	mhz19, dev = mhz19_init(co2log, ppm='const:900')
+	dev.rx.extend((0, b) for b in mhz19_frame(dev, 1234)[:5] + mhz19_frame(dev, 555))
+	assert co2log.run(mhz19.read_ppm()) == 900 # stale response bytes are dropped
+
+def test_sim_heap(tmp_path):
+	# Main script heap use should not grow between readings, with all kinds of UART faults
+	from conftest import root
+	import subprocess, sys
+	(conf := tmp_path / 'config.ini').write_text('[sensor]\ninterval = 60\n')
+	proc = subprocess.run( [ sys.executable, root / 'main-sim.py', '-c', conf,
+		'-t', '100m', '--seed', '1', '--tracemalloc',
+		'--uart-garbage', '0.3', '--uart-corrupt', '0.1', '--uart-drop', '0.05' ],
+		capture_output=True, text=True, timeout=300 )
+	assert proc.returncode == 0, proc.stderr
+	m = re.search(r'heap \[main script\]: .*? \[([-+\d.,]+)B/reading', proc.stderr)
+	assert m and abs(float(m[1])) < 16, proc.stderr
+
+def test_sim_interval_median_reads(tmp_path):
+	# Interval is between datapoints, and already includes median-read-delays time
+	from conftest import run_sim
+	st, out = run_sim( '-t', '1d', '--seed', '1', tmp_path=tmp_path,
+		conf='[sensor]\ninterval = 600\nmedian-read-delays = 20 20 10 10\n' )
+	assert 142 <= int(st['readings']) <= 144 # 86400 - 210s init delay
+
+def test_sim_interval_adaptive(tmp_path):
+	# Fewer sensor wakeups per day with stable readings, down to interval-min on changes
+	from conftest import run_sim
+	conf = '[sensor]\nverbose = yes\ninterval = 1021\nmedian-read-delays = 20 20 10 10\n'
+	st_fixed, out = run_sim('-t', '2d', '--seed', '1', tmp_path=tmp_path, conf=conf)
+	st, out = run_sim( '-t', '2d', '--seed', '1', tmp_path=tmp_path, conf=conf
+		+ 'interval-adapt-rate = 200\ninterval-min = 240\ninterval-max = 3600\n' )
+	wakeups, wakeups_fixed = (int(s['cmds']) for s in (st, st_fixed)) # uart commands
+	assert wakeups < wakeups_fixed * 0.8, [wakeups, wakeups_fixed]
+	intervals = set( float(v.replace(',', ''))
+		for v in re.findall(r'\[sensor\] interval: ([\d,.]+)s', out) )
+	assert min(intervals) == 240 and max(intervals) == 3600, intervals
@@ -0,0 +1,38 @@
+import subprocess, itertools as it, sys, re
+
+import pytest
+
+from conftest import root, run_sim
+
+
+def test_relative_paths(tmp_path):
+	(tmp_path / 'c.ini').write_text('[storage]\nenabled = yes\n')
+	for d in [], ['-d', 'sim']: # -o path is relative to cwd, not -d or temp dir
+		proc = subprocess.run( [ sys.executable, root / 'main-sim.py',
+			'-c', 'c.ini', '-o', 'out.txt', '-t', '1h', *d ],
+			capture_output=True, text=True, timeout=120, cwd=tmp_path )
+		assert proc.returncode == 0, proc.stderr
+		assert '--- CO2Log start ---' in (tmp_path / 'out.txt').read_text()
+		(tmp_path / 'out.txt').unlink()
+	assert (tmp_path / 'sim/co2log.0.bin').exists() and not (tmp_path / 'sim/out.txt').exists()
+
+def boot_timeline(out):
+	assert out.count('--- CO2Log boot timeline ---') == 1, out
+	lines = out.split('--- CO2Log boot timeline ---\n', 1)[1].splitlines()
+	marks = list(re.findall(r'^  (\S+) +([\d,]+)ms \[\+([\d,]+)ms\] mem-free=[\d,]+B$', line) for line in lines)
+	return list( (phase, int(tk.replace(',', '')), int(td.replace(',', '')))
+		for phase, tk, td in (m[0] for m in it.takewhile(bool, marks)) )
+
+@pytest.mark.parametrize('sensor', [True, False])
+def test_boot_timeline(tmp_path, sensor):
+	st, out = run_sim( '-t', '1h', '--seed', '1', tmp_path=tmp_path,
+		conf='' if sensor else '[sensor]\nenabled = no\n' )
+	marks = boot_timeline(out)
+	phases = list(phase for phase, tk, td in marks)
+	if sensor:
+		assert phases in ( ['import', 'conf', 'hw-init', 'rtc-sync', 'start', 'reading'],
+			['import', 'conf', 'hw-init', 'rtc-sync', 'start', 'clear', 'reading'] ), phases
+		assert marks[-1][1] >= 210_000 # after sensor preheat delay
+	else: assert phases == ['import', 'conf', 'hw-init', 'start'], phases
+	tk0 = 0
+	for phase, tk, td in marks: assert tk >= tk0 and td == tk - tk0; tk0 = tk
@@ -0,0 +1,66 @@
+import struct, os
+
+
+def rlog_new(main, **kw):
+	kw = dict(dict(path='rlog', segments=3, segment_records=8), **kw)
+	(rlog := main.ReadingsLog(**kw)).open()
+	return rlog
+
+def rlog_read(rlog, idx, n=64): # read_into only returns records up to segment end
+	buff = bytearray(n * rlog.rec_sz)
+	n = rlog.read_into(idx, buff)
+	return list(struct.iter_unpack(rlog.rec_fmt, buff[:n*rlog.rec_sz]))
+
+
+def test_append_read(co2log):
+	rlog = rlog_new(co2log.main)
+	assert (rlog.index(), rlog.index_first()) == (0, 0)
+	for n in range(5): rlog.append(1000 + n, 400 + n)
+	assert rlog.index() == 5
+	assert rlog_read(rlog, 0) == list((1000 + n, 400 + n) for n in range(5))
+	assert rlog_read(rlog, 3) == [(1003, 403), (1004, 404)]
+	assert rlog_read(rlog, 5) == []
+	assert rlog_read(rlog, 1, n=2) == [(1001, 401), (1002, 402)]
+	rlog.append(1005, 70_000) # clamped to uint16
+	assert rlog_read(rlog, 5) == [(1005, 0xffff)]
+
+def test_segment_rotation(co2log):
+	rlog = rlog_new(co2log.main)
+	for n in range(8 * 3 + 5): rlog.append(1000 + n, 400 + n)
+	assert rlog.index() == 29
+	assert rlog.index_first() == 8 # segments are seq=3 (current, seg=0), 1 and 2
+	assert sorted(f for f in os.listdir() if f.startswith('rlog.')) == [
+		'rlog.0.bin', 'rlog.1.bin', 'rlog.2.bin' ]
+	assert all(os.stat(f'rlog.{n}.bin').st_size == rlog.seg_sz for n in range(3))
+	assert rlog_read(rlog, 0) == rlog_read(rlog, 7) == [] # overwritten
+	assert rlog_read(rlog, 8) == list((1000 + n, 400 + n) for n in range(8, 16))
+	assert rlog_read(rlog, 20) == list((1000 + n, 400 + n) for n in range(20, 24))
+	assert rlog_read(rlog, 24) == list((1000 + n, 400 + n) for n in range(24, 29))
+
+def test_reopen_resume(co2log):
+	rlog = rlog_new(co2log.main)
+	for n in range(11): rlog.append(1000 + n, 400 + n)
+	rlog.close()
+	rlog = rlog_new(co2log.main)
+	assert (rlog.index(), rlog.index_first()) == (11, 0)
+	rlog.append(2000, 500)
+	assert rlog_read(rlog, 8) == [(1008, 408), (1009, 409), (1010, 410), (2000, 500)]
+	for n in range(4): rlog.append(2001 + n, 501 + n) # fills 2nd segment exactly
+	rlog.close()
+	rlog = rlog_new(co2log.main)
+	assert rlog.index() == 16
+	rlog.append(3000, 600) # rotates to 3rd one
+	assert rlog.index() == 17 and rlog.seg == 2
+
+def test_reopen_mismatch(co2log):
+	rlog = rlog_new(co2log.main)
+	for n in range(3): rlog.append(1000 + n, 400 + n)
+	rlog.close()
+	# Different record size (columns) or segment size discards old segments
+	rlog = rlog_new(co2log.main, columns=2)
+	assert rlog.index() == 0
+	rlog.append(1100, 400, 410)
+	assert rlog_read(rlog, 0) == [(1100, 400, 410)]
+	rlog.close()
+	rlog = rlog_new(co2log.main, columns=2, segment_records=16)
+	assert rlog.index() == 0
@@ -0,0 +1,48 @@
+import pytest
+
+from conftest import run_sim
+
+
+def component(co2log, fails, log):
+	'Returns start(restart) func for component failing on first "fails" runs'
+	asyncio, sim, runs = co2log.sim.asyncio, co2log.sim.sim, list()
+	async def start(restart):
+		log.append(('start', restart, sim.vt)); runs.append(restart)
+		await asyncio.sleep(1)
+		if len(runs) <= fails: raise RuntimeError(f'fail #{len(runs)}')
+		return 'done'
+	return start
+
+def test_restart_backoff(co2log, capsys):
+	sup, log = co2log.main.Supervisor(backoff_min=5, backoff_max=12), list()
+	async def reinit(): log.append(('reinit', co2log.sim.sim.vt))
+	sup.add('test', component(co2log, 3, log), reinit)
+	vt0 = co2log.sim.sim.vt
+	assert co2log.run(sup.run()) == ['done']
+	starts = list((e[1], round(e[2] - vt0)) for e in log if e[0] == 'start')
+	assert starts == [(False, 0), (True, 6), (True, 17), (True, 30)] # 5s, 10s, 12s max
+	assert list(e[0] for e in log) == ['start'] + ['reinit', 'start']*3
+	assert capsys.readouterr().out.count('Component test failed') == 3
+
+def test_max_failures(co2log, capsys):
+	sup, log, log_other = co2log.main.Supervisor(max_failures=2, backoff_min=1), list(), list()
+	sup.add('test', component(co2log, 10, log))
+	async def other(restart):
+		try: await co2log.sim.asyncio.sleep(3600)
+		except BaseException as err: log_other.append(err); raise
+	sup.add('other', other)
+	with pytest.raises(RuntimeError, match='fail #3'): co2log.run(sup.run())
+	assert len(log) == 3 and len(log_other) == 1 # other component gets cancelled
+	assert capsys.readouterr().out.count('Component test failed [') == 2
+
+def test_failure_window(co2log):
+	sup, log = co2log.main.Supervisor(max_failures=1, window=60, backoff_min=100), list()
+	sup.add('test', component(co2log, 3, log)) # failures are 100s+ apart, never 2 within window
+	assert co2log.run(sup.run()) == ['done'] and len(log) == 4
+
+def test_sim_uart_outage(tmp_path):
+	st, out = run_sim( '-t', '1d', '--seed', '1', '--uart-outage', '6h:1h',
+		conf='[supervisor]\nbackoff-min = 60\n', tmp_path=tmp_path )
+	assert 'Component sensor failed' in out
+	assert 'One of the main components failed' not in out
+	assert int(st['readings']) > 80 # keeps going after outage